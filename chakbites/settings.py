@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'crispy_forms',
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'core',
 ]
@@ -58,7 +60,8 @@ CORS_ALLOWED_ORIGINS = [
 # Add to your settings.py
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWT without a user query per request; see core/auth.py
+        'core.auth.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
@@ -80,6 +83,11 @@ SIMPLE_JWT = {
     'SIGNING_KEY': SECRET_KEY,
 }
 
+# core.auth doesn't load the user per request. Logouts, deactivations and
+# staff changes are stored as revocations that each worker reads at most
+# this often, so they take up to this long to reach the other workers.
+JWT_REVOCATION_POLL_SECONDS = 5
+
 # CSRF settings
 CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 CSRF_COOKIE_HTTPONLY = False
@@ -87,6 +95,7 @@ CSRF_COOKIE_SAMESITE = 'Lax'
 
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',  # First, so it times everything below it
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -116,6 +125,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chakbites.wsgi.application'
+# The order event stream holds connections open, so serve it through ASGI
+ASGI_APPLICATION = 'chakbites.asgi.application'
 
 
 # Database
@@ -134,6 +145,108 @@ DATABASES = {
 
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; set REDIS_URL in production to share the cache and
+# the order event broker between workers. Running several workers without it
+# leaves each with its own menu version (see core/menu_cache.py), so a menu
+# edit only shows up on the worker that made it.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chakbites',
+    }
+}
+
+# Order status push channel (see core/events.py)
+ORDER_EVENTS_BROKER = {
+    'BACKEND': 'core.events.InProcessBroker',
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+    ORDER_EVENTS_BROKER = {
+        'BACKEND': 'core.events.RedisBroker',
+        'OPTIONS': {'url': os.environ['REDIS_URL']},
+    }
+
+
+# Logging: job and image logs, plus likely N+1 queries from core.middleware.
+# Its line per request is logged at DEBUG; set REQUEST_LOG_LEVEL=DEBUG to see it.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': 'INFO'},
+        'core.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+
+# Email (sent from background jobs; see core/tasks.py)
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Use SMTP in production
+DEFAULT_FROM_EMAIL = 'ChakBites <orders@chakbites.com>'
+
+
+# Delivered and cancelled orders older than this move to the archive tables
+# when `manage.py archive_orders` runs (see core/archive.py)
+ORDER_ARCHIVE_AFTER_DAYS = 180
+
+# `manage.py purge_carts` deletes checked-out carts, empty carts idle for this
+# many hours and abandoned carts idle for this many days (see core/carts.py)
+CART_EMPTY_EXPIRY_HOURS = 24
+CART_IDLE_EXPIRY_DAYS = 30
+
+
+# Delivery fees and ETAs (see core/delivery.py). An address is in the first
+# zone with one of its keywords, e.g.
+#   {'name': 'Gulberg', 'keywords': ['gulberg'], 'fee': 50, 'travel_minutes': 15}
+# and in DEFAULT_ZONE otherwise.
+DELIVERY = {
+    'ZONES': [],
+    'DEFAULT_ZONE': {'name': 'Standard', 'fee': 50, 'travel_minutes': 20},
+    'KITCHEN_STATIONS': 3,  # Orders prepared side by side
+    'QUEUE_REFRESH_SECONDS': 10,
+    'SAMPLE_SIZE': 200,  # Recent prep and delivery durations each estimate learns from
+}
+
+
+# Password hashing
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+# The first hasher makes new hashes, and older hashes are upgraded to it on
+# the next login. For a more parallel hasher put e.g. ScryptPasswordHasher or
+# Argon2PasswordHasher (needs argon2-cffi) first.
+
+PASSWORD_HASHERS = [
+    'core.hashing.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+# OWASP's recommendation for PBKDF2-SHA256; Django's own default is 1,000,000
+PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600_000))
+
+# Logins and registrations hash on this pool (see core/hashing.py); requests
+# beyond WORKERS + BACKLOG get a 429 instead of waiting. WORKERS defaults to
+# the number of CPUs.
+PASSWORD_HASHING_POOL = {
+    'WORKERS': None,
+    'BACKLOG': 4,
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UserProfile, Pizza, Topping, Cart, CartItem, Order, OrderItem
+from .models import UserProfile, Pizza, Topping, Cart, CartItem, Order, OrderItem, ArchivedOrder, Job
 
 admin.site.register(UserProfile)
 admin.site.register(Pizza)
@@ -7,4 +7,6 @@ admin.site.register(Topping)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(Order)
-admin.site.register(OrderItem)
\ No newline at end of file
+admin.site.register(OrderItem)
+admin.site.register(ArchivedOrder)
+admin.site.register(Job)
\ No newline at end of file
@@ -0,0 +1,321 @@
+"""Sales rollups for the analytics API.
+
+Hourly rows are rebuilt from Order/OrderItem, plus their archived copies,
+only for the hours that hold orders created or changed since the last
+watermark; daily rows are then summed from the hourly ones. Reports read
+the rollup tables and never scan order history. ``export_history`` is the
+escape hatch for ad-hoc questions: it loads the raw rows of a date range
+into NumPy arrays and aggregates them there instead of in the database.
+"""
+import itertools
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import (
+    AnalyticsWatermark, ArchivedOrder, ArchivedOrderItem, Order, OrderItem, PizzaSalesRollup, SalesRollup,
+    ToppingRollup
+)
+
+WATERMARK = 'sales_rollups'
+# Re-read a little before the watermark, so orders committed late still get counted
+OVERLAP = timedelta(minutes=5)
+PERIODS_PER_QUERY = 50
+EPOCH = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+CANCELLED = Q(status='C')
+
+
+def _hour_filter(hours, field):
+    condition = Q()
+    for hour in hours:
+        condition |= Q(**{f'{field}__gte': hour, f'{field}__lt': hour + timedelta(hours=1)})
+    return condition
+
+
+def _combine(rows, keys):
+    # Add up aggregate rows that share the same ``keys``
+    combined = {}
+    for row in rows:
+        key = tuple(row[name] for name in keys)
+        if key not in combined:
+            combined[key] = dict(row)
+            continue
+        for name, value in row.items():
+            if name not in keys:
+                combined[key][name] = (combined[key][name] or 0) + (value or 0)
+    return list(combined.values())
+
+
+def _rebuild_hours(hours):
+    """Replace the hourly rollups for ``hours`` with fresh aggregates."""
+    SalesRollup.objects.filter(granularity=SalesRollup.HOUR, period_start__in=hours).delete()
+    PizzaSalesRollup.objects.filter(granularity=SalesRollup.HOUR, period_start__in=hours).delete()
+    ToppingRollup.objects.filter(granularity=SalesRollup.HOUR, period_start__in=hours).delete()
+
+    # An old hour can hold both live and archived orders, so read both sides and add them up
+    orders, items, toppings = [], [], []
+    for order_model, item_model in ((Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)):
+        orders += (
+            order_model.objects.filter(_hour_filter(hours, 'created_at'))
+            .annotate(period=TruncHour('created_at'))
+            .values('period')
+            .annotate(
+                orders=Count('id', filter=~CANCELLED),
+                cancelled_orders=Count('id', filter=CANCELLED),
+                revenue=Sum('total_amount', filter=~CANCELLED),
+                delivery_fees=Sum('delivery_fee', filter=~CANCELLED)
+            )
+        )
+        items += (
+            item_model.objects.filter(_hour_filter(hours, 'order__created_at'))
+            .exclude(order__status='C')
+            .annotate(period=TruncHour('order__created_at'))
+            .values('period', 'pizza_id', 'size')
+            .annotate(quantity=Sum('quantity'), revenue=Sum('price'))
+        )
+        item = item_model.toppings.field.m2m_field_name()  # orderitem / archivedorderitem
+        toppings += (
+            item_model.toppings.through.objects.filter(_hour_filter(hours, f'{item}__order__created_at'))
+            .exclude(**{f'{item}__order__status': 'C'})
+            .annotate(period=TruncHour(f'{item}__order__created_at'))
+            .values('period', 'topping_id')
+            .annotate(pizzas=Sum(f'{item}__quantity'))
+        )
+    orders = _combine(orders, ['period'])
+    items = _combine(items, ['period', 'pizza_id', 'size'])
+    toppings = _combine(toppings, ['period', 'topping_id'])
+
+    # Items of a deleted pizza still count towards pizzas sold, but have no pizza to roll up under
+    pizza_rows = [
+        PizzaSalesRollup(granularity=SalesRollup.HOUR, period_start=row['period'], pizza_id=row['pizza_id'],
+                         size=row['size'], quantity=row['quantity'], revenue=row['revenue'])
+        for row in items
+        if row['pizza_id'] is not None
+    ]
+    pizzas_sold = {}
+    for row in items:
+        pizzas_sold[row['period']] = pizzas_sold.get(row['period'], 0) + row['quantity']
+
+    SalesRollup.objects.bulk_create([
+        SalesRollup(granularity=SalesRollup.HOUR, period_start=row['period'], orders=row['orders'],
+                    cancelled_orders=row['cancelled_orders'], pizzas_sold=pizzas_sold.get(row['period'], 0),
+                    revenue=row['revenue'] or 0, delivery_fees=row['delivery_fees'] or 0)
+        for row in orders
+    ])
+    PizzaSalesRollup.objects.bulk_create(pizza_rows)
+    ToppingRollup.objects.bulk_create([
+        ToppingRollup(granularity=SalesRollup.HOUR, period_start=row['period'],
+                      topping_id=row['topping_id'], pizzas=row['pizzas'])
+        for row in toppings
+    ])
+
+
+def _rebuild_days(days):
+    """Replace the daily rollups starting at ``days`` with sums of their hourly rows."""
+    hourly = Q()
+    for day in days:
+        hourly |= Q(period_start__gte=day, period_start__lt=day + timedelta(days=1))
+    hourly &= Q(granularity=SalesRollup.HOUR)
+
+    for model in (SalesRollup, PizzaSalesRollup, ToppingRollup):
+        model.objects.filter(granularity=SalesRollup.DAY, period_start__in=days).delete()
+
+    sales = (
+        SalesRollup.objects.filter(hourly)
+        .annotate(day=TruncDay('period_start')).values('day')
+        .annotate(orders_sum=Sum('orders'), cancelled_sum=Sum('cancelled_orders'),
+                  pizzas_sum=Sum('pizzas_sold'), revenue_sum=Sum('revenue'), fees_sum=Sum('delivery_fees'))
+    )
+    SalesRollup.objects.bulk_create([
+        SalesRollup(granularity=SalesRollup.DAY, period_start=row['day'], orders=row['orders_sum'],
+                    cancelled_orders=row['cancelled_sum'], pizzas_sold=row['pizzas_sum'],
+                    revenue=row['revenue_sum'], delivery_fees=row['fees_sum'])
+        for row in sales
+    ])
+    pizzas = (
+        PizzaSalesRollup.objects.filter(hourly)
+        .annotate(day=TruncDay('period_start')).values('day', 'pizza_id', 'size')
+        .annotate(quantity_sum=Sum('quantity'), revenue_sum=Sum('revenue'))
+    )
+    PizzaSalesRollup.objects.bulk_create([
+        PizzaSalesRollup(granularity=SalesRollup.DAY, period_start=row['day'], pizza_id=row['pizza_id'],
+                         size=row['size'], quantity=row['quantity_sum'], revenue=row['revenue_sum'])
+        for row in pizzas
+    ])
+    toppings = (
+        ToppingRollup.objects.filter(hourly)
+        .annotate(day=TruncDay('period_start')).values('day', 'topping_id')
+        .annotate(pizzas_sum=Sum('pizzas'))
+    )
+    ToppingRollup.objects.bulk_create([
+        ToppingRollup(granularity=SalesRollup.DAY, period_start=row['day'],
+                      topping_id=row['topping_id'], pizzas=row['pizzas_sum'])
+        for row in toppings
+    ])
+
+
+def refresh_rollups(now=None):
+    """Bring the rollups up to date with orders changed since the watermark.
+
+    Returns the number of hours rebuilt. Rebuilding an hour recomputes it
+    from scratch, so running this twice, or with overlapping windows, is safe.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        watermark, created = AnalyticsWatermark.objects.select_for_update().get_or_create(
+            name=WATERMARK, defaults={'value': EPOCH}
+        )
+        changed = Order.objects.filter(updated_at__gt=watermark.value - OVERLAP, updated_at__lte=now)
+        hours = sorted(set(changed.annotate(hour=TruncHour('created_at')).values_list('hour', flat=True)))
+        for start in range(0, len(hours), PERIODS_PER_QUERY):
+            _rebuild_hours(hours[start:start + PERIODS_PER_QUERY])
+
+        days = sorted({timezone.localtime(hour).replace(hour=0) for hour in hours})
+        for start in range(0, len(days), PERIODS_PER_QUERY):
+            _rebuild_days(days[start:start + PERIODS_PER_QUERY])
+
+        watermark.value = now
+        watermark.save(update_fields=['value'])
+    return len(hours)
+
+
+def rollup_watermark():
+    return AnalyticsWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+
+
+def period_range(start, end):
+    # ``start`` and ``end`` are dates; ``end`` is inclusive
+    tz = timezone.get_current_timezone()
+    return (
+        datetime.combine(start, datetime.min.time(), tzinfo=tz),
+        datetime.combine(end + timedelta(days=1), datetime.min.time(), tzinfo=tz),
+    )
+
+
+def revenue_series(start, end, granularity=SalesRollup.DAY):
+    period_from, period_to = period_range(start, end)
+    rows = SalesRollup.objects.filter(
+        granularity=granularity, period_start__gte=period_from, period_start__lt=period_to
+    ).order_by('period_start')
+    return [
+        {
+            'period_start': row.period_start,
+            'orders': row.orders,
+            'cancelled_orders': row.cancelled_orders,
+            'pizzas_sold': row.pizzas_sold,
+            'revenue': row.revenue,
+            'average_order_value': (row.revenue / row.orders).quantize(Decimal('0.01')) if row.orders else None,
+        }
+        for row in rows
+    ]
+
+
+def summary(start, end):
+    period_from, period_to = period_range(start, end)
+    totals = SalesRollup.objects.filter(
+        granularity=SalesRollup.DAY, period_start__gte=period_from, period_start__lt=period_to
+    ).aggregate(
+        orders=Sum('orders'), cancelled_orders=Sum('cancelled_orders'), pizzas_sold=Sum('pizzas_sold'),
+        revenue=Sum('revenue'), delivery_fees=Sum('delivery_fees')
+    )
+    totals = {name: value or 0 for name, value in totals.items()}
+    totals['average_order_value'] = (
+        (totals['revenue'] / totals['orders']).quantize(Decimal('0.01')) if totals['orders'] else None
+    )
+    return totals
+
+
+def best_sellers(start, end, limit=10):
+    period_from, period_to = period_range(start, end)
+    return list(
+        PizzaSalesRollup.objects.filter(
+            granularity=SalesRollup.DAY, period_start__gte=period_from, period_start__lt=period_to
+        )
+        .values('pizza_id', 'size')
+        .annotate(name=F('pizza__name'), quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-quantity', '-revenue')[:limit]
+    )
+
+
+def topping_attach_rates(start, end):
+    """Share of pizzas sold in the range that had each topping."""
+    period_from, period_to = period_range(start, end)
+    in_range = Q(granularity=SalesRollup.DAY, period_start__gte=period_from, period_start__lt=period_to)
+    pizzas_sold = SalesRollup.objects.filter(in_range).aggregate(total=Sum('pizzas_sold'))['total'] or 0
+    rows = (
+        ToppingRollup.objects.filter(in_range)
+        .values('topping_id')
+        .annotate(name=F('topping__name'), pizzas=Sum('pizzas'))
+        .order_by('-pizzas')
+    )
+    return [
+        {**row, 'attach_rate': round(row['pizzas'] / pizzas_sold, 4) if pizzas_sold else None}
+        for row in rows
+    ]
+
+
+EXPORT_GROUPS = ('day', 'pizza', 'size', 'hour_of_day', 'weekday')
+
+
+def export_history(start, end, by='day', chunk_size=50000):
+    """Aggregate raw order items in a date range with NumPy, grouped ``by`` one of EXPORT_GROUPS.
+
+    Rows are streamed from the database in chunks of plain columns and
+    grouped in memory, so the query is a single indexed range scan with no
+    GROUP BY. Returns a list of dicts sorted by the group key.
+    """
+    import numpy as np
+
+    period_from, period_to = period_range(start, end)
+    rows = itertools.chain.from_iterable(
+        model.objects.filter(order__created_at__gte=period_from, order__created_at__lt=period_to)
+        .exclude(order__status='C')
+        .values_list('order__created_at', 'pizza_id', 'size', 'quantity', 'price')
+        .iterator(chunk_size=chunk_size)
+        for model in (OrderItem, ArchivedOrderItem)
+    )
+
+    created, pizza_ids, sizes, quantities, prices = [], [], [], [], []
+    for created_at, pizza_id, size, quantity, price in rows:
+        created.append(created_at.timestamp())
+        pizza_ids.append(pizza_id or 0)  # 0 for items whose pizza was deleted
+        sizes.append(size)
+        quantities.append(quantity)
+        prices.append(price)
+    if not created:
+        return []
+
+    offset = timezone.localtime(period_from).utcoffset().total_seconds()
+    local_seconds = np.asarray(created, dtype=np.float64) + offset
+    keys = {
+        'day': lambda: (local_seconds // 86400).astype(np.int64),
+        'hour_of_day': lambda: ((local_seconds % 86400) // 3600).astype(np.int64),
+        'weekday': lambda: ((local_seconds // 86400 + 3) % 7).astype(np.int64),  # 1970-01-01 was a Thursday
+        'pizza': lambda: np.asarray(pizza_ids, dtype=np.int64),
+        'size': lambda: np.asarray(sizes),
+    }[by]()
+    quantity = np.asarray(quantities, dtype=np.int64)
+    revenue = np.asarray([float(price) for price in prices], dtype=np.float64)
+
+    groups, inverse = np.unique(keys, return_inverse=True)
+    lines = np.bincount(inverse)
+    quantity_totals = np.bincount(inverse, weights=quantity)
+    revenue_totals = np.bincount(inverse, weights=revenue)
+
+    def label(key):
+        if by == 'day':
+            return (datetime(1970, 1, 1) + timedelta(days=int(key))).date().isoformat()
+        if by == 'pizza' and key == 0:
+            return None
+        return key.item() if hasattr(key, 'item') else key
+
+    return [
+        {by: label(key), 'lines': int(count), 'quantity': int(qty), 'revenue': round(float(total), 2)}
+        for key, count, qty, total in zip(groups, lines, quantity_totals, revenue_totals)
+    ]
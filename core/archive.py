@@ -0,0 +1,113 @@
+"""Archival of old, finished orders.
+
+``manage.py archive_orders`` moves delivered and cancelled orders older than
+ORDER_ARCHIVE_AFTER_DAYS, with their items and topping links, into
+ArchivedOrder/ArchivedOrderItem. The rows keep their ids. Each batch is
+copied and deleted in its own transaction, so the run can be stopped at any
+point and simply started again. The hot tables then hold only recent and
+live orders, and readers that need the full history merge both sides:
+OrderHistory for ordered pages, ``find_order`` for single orders.
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+# Orders that can no longer change
+TERMINAL_STATUSES = ['DL', 'C']
+BATCH_SIZE = 500
+
+
+def archive_cutoff(days=None):
+    if days is None:
+        days = settings.ORDER_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable_orders(before):
+    return Order.objects.filter(status__in=TERMINAL_STATUSES, created_at__lt=before)
+
+
+def _copy(instance, model, **values):
+    # Every column the archive model shares with the original, by attname
+    for field in model._meta.concrete_fields:
+        if hasattr(instance, field.attname):
+            values.setdefault(field.attname, getattr(instance, field.attname))
+    return model(**values)
+
+
+def archive_batch(before, batch_size=BATCH_SIZE):
+    """Move up to ``batch_size`` of the oldest archivable orders. Returns how many moved."""
+    with transaction.atomic():
+        orders = list(
+            archivable_orders(before).select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        if not orders:
+            return 0
+        items = list(OrderItem.objects.filter(order__in=orders))
+        links = list(OrderItem.toppings.through.objects.filter(orderitem__in=items))
+
+        ArchivedOrder.objects.bulk_create([_copy(order, ArchivedOrder) for order in orders])
+        ArchivedOrderItem.objects.bulk_create([_copy(item, ArchivedOrderItem) for item in items])
+        ArchivedOrderItem.toppings.through.objects.bulk_create([
+            ArchivedOrderItem.toppings.through(archivedorderitem_id=link.orderitem_id, topping_id=link.topping_id)
+            for link in links
+        ])
+        # Cascades to the items, their topping links and any stored idempotency keys
+        Order.objects.filter(id__in=[order.id for order in orders]).delete()
+    return len(orders)
+
+
+class OrderHistory:
+    """Hot and archived orders read as one ordered queryset.
+
+    Supports what keyset pagination needs: filter(), order_by() and bounded
+    slices. A slice takes the first ``stop`` rows of each queryset in the
+    same order and merges them, so a page is one indexed query per table.
+    Ids are unique across both tables, so (created_at, id) stays a total order.
+    """
+
+    def __init__(self, *querysets, ordering=None):
+        self.querysets = querysets
+        self.ordering = ordering
+
+    def filter(self, *args, **kwargs):
+        return OrderHistory(*(queryset.filter(*args, **kwargs) for queryset in self.querysets),
+                            ordering=self.ordering)
+
+    def order_by(self, *fields):
+        if len({field.startswith('-') for field in fields}) != 1:
+            raise ValueError("OrderHistory can only order by fields sorted in the same direction")
+        return OrderHistory(*(queryset.order_by(*fields) for queryset in self.querysets), ordering=fields)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.stop is None or self.ordering is None:
+            raise TypeError("OrderHistory only supports bounded slices after order_by()")
+        names = [field.lstrip('-') for field in self.ordering]
+        rows = heapq.merge(
+            *(queryset[:index.stop] for queryset in self.querysets),
+            key=lambda order: [getattr(order, name) for name in names],
+            reverse=self.ordering[0].startswith('-')
+        )
+        return list(rows)[index]
+
+
+def find_order(hot, archived, **lookup):
+    """The order matching ``lookup`` in ``hot``, else in ``archived``; None if neither has it."""
+    for queryset in (hot, archived):
+        order = queryset.filter(**lookup).first()
+        if order is not None:
+            return order
+    return None
+
+
+async def afind_order(hot, archived, **lookup):
+    for queryset in (hot, archived):
+        order = await queryset.filter(**lookup).afirst()
+        if order is not None:
+            return order
+    return None
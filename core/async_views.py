@@ -0,0 +1,150 @@
+"""Async views for the hot read paths and the order event stream.
+
+These use Django's async ORM and cache APIs end to end, so under ASGI
+(chakbites/asgi.py) a slow database round-trip parks a coroutine instead
+of pinning a worker thread. Responses match the equivalent DRF endpoints.
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException
+from rest_framework.utils.encoders import JSONEncoder
+
+from .archive import afind_order
+from .auth import StatelessJWTAuthentication
+from .carts import aget_cart_count
+from .events import KITCHEN_CHANNEL, get_broker, user_channel
+from .menu_cache import acatalog_version, aget_or_build
+from .models import ArchivedOrder, Cart, Order, Pizza
+from .serializers import CartSerializer, OrderSerializer, PizzaSerializer, eager_load
+
+ORDER_EVENTS_KEEPALIVE = 15  # seconds between keepalive comments on idle streams
+
+
+async def authenticate(request):
+    """Return the session or JWT user for the request, or None.
+
+    EventSource can't send headers, so the access token may also be passed
+    as ?token=.
+    """
+    user = await request.auser()
+    if user.is_authenticated:
+        return user
+
+    auth = StatelessJWTAuthentication()
+    raw_token = request.GET.get('token')
+    if not raw_token:
+        header = auth.get_header(request)
+        raw_token = header and auth.get_raw_token(header)
+    if not raw_token:
+        return None
+
+    try:
+        user = await auth.aget_user(auth.get_validated_token(raw_token))
+    except (APIException, KeyError, User.DoesNotExist):
+        return None
+    return user if user.is_active else None
+
+
+def api_response(data, status=200):
+    # DRF's encoder, so decimals come out the same as from the sync API
+    return JsonResponse(data, status=status, encoder=JSONEncoder, safe=False)
+
+
+def authentication_required():
+    return api_response({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+
+@require_GET
+async def menu(request):
+    etag = quote_etag(f"catalog-{await acatalog_version()}")
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    async def build():
+        pizzas = [pizza async for pizza in Pizza.objects.all()]
+        return PizzaSerializer(pizzas, many=True, context={'request': request}).data
+
+    # Same key as PizzaViewSet.list, so both paths share one cached payload
+    data = await aget_or_build(f"api:pizzas:{request.build_absolute_uri('/')}", build)
+    response = api_response(data)
+    response['ETag'] = etag
+    return response
+
+
+@require_GET
+async def cart(request):
+    user = await authenticate(request)
+    if user is None:
+        return authentication_required()
+
+    queryset = eager_load(Cart.objects.filter(user=user, active=True), CartSerializer())
+    cart = await queryset.afirst()
+    if cart is None:
+        # Reads never create a cart
+        return api_response({
+            'id': None, 'user': user.pk, 'created_at': None, 'updated_at': None,
+            'active': True, 'items': [], 'item_count': 0, 'total_price': 0,
+        })
+    return api_response(CartSerializer(cart, context={'request': request}).data)
+
+
+@require_GET
+async def cart_count(request):
+    user = await authenticate(request)
+    if user is None:
+        return authentication_required()
+    return api_response({'count': await aget_cart_count(user)})
+
+
+@require_GET
+async def order_detail(request, order_id):
+    user = await authenticate(request)
+    if user is None:
+        return authentication_required()
+
+    lookup = {'pk': order_id} if user.is_staff else {'pk': order_id, 'user': user}
+    order = await afind_order(
+        eager_load(Order.objects.all(), OrderSerializer()),
+        eager_load(ArchivedOrder.objects.all(), OrderSerializer()),
+        **lookup
+    )
+    if order is None:
+        return api_response({'detail': 'No Order matches the given query.'}, status=404)
+    return api_response(OrderSerializer(order, context={'request': request}).data)
+
+
+async def _order_event_stream(channel):
+    async with get_broker().subscribe(channel) as subscription:
+        yield 'retry: 5000\n\n'
+        while True:
+            message = await subscription.get(timeout=ORDER_EVENTS_KEEPALIVE)
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: order_status\ndata: {json.dumps(message)}\n\n"
+
+
+@require_GET
+async def order_events(request):
+    """Server-sent events stream of order status changes.
+
+    Customers get their own orders; staff can pass ?kitchen=1 for every order.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return authentication_required()
+
+    if user.is_staff and request.GET.get('kitchen'):
+        channel = KITCHEN_CHANNEL
+    else:
+        channel = user_channel(user.pk)
+
+    return StreamingHttpResponse(
+        _order_event_stream(channel),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,230 @@
+"""JWT authentication that doesn't look the user up on every request.
+
+Tokens from ``issue_tokens`` carry the user's username, staff flag and
+profile id as claims. StatelessJWTAuthentication builds a ClaimsUser from
+those claims without a query. Any other field is loaded on first access
+from a small in-process cache of user rows.
+
+Instead of checking is_active on every request, tokens are revoked:
+logging out revokes the presented access token, and changing a user's
+username, staff or active flag, or deleting the user, revokes every token
+they were issued so far and blacklists their refresh tokens. Tokens carry
+the time of the login they came from as ``auth_time``, to the microsecond
+and unchanged by refreshes, so a token from a login made in the same
+second as a revocation still works while any token refreshed from an
+older login doesn't. Revocations are TokenRevocation rows, so they
+survive restarts and can't be evicted the way cache keys can. Each
+process keeps the unexpired ones in memory and reads new rows at most
+every JWT_REVOCATION_POLL_SECONDS, so a revocation made by one worker
+takes up to that long to reach the others; the worker that made it
+applies it at once. Changes made with QuerySet.update() send no signals,
+so call ``revoke_user_tokens`` after them.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import ClaimsUser, TokenRevocation, UserProfile
+
+USER_ROW_TTL = 30  # seconds a cached user row may lag behind the database
+USER_ROW_CACHE_SIZE = 1024
+# Re-read revocations this far back, to catch rows committed late by a slow transaction
+REVOCATION_OVERLAP = timedelta(minutes=1)
+
+
+class TTLCache:
+    """Thread-safe LRU whose entries also expire ``ttl`` seconds after they were set."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+user_rows = TTLCache(USER_ROW_CACHE_SIZE, USER_ROW_TTL)
+
+
+def load_user_row(user_id):
+    """All columns of the user as a dict, from the row cache when fresh enough."""
+    row = user_rows.get(user_id)
+    if row is None:
+        columns = [field.attname for field in User._meta.concrete_fields]
+        row = User.objects.filter(pk=user_id).values(*columns).first()
+        if row is None:
+            raise User.DoesNotExist(f"User {user_id} no longer exists")
+        user_rows.set(user_id, row)
+    return row
+
+
+def forget_user_row(user_id):
+    user_rows.delete(user_id)
+
+
+def issue_tokens(user, profile_id=None):
+    """Refresh and access tokens for ``user``, with the claims the stateless path needs."""
+    if profile_id is None:
+        profile_id = UserProfile.objects.filter(user=user).values_list('id', flat=True).first()
+    refresh = RefreshToken.for_user(user)
+    refresh['auth_time'] = timezone.now().timestamp()
+    refresh['username'] = user.username
+    refresh['is_staff'] = user.is_staff
+    refresh['profile_id'] = profile_id
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+def user_from_claims(token):
+    """A ClaimsUser for the token, or None for tokens issued without the claims."""
+    try:
+        # Only active users are issued tokens, and deactivating one revokes them
+        values = [int(token[jwt_settings.USER_ID_CLAIM]), token['username'], token['is_staff'], True]
+    except KeyError:
+        return None
+    user = ClaimsUser.from_db(DEFAULT_DB_ALIAS, ['id', 'username', 'is_staff', 'is_active'], values)
+    user.profile_id = token.get('profile_id')
+    return user
+
+
+class RevocationList:
+    """The unexpired TokenRevocation rows, kept in memory and topped up from the table."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = {}  # jti -> expiry timestamp
+        self.users = {}  # User id -> (revoked at, expiry) timestamps; tokens issued up to then are refused
+        self.polled_at = None  # time.monotonic() of the last read
+        self.read_until = None
+
+    def due(self):
+        return self.polled_at is None or time.monotonic() - self.polled_at > settings.JWT_REVOCATION_POLL_SECONDS
+
+    def poll(self):
+        now = timezone.now()
+        rows = TokenRevocation.objects.filter(expires_at__gt=now)
+        if self.read_until is not None:
+            rows = rows.filter(revoked_at__gt=self.read_until - REVOCATION_OVERLAP)
+        rows = list(rows.values_list('user_id', 'jti', 'revoked_at', 'expires_at'))
+        with self.lock:
+            for row in rows:
+                self._add(*row)
+            cutoff = now.timestamp()
+            self.tokens = {jti: expires for jti, expires in self.tokens.items() if expires > cutoff}
+            self.users = {user_id: entry for user_id, entry in self.users.items() if entry[1] > cutoff}
+            self.read_until = now
+            self.polled_at = time.monotonic()
+
+    def add(self, user_id, jti, revoked_at, expires_at):
+        with self.lock:
+            self._add(user_id, jti, revoked_at, expires_at)
+
+    def _add(self, user_id, jti, revoked_at, expires_at):
+        if jti:
+            self.tokens[jti] = expires_at.timestamp()
+        else:
+            previous = self.users.get(user_id, (0, 0))
+            self.users[user_id] = (max(previous[0], revoked_at.timestamp()), max(previous[1], expires_at.timestamp()))
+
+    def check(self, token):
+        """Raise AuthenticationFailed if ``token`` was revoked as of the last poll."""
+        with self.lock:
+            user_revoked_at = self.users.get(int(token[jwt_settings.USER_ID_CLAIM]), (None,))[0]
+            # Tokens issued without auth_time fall back to the whole-second iat
+            revoked = token.get(jwt_settings.JTI_CLAIM) in self.tokens or (
+                user_revoked_at is not None and token.get('auth_time', token.get('iat', 0)) <= user_revoked_at
+            )
+        if revoked:
+            raise AuthenticationFailed("Token has been revoked", code='token_revoked')
+
+
+revocations = RevocationList()
+
+
+def _revoke(user_id, jti, expires_at):
+    revocation = TokenRevocation.objects.create(user_id=user_id, jti=jti, expires_at=expires_at)
+    # Take effect here now; other processes pick the row up on their next poll
+    revocations.add(user_id, jti, revocation.revoked_at, expires_at)
+    # Expired rows protect nothing; clearing them here keeps the table to the live revocations
+    TokenRevocation.objects.filter(expires_at__lte=revocation.revoked_at).delete()
+
+
+def revoke_token(token):
+    """Reject ``token`` (e.g. the access token of a logged-out session) until it expires."""
+    expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+    if expires_at > timezone.now():
+        _revoke(int(token[jwt_settings.USER_ID_CLAIM]), token[jwt_settings.JTI_CLAIM], expires_at)
+
+
+def revoke_user_tokens(user_id):
+    """Reject every token issued to the user so far, e.g. after deactivation.
+
+    Their refresh tokens are blacklisted, and the revocation outlives them,
+    so an access token refreshed in a race with this call is refused too.
+    """
+    now = timezone.now()
+    _revoke(user_id, '', now + jwt_settings.REFRESH_TOKEN_LIFETIME)
+    outstanding = OutstandingToken.objects.filter(
+        user_id=user_id, expires_at__gt=now, blacklistedtoken__isnull=True
+    ).values_list('id', flat=True)
+    BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token_id=token_id) for token_id in outstanding], ignore_conflicts=True
+    )
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the token's claims instead of loading the user.
+
+    Tokens issued before the claims were added still work, through the
+    regular lookup.
+    """
+
+    def get_user(self, validated_token):
+        if revocations.due():
+            revocations.poll()
+        revocations.check(validated_token)
+        return user_from_claims(validated_token) or super().get_user(validated_token)
+
+    async def aget_user(self, validated_token):
+        if revocations.due():
+            await sync_to_async(revocations.poll)()
+        revocations.check(validated_token)
+        user = user_from_claims(validated_token)
+        if user is None:
+            user = await User.objects.aget(**{
+                jwt_settings.USER_ID_FIELD: validated_token[jwt_settings.USER_ID_CLAIM]
+            })
+        return user
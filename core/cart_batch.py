@@ -0,0 +1,123 @@
+from django.db import transaction
+
+from .models import CartItem, Pizza, Topping
+from .pricing import recalculate_carts
+
+
+class CartOperationError(Exception):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def _positive_int(value, index):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise CartOperationError(index, 'Quantity must be a positive integer')
+    return value
+
+
+def _id(value, index, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise CartOperationError(index, f'{name} is required')
+
+
+def _id_list(values, index):
+    if not isinstance(values, list):
+        raise CartOperationError(index, 'topping_ids must be a list')
+    # A topping goes on once however often it's listed, as with add_item
+    return list(dict.fromkeys(_id(value, index, 'topping_ids') for value in values))
+
+
+def apply_cart_operations(cart, operations):
+    """Apply a list of add/update/remove operations to the cart atomically.
+
+    Each operation is a dict with an ``op`` of ``add`` (pizza_id, size,
+    quantity, topping_ids, notes), ``update`` (item_id, quantity) or
+    ``remove`` (item_id). Pizzas, toppings and cart items are each loaded
+    with one query, writes are bulk, and either every operation is applied
+    or none is. Raises CartOperationError naming the offending operation.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError(None, 'operations must be a non-empty list')
+
+    adds, updates, removes = [], {}, {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise CartOperationError(index, 'Each operation must be an object')
+        op = operation.get('op')
+        if op == 'add':
+            if operation.get('size') not in dict(Pizza.SIZE_CHOICES):
+                raise CartOperationError(index, 'Invalid size')
+            adds.append({
+                'index': index,
+                'pizza_id': _id(operation.get('pizza_id'), index, 'pizza_id'),
+                'size': operation['size'],
+                'quantity': _positive_int(operation.get('quantity', 1), index),
+                'topping_ids': _id_list(operation.get('topping_ids', []), index),
+                'notes': operation.get('notes', ''),
+            })
+        elif op in ('update', 'remove'):
+            item_id = _id(operation.get('item_id'), index, 'item_id')
+            if op == 'update':
+                updates[item_id] = (index, _positive_int(operation.get('quantity'), index))
+            else:
+                removes[item_id] = index
+        else:
+            raise CartOperationError(index, "op must be 'add', 'update' or 'remove'")
+
+    pizza_ids = {add['pizza_id'] for add in adds}
+    pizzas = Pizza.objects.in_bulk(pizza_ids) if pizza_ids else {}
+    topping_ids = {topping_id for add in adds for topping_id in add['topping_ids']}
+    toppings = Topping.objects.in_bulk(topping_ids) if topping_ids else {}
+
+    new_items = []
+    for add in adds:
+        if add['pizza_id'] not in pizzas:
+            raise CartOperationError(add['index'], 'Pizza not found')
+        if any(topping_id not in toppings for topping_id in add['topping_ids']):
+            raise CartOperationError(add['index'], 'Topping not found')
+        item_toppings = [toppings[topping_id] for topping_id in add['topping_ids']]
+        item = CartItem(cart=cart, pizza=pizzas[add['pizza_id']], size=add['size'],
+                        quantity=add['quantity'], notes=add['notes'])
+        item.set_price(item.compute_unit_price(item_toppings))
+        new_items.append((item, item_toppings))
+
+    with transaction.atomic():
+        targets = {item_id: index for item_id, (index, quantity) in updates.items()}
+        targets.update(removes)
+        existing = CartItem.objects.select_for_update().filter(cart=cart).in_bulk(targets)
+        for item_id, index in targets.items():
+            if item_id not in existing:
+                raise CartOperationError(index, 'Item not found in cart')
+
+        changed = []
+        for item_id, (index, quantity) in updates.items():
+            if item_id in removes:
+                continue
+            item = existing[item_id]
+            item.quantity = quantity
+            item.set_price(item.unit_price)
+            changed.append(item)
+        CartItem.objects.bulk_update(changed, ['quantity', 'line_total'])
+
+        if removes:
+            CartItem.objects.filter(id__in=removes).delete()
+
+        CartItem.objects.bulk_create([item for item, item_toppings in new_items])
+        CartItemTopping = CartItem.toppings.through
+        CartItemTopping.objects.bulk_create([
+            CartItemTopping(cartitem_id=item.id, topping_id=topping.id)
+            for item, item_toppings in new_items
+            for topping in item_toppings
+        ])
+
+        recalculate_carts([cart.id])
+    cart.refresh_from_db(fields=['subtotal', 'item_count', 'updated_at'])
+    return cart
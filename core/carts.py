@@ -0,0 +1,106 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .metrics import record_cache
+from .models import Cart
+
+# Without REDIS_URL each worker caches in its own memory, and deleting a
+# count only reaches the worker that made the change; the others serve
+# theirs for at most this many seconds
+CART_COUNT_TIMEOUT = 60
+PURGE_BATCH_SIZE = 500
+
+
+def get_active_cart(user):
+    # Reads never create a cart; one is only made on the first write
+    return Cart.objects.filter(user=user, active=True).first()
+
+
+def get_or_create_active_cart(user):
+    # Safe under concurrency: the cart_one_active_per_user index rejects a
+    # second insert, and get_or_create then returns the cart that won
+    cart, created = Cart.objects.get_or_create(user=user, active=True)
+    return cart
+
+
+def lock_active_cart(user):
+    """Return the user's active cart, creating it if needed, locked for update.
+
+    Must be called inside a transaction. Cart writes and checkout both take
+    this lock, so an add can't land in a cart that is being checked out, and
+    purge_batch skips a cart that is being written to.
+    """
+    cart, created = Cart.objects.select_for_update().get_or_create(user=user, active=True)
+    return cart
+
+
+def purge_cutoffs(empty_hours=None, idle_days=None):
+    if empty_hours is None:
+        empty_hours = settings.CART_EMPTY_EXPIRY_HOURS
+    if idle_days is None:
+        idle_days = settings.CART_IDLE_EXPIRY_DAYS
+    now = timezone.now()
+    return now - timedelta(hours=empty_hours), now - timedelta(days=idle_days)
+
+
+def purgeable_carts(empty_before, idle_before):
+    """Checked-out carts, plus active ones left empty since ``empty_before`` or untouched since ``idle_before``."""
+    return Cart.objects.filter(
+        Q(active=False) | Q(item_count=0, updated_at__lt=empty_before) | Q(updated_at__lt=idle_before)
+    )
+
+
+def purge_batch(empty_before, idle_before, batch_size=PURGE_BATCH_SIZE):
+    """Delete up to ``batch_size`` purgeable carts with their items.
+
+    Returns the number of carts and cart items deleted. Each batch is its own
+    short transaction, and carts locked by a cart write are left for a later run.
+    """
+    with transaction.atomic():
+        carts = list(
+            purgeable_carts(empty_before, idle_before).select_for_update(skip_locked=True)
+            .order_by('id').values_list('id', 'user_id', 'active')[:batch_size]
+        )
+        if not carts:
+            return 0, 0
+        deleted, per_model = Cart.objects.filter(id__in=[cart_id for cart_id, user_id, active in carts]).delete()
+    # Users whose active cart went are back to an empty one
+    forget_cart_counts([user_id for cart_id, user_id, active in carts if active])
+    return len(carts), per_model.get('core.CartItem', 0)
+
+
+def _cart_count_key(user_id):
+    return f"cart_count:{user_id}"
+
+
+def get_cart_count(user):
+    count = cache.get(_cart_count_key(user.pk))
+    record_cache(count is not None)
+    if count is None:
+        count = Cart.objects.filter(user=user, active=True).values_list('item_count', flat=True).first() or 0
+        cache.set(_cart_count_key(user.pk), count, CART_COUNT_TIMEOUT)
+    return count
+
+
+async def aget_cart_count(user):
+    count = await cache.aget(_cart_count_key(user.pk))
+    record_cache(count is not None)
+    if count is None:
+        count = await Cart.objects.filter(user=user, active=True).values_list('item_count', flat=True).afirst() or 0
+        await cache.aset(_cart_count_key(user.pk), count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def forget_cart_counts(user_ids):
+    """Drop the users' cached counts once the current transaction (if any) commits.
+
+    The next read loads the committed count, so concurrent writes can't
+    leave an older count cached in whichever order they finish.
+    """
+    keys = [_cart_count_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
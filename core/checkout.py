@@ -0,0 +1,99 @@
+from django.db import transaction
+
+from . import delivery
+from .jobs import enqueue
+from .models import Cart, CartItem, Order, OrderItem
+from .order_status import record_placed
+
+
+def load_cart_items(cart):
+    # One query for the items and their pizzas, one for all of their toppings
+    return list(
+        CartItem.objects.filter(cart=cart)
+        .select_related('pizza')
+        .prefetch_related('toppings')
+    )
+
+
+def snapshot(item):
+    # Catalog details copied onto the order item, so history never reads them back
+    return {
+        'pizza_name': item.pizza.name,
+        'unit_price': item.unit_price,
+        'topping_snapshot': [
+            {'id': topping.id, 'name': topping.name, 'price': topping.price}
+            for topping in item.toppings.all()
+        ],
+    }
+
+
+def place_order(user, cart, order_type, delivery_address='', notes=''):
+    """Turn the cart into an order using a fixed number of queries.
+
+    Prices are computed in memory from the prefetched items, and the order,
+    its items and their toppings are written with bulk inserts inside a
+    single transaction. The cart row is locked first, so concurrent checkouts
+    and cart edits queue behind it. Returns None if the cart is empty or was
+    already checked out.
+    """
+    with transaction.atomic():
+        cart = Cart.objects.select_for_update().filter(pk=cart.pk, active=True).first()
+        if cart is None:
+            return None
+        items = load_cart_items(cart)
+        if not items:
+            return None
+
+        # Calculate total amount
+        line_prices = [item.get_price() for item in items]
+        total_amount = sum(line_prices)
+
+        # Delivery fee for the address's zone, and an ETA from the kitchen queue
+        nominal_prep = delivery.prep_minutes(items)
+        quote = delivery.estimate(order_type, delivery_address, nominal_prep)
+        total_amount += quote['fee']
+
+        order = Order.objects.create(
+            user=user,
+            order_type=order_type,
+            delivery_address=delivery_address,
+            delivery_fee=quote['fee'],
+            eta_earliest=quote['eta_earliest'],
+            eta_latest=quote['eta_latest'],
+            payment_method='Cash on Delivery',
+            total_amount=total_amount,
+            notes=notes
+        )
+        record_placed(order, user)
+
+        # Create order items from cart items
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                pizza=item.pizza,
+                size=item.size,
+                quantity=item.quantity,
+                price=price,
+                **snapshot(item)
+            )
+            for item, price in zip(items, line_prices)
+        ])
+
+        OrderItemTopping = OrderItem.toppings.through
+        OrderItemTopping.objects.bulk_create([
+            OrderItemTopping(orderitem_id=order_item.id, topping_id=topping.id)
+            for item, order_item in zip(items, order_items)
+            for topping in item.toppings.all()
+        ])
+
+        # Clear the cart
+        CartItem.objects.filter(cart=cart).delete()
+        cart.active = False
+        cart.subtotal = 0
+        cart.item_count = 0
+        cart.save(update_fields=['active', 'subtotal', 'item_count', 'updated_at'])
+
+        enqueue('send_order_receipt', order_id=order.id, idempotency_key=f"order-receipt:{order.id}")
+        transaction.on_commit(lambda: delivery.get_model().add_order(order.id, nominal_prep, order.created_at))
+
+    return order
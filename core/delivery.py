@@ -0,0 +1,210 @@
+"""Delivery fees and ETAs.
+
+The fee comes from the delivery zone named in the address. The ETA is the
+wait for a kitchen station, this order's prep time and the zone's travel
+time, given as a window: the early end at typical speeds, the late end at
+slow (90th percentile) ones.
+
+Prep times start from each pizza's prep_minutes and are scaled by how long
+orders have really been taking to prepare; travel times are the zone's
+recent delivery durations. Both come from rolling windows of stage
+durations, filled from the order status log (core/order_status.py) when a
+process first needs them and fed by ``record_transition`` after that. The
+kitchen queue is a snapshot reloaded at most every QUEUE_REFRESH_SECONDS,
+and kept current in between by this process's own checkouts and status
+changes, so an estimate is arithmetic over memory and never an aggregate
+query. Every process learns on its own.
+"""
+import heapq
+import re
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import OrderItem, OrderStatusEvent
+
+# Stretch applied to a slow order before there are samples to say otherwise
+SLOW_FACTOR = 1.3
+MIN_WINDOW_MINUTES = 10
+QUEUED_STATUSES = ['P', 'PR']
+
+
+def get_zone(address):
+    """The first zone in DELIVERY['ZONES'] with a keyword in ``address``, else DEFAULT_ZONE."""
+    address = address or ''
+    for zone in settings.DELIVERY['ZONES']:
+        if any(re.search(rf"\b{re.escape(keyword)}\b", address, re.IGNORECASE) for keyword in zone['keywords']):
+            return zone
+    return settings.DELIVERY['DEFAULT_ZONE']
+
+
+def prep_minutes(items):
+    """Nominal prep time of order or cart items, from each pizza's prep_minutes."""
+    return sum(item.quantity * item.pizza.prep_minutes for item in items)
+
+
+class RollingWindow:
+    """The most recent ``size`` samples of one measurement, with cheap quantiles."""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.ordered = None
+
+    def add(self, value):
+        self.samples.append(value)
+        self.ordered = None
+
+    def quantile(self, fraction, default):
+        if not self.samples:
+            return default
+        if self.ordered is None:
+            self.ordered = sorted(self.samples)
+        return self.ordered[min(len(self.ordered) - 1, int(len(self.ordered) * fraction))]
+
+
+class DeliveryModel:
+    """Recent stage durations plus a snapshot of the kitchen queue."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        size = settings.DELIVERY['SAMPLE_SIZE']
+        # Actual prep time over nominal prep time, so big and small orders share one model
+        self.prep_ratios = RollingWindow(size)
+        self.travel = {}  # Zone name -> RollingWindow of delivery minutes
+        self.queue = {}  # Order id -> [status, stage started at, nominal prep minutes]
+        self.loaded_at = None
+
+    def queued_orders(self):
+        refresh = settings.DELIVERY['QUEUE_REFRESH_SECONDS']
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > refresh:
+            rows = (
+                OrderItem.objects.filter(order__status__in=QUEUED_STATUSES)
+                .values('order_id', 'order__status', 'order__created_at', 'order__updated_at')
+                .annotate(nominal=Sum(F('quantity') * F('pizza__prep_minutes')))
+                .order_by()
+            )
+            queue = {
+                row['order_id']: [
+                    row['order__status'],
+                    # A pending order has waited since it was placed, a preparing one since it started
+                    row['order__created_at'] if row['order__status'] == 'P' else row['order__updated_at'],
+                    row['nominal'],
+                ]
+                for row in rows
+            }
+            with self.lock:
+                self.queue = queue
+                self.loaded_at = time.monotonic()
+        with self.lock:
+            return list(self.queue.values())
+
+    def load_history(self):
+        """Fill the rolling windows with the most recent logged prep and delivery stages."""
+        size = settings.DELIVERY['SAMPLE_SIZE']
+        # Newest first through the stage index, then replayed oldest first
+        prepared = list(
+            OrderStatusEvent.objects.filter(from_status='PR', status__in=['OD', 'DL'])
+            .order_by('-created_at').values_list('order_id', 'stage_seconds')[:size]
+        )
+        nominal = dict(
+            OrderItem.objects.filter(order_id__in=[order_id for order_id, seconds in prepared])
+            .values('order_id').annotate(nominal=Sum(F('quantity') * F('pizza__prep_minutes')))
+            .values_list('order_id', 'nominal').order_by()
+        )
+        delivered = list(
+            OrderStatusEvent.objects.filter(from_status='OD', status='DL')
+            .order_by('-created_at').values_list('order__delivery_address', 'stage_seconds')[:size]
+        )
+        with self.lock:
+            for order_id, seconds in reversed(prepared):
+                if nominal.get(order_id):  # Archived orders' items are out of reach; skip them
+                    self.prep_ratios.add(seconds / 60 / nominal[order_id])
+            for address, seconds in reversed(delivered):
+                zone = get_zone(address)['name']
+                self.travel.setdefault(zone, RollingWindow(size)).add(seconds / 60)
+
+    def add_order(self, order_id, nominal, placed_at):
+        with self.lock:
+            self.queue[order_id] = ['P', placed_at, nominal]
+
+    def record(self, order, event):
+        """Learn from the status change ``event`` of ``order``."""
+        previous_status, minutes = event.from_status, event.stage_seconds / 60
+        with self.lock:
+            entry = self.queue.pop(order.pk, None)
+            if order.status == 'PR':
+                self.queue[order.pk] = ['PR', event.created_at, entry[2] if entry else None]
+        if previous_status == 'PR' and order.status in ('OD', 'DL'):
+            nominal = entry[2] if entry and entry[2] else order_prep_minutes(order)
+            if nominal:
+                with self.lock:
+                    self.prep_ratios.add(minutes / nominal)
+        elif previous_status == 'OD' and order.status == 'DL':
+            zone = get_zone(order.delivery_address)['name']
+            with self.lock:
+                self.travel.setdefault(zone, RollingWindow(settings.DELIVERY['SAMPLE_SIZE'])).add(minutes)
+
+    def kitchen_wait(self, queue, ratio, now):
+        """Minutes until a station is free for a new order, if the queue runs at ``ratio``."""
+        stations = [0.0] * settings.DELIVERY['KITCHEN_STATIONS']
+        # Orders already on a station first, then the pending ones oldest first
+        for status, started, nominal in sorted(queue, key=lambda entry: (entry[0] != 'PR', entry[1])):
+            remaining = (nominal or 0) * ratio
+            if status == 'PR':
+                remaining = max(remaining - (now - started).total_seconds() / 60, 0)
+            heapq.heappush(stations, heapq.heappop(stations) + remaining)
+        return stations[0]
+
+    def estimate(self, order_type, address, nominal_prep):
+        """Fee, zone name and ETA window for an order needing ``nominal_prep`` minutes of prep."""
+        queue = self.queued_orders()
+        now = timezone.now()
+        zone = get_zone(address) if order_type == 'D' else None
+        with self.lock:
+            typical_ratio = self.prep_ratios.quantile(0.5, 1.0)
+            slow_ratio = self.prep_ratios.quantile(0.9, SLOW_FACTOR)
+            if zone is None:
+                typical_travel = slow_travel = 0
+            else:
+                travel = self.travel.get(zone['name']) or RollingWindow(0)
+                typical_travel = travel.quantile(0.5, zone['travel_minutes'])
+                slow_travel = travel.quantile(0.9, zone['travel_minutes'] * SLOW_FACTOR)
+
+        earliest = self.kitchen_wait(queue, typical_ratio, now) + nominal_prep * typical_ratio + typical_travel
+        latest = self.kitchen_wait(queue, slow_ratio, now) + nominal_prep * slow_ratio + slow_travel
+        return {
+            'zone': zone['name'] if zone else None,
+            'fee': Decimal(str(zone['fee'])) if zone else Decimal('0'),
+            'eta_earliest': now + timedelta(minutes=earliest),
+            'eta_latest': now + timedelta(minutes=max(latest, earliest + MIN_WINDOW_MINUTES)),
+        }
+
+
+def order_prep_minutes(order):
+    # Only for orders the queue snapshot hasn't seen, e.g. placed and started between reloads
+    return OrderItem.objects.filter(order=order).aggregate(
+        nominal=Sum(F('quantity') * F('pizza__prep_minutes'))
+    )['nominal']
+
+
+@lru_cache(maxsize=None)
+def get_model():
+    model = DeliveryModel()
+    model.load_history()
+    return model
+
+
+def estimate(order_type, address, nominal_prep):
+    return get_model().estimate(order_type, address, nominal_prep)
+
+
+def record_transition(order, event):
+    """Call after core.order_status.change_status moved ``order`` on, with the event it logged."""
+    get_model().record(order, event)
@@ -0,0 +1,170 @@
+"""Order status push channel.
+
+Views publish order events to a broker; the server-sent events endpoint
+subscribes one stream per connection. Each customer listens on
+``user:<id>`` and the kitchen on ``kitchen``. The broker class comes from
+``settings.ORDER_EVENTS_BROKER`` so the in-process broker can be swapped for
+the Redis one when running more than one worker.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+KITCHEN_CHANNEL = 'kitchen'
+SUBSCRIBER_QUEUE_SIZE = 100
+RECONNECT_MAX_SECONDS = 30  # Longest wait between attempts to resubscribe to Redis
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+class Subscription:
+    def __init__(self, queue):
+        self._queue = queue
+
+    async def get(self, timeout=None):
+        """Wait for the next message, or return None after ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+def _deliver(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass  # Slow consumer; it will catch up from the next event
+
+
+class InProcessBroker:
+    """Fans messages out to the subscribers connected to this process.
+
+    ``publish`` may be called from any thread (sync views run in a thread
+    pool under ASGI); messages are handed to each subscriber's event loop.
+    """
+
+    def __init__(self, **options):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        self._fan_out(channel, message)
+
+    def _fan_out(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, message)
+            except RuntimeError:
+                pass  # The subscriber's loop has already shut down
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            yield Subscription(queue)
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+class RedisBroker(InProcessBroker):
+    """Publishes through Redis pub/sub so every worker sees every event.
+
+    Each process holds a single Redis subscription, started on the first
+    local subscriber, and fans incoming messages out in-process. If the
+    connection drops, the listener logs it and resubscribes, waiting twice
+    as long after each failed attempt up to RECONNECT_MAX_SECONDS. Events
+    published while it is down are not replayed.
+    """
+
+    prefix = 'order-events:'
+
+    def __init__(self, url, **options):
+        import redis
+
+        super().__init__(**options)
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish(self, channel, message):
+        self._redis.publish(self.prefix + channel, json.dumps(message))
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        return super().subscribe(channel)
+
+    def _listen(self):
+        import redis
+
+        delay = 1
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.psubscribe(self.prefix + '*')
+                delay = 1
+                for item in pubsub.listen():
+                    channel = item['channel'].decode()[len(self.prefix):]
+                    self._fan_out(channel, json.loads(item['data']))
+            except (redis.ConnectionError, redis.TimeoutError):
+                logger.warning("Order event subscription lost; resubscribing in %ds", delay, exc_info=True)
+            except Exception:
+                logger.exception("Order event listener failed; resubscribing in %ds", delay)
+            finally:
+                pubsub.close()
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    config = settings.ORDER_EVENTS_BROKER
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+
+def order_event(order):
+    return {
+        'order_id': order.id,
+        'user_id': order.user_id,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'updated_at': order.updated_at.isoformat(),
+    }
+
+
+def publish_order_event(order):
+    """Push the order's current status to its owner and the kitchen once committed."""
+    message = order_event(order)
+
+    def publish():
+        broker = get_broker()
+        broker.publish(user_channel(order.user_id), message)
+        broker.publish(KITCHEN_CHANNEL, message)
+
+    transaction.on_commit(publish)
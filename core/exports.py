@@ -0,0 +1,148 @@
+"""Streaming order exports for accounting.
+
+Orders are read in id order with ``.iterator(chunk_size=...)``; each chunk
+prefetches its items, which carry their own pizza and topping snapshot, in
+one query, so memory stays flat however many orders match. The order id
+doubles as a resume cursor: pass the last id you received as ``after`` to
+carry on from there. Archived orders keep their ids, so they are read the
+same way and merged into the one id-ordered stream.
+
+Under ASGI Django reads a sync iterator into memory before sending any of
+it, so there the stream is handed over through ``aiter_chunks``.
+"""
+import csv
+import heapq
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+
+from .analytics import period_range
+from .models import ArchivedOrder, Order
+
+CHUNK_SIZE = 500
+
+CSV_HEADER = [
+    'order_id', 'created_at', 'username', 'status', 'order_type', 'payment_method',
+    'delivery_fee', 'total_amount', 'pizza', 'size', 'quantity', 'line_price', 'toppings',
+]
+
+
+def export_filters(start=None, end=None, status=None, after=None):
+    """Turn raw string filters into keyword arguments for ``export_orders``.
+
+    Raises ValueError with a message fit for the client on bad input.
+    """
+    filters = {}
+    for name, value in (('start', start), ('end', end)):
+        if value:
+            try:
+                filters[name] = parse_date(value)
+            except ValueError:
+                filters[name] = None
+            if filters[name] is None:
+                raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+    if status:
+        statuses = status.split(',')
+        valid = dict(Order.STATUS_CHOICES)
+        if any(code not in valid for code in statuses):
+            raise ValueError(f"status must be a comma-separated list of {', '.join(valid)}")
+        filters['statuses'] = statuses
+    if after:
+        try:
+            filters['after'] = int(after)
+        except ValueError:
+            raise ValueError('after must be an order id')
+    return filters
+
+
+def export_orders(start=None, end=None, statuses=None, after=None, chunk_size=CHUNK_SIZE):
+    streams = []
+    for order_model in (Order, ArchivedOrder):
+        queryset = order_model.objects.select_related('user').prefetch_related('items').order_by('id')
+        if start:
+            queryset = queryset.filter(created_at__gte=period_range(start, start)[0])
+        if end:
+            queryset = queryset.filter(created_at__lt=period_range(end, end)[1])
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        if after:
+            queryset = queryset.filter(id__gt=after)
+        streams.append(queryset.iterator(chunk_size=chunk_size))
+    return heapq.merge(*streams, key=lambda order: order.id)
+
+
+def order_record(order):
+    return {
+        'id': order.id,
+        'created_at': order.created_at,
+        'username': order.user.username,
+        'status': order.status,
+        'order_type': order.order_type,
+        'payment_method': order.payment_method,
+        'delivery_fee': order.delivery_fee,
+        'total_amount': order.total_amount,
+        'items': [
+            {
+                'pizza': item.pizza_name,
+                'size': item.size,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'price': item.price,
+                'toppings': item.topping_names,
+            }
+            for item in order.items.all()
+        ],
+    }
+
+
+def stream_ndjson(orders):
+    # One order per line, items nested; decimals stay exact as strings
+    for order in orders:
+        yield json.dumps(order_record(order), cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_csv(orders):
+    # One row per order item, order columns repeated
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER)
+    for order in orders:
+        record = order_record(order)
+        prefix = [
+            record['id'], record['created_at'].isoformat(), record['username'], record['status'],
+            record['order_type'], record['payment_method'], record['delivery_fee'], record['total_amount'],
+        ]
+        items = record['items'] or [None]
+        yield ''.join(
+            writer.writerow(prefix + (
+                [item['pizza'], item['size'], item['quantity'], item['price'], '; '.join(item['toppings'])]
+                if item else [''] * 5
+            ))
+            for item in items
+        )
+
+
+async def aiter_chunks(chunks):
+    """``chunks`` as an async iterator, for a StreamingHttpResponse under ASGI.
+
+    Each chunk is produced on the sync thread, which owns the database
+    connection the export reads through.
+    """
+    chunks = iter(chunks)
+    while True:
+        chunk = await sync_to_async(next)(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+EXPORTERS = {
+    'csv': (stream_csv, 'text/csv'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+}
@@ -0,0 +1,97 @@
+"""Password hashing on a bounded pool, with admission control.
+
+A PBKDF2 check costs hundreds of milliseconds of CPU. Run on the request
+thread, a burst of logins would starve every other request on the worker.
+Logins and registrations hand the hashing to a small thread pool instead:
+hashlib releases the GIL while it hashes, so menu reads keep being served
+alongside. The pool admits at most WORKERS + BACKLOG hashes at a time, and
+anything beyond that fails fast with HashingBusy, which the views turn into
+a 429, instead of queueing behind work that will already take seconds.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    PBKDF2PasswordHasher, check_password, get_hasher, identify_hasher, make_password
+)
+from django.contrib.auth.models import User
+
+
+class HashingBusy(Exception):
+    """Every hashing slot is taken; the client should retry shortly."""
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """Django's PBKDF2-SHA256 with the iteration count from PASSWORD_PBKDF2_ITERATIONS.
+
+    The algorithm name is unchanged and every hash records its own
+    iterations, so existing hashes still verify, and are rehashed to the
+    configured count on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class HashingPool:
+    def __init__(self, workers, backlog):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+
+    def run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            return self.executor.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    config = settings.PASSWORD_HASHING_POOL
+    return HashingPool(config.get('WORKERS') or os.cpu_count() or 1, config.get('BACKLOG', 0))
+
+
+def hash_password(password):
+    """make_password on the pool. Raises HashingBusy when the pool is full."""
+    return get_pool().run(make_password, password)
+
+
+def needs_rehash(encoded):
+    # Same rule as Django's check_password: another hasher, or the preferred one with other parameters
+    preferred = get_hasher('default')
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    return hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def check_credentials(username, password):
+    """The active user with these credentials, or None; authenticate() for the model backend.
+
+    The database work stays on the request thread and only the hashing goes
+    to the pool. An outdated hash is replaced with one from the preferred
+    hasher. Raises HashingBusy when the pool is full.
+    """
+    if username is None or password is None:
+        return None
+    pool = get_pool()
+    try:
+        user = User._default_manager.get_by_natural_key(username)
+    except User.DoesNotExist:
+        # Hash anyway, so an unknown username takes as long as a wrong password
+        pool.run(make_password, password)
+        return None
+
+    if not pool.run(check_password, password, user.password):
+        return None
+    if needs_rehash(user.password):
+        user.password = pool.run(make_password, password)
+        user.save(update_fields=['password'])
+    return user if user.is_active else None
@@ -0,0 +1,93 @@
+"""Responsive renditions for pizza photos and the static carousel images.
+
+Each source image is resized to a fixed set of widths and saved as both
+WebP and JPEG. Metadata (EXIF, ICC, GPS) is not carried over into the
+renditions. A tiny blurred JPEG is kept inline as a placeholder while the
+real image loads.
+"""
+import base64
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+PIZZA_WIDTHS = (320, 640, 960)
+CAROUSEL_WIDTHS = (640, 1280, 1920)
+PLACEHOLDER_WIDTH = 16
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 75, 'method': 6},
+    'jpeg': {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+
+def load_image(file):
+    image = Image.open(file)
+    image = ImageOps.exif_transpose(image)  # Apply camera rotation before EXIF is dropped
+    return image.convert('RGB')
+
+
+def resized(image, width):
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode(image, fmt):
+    buffer = BytesIO()
+    image.save(buffer, **FORMATS[fmt])
+    return buffer.getvalue()
+
+
+def placeholder(image):
+    small = resized(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    small.save(buffer, format='JPEG', quality=40)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def rendition_widths(image, widths):
+    # Never upscale; a small original gets a single rendition at its own width
+    return [width for width in widths if width < image.width] or [image.width]
+
+
+def build_pizza_renditions(pizza):
+    """Generate renditions for ``pizza.image`` and return the fields to store on it."""
+    with pizza.image.open('rb') as file:
+        image = load_image(file)
+
+    stem = os.path.splitext(os.path.basename(pizza.image.name))[0]
+    renditions = {fmt: {} for fmt in FORMATS}
+    for width in rendition_widths(image, PIZZA_WIDTHS):
+        version = resized(image, width)
+        for fmt in FORMATS:
+            name = f"pizzas/renditions/{stem}-{width}.{fmt}"
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            renditions[fmt][str(width)] = default_storage.save(name, ContentFile(encode(version, fmt)))
+
+    return {
+        'image_width': image.width,
+        'image_height': image.height,
+        'image_placeholder': placeholder(image),
+        'image_renditions': {'source': pizza.image.name, **renditions},
+    }
+
+
+def build_static_renditions(path, widths=CAROUSEL_WIDTHS):
+    """Write renditions of a static image into a ``renditions`` folder beside it."""
+    image = load_image(path)
+    directory, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    os.makedirs(os.path.join(directory, 'renditions'), exist_ok=True)
+
+    written = []
+    for width in rendition_widths(image, widths):
+        version = resized(image, width)
+        for fmt in FORMATS:
+            target = os.path.join(directory, 'renditions', f"{stem}-{width}.{fmt}")
+            with open(target, 'wb') as file:
+                file.write(encode(version, fmt))
+            written.append(target)
+    return written
@@ -0,0 +1,114 @@
+"""Database-backed job queue for work that shouldn't run in the request.
+
+Register a function with ``@job`` and call ``enqueue`` from a view. The job
+row is written in the caller's transaction, so the worker only sees it once
+that transaction commits and it is never lost if the request fails later.
+``python manage.py run_jobs`` claims due jobs, retries failures with
+exponential backoff and gives up after ``max_attempts``.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Avg, Count, F, Min
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_DELAY = 10  # seconds; doubles with every failed attempt
+STALE_AFTER = timedelta(minutes=10)  # running this long means the worker died
+
+registry = {}
+
+
+def job(func):
+    """Register ``func`` so it can be enqueued by name."""
+    registry[func.__name__] = func
+    return func
+
+
+def enqueue(name, idempotency_key=None, max_attempts=5, delay=0, **kwargs):
+    """Queue ``registry[name](**kwargs)``; a repeated idempotency key is a no-op."""
+    if name not in registry:
+        raise KeyError(f"Unknown job {name!r}")
+    values = {
+        'name': name,
+        'kwargs': kwargs,
+        'max_attempts': max_attempts,
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+    if idempotency_key is None:
+        return Job.objects.create(**values)
+    job, created = Job.objects.get_or_create(idempotency_key=idempotency_key, defaults=values)
+    return job
+
+
+def claim_next_job():
+    """Mark the next due job as running and return it, or None."""
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=skip_locked)
+            .filter(status=Job.QUEUED, run_at__lte=timezone.now())
+            .order_by('run_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'started_at'])
+    return job
+
+
+def run_job(job):
+    try:
+        registry[job.name](**job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error("Job %s #%s failed permanently", job.name, job.pk)
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+            logger.warning("Job %s #%s failed, retrying at %s", job.name, job.pk, job.run_at)
+    else:
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+        logger.info(
+            "Job %s #%s done in %.3fs (%.3fs after enqueue)", job.name, job.pk,
+            (job.finished_at - job.started_at).total_seconds(),
+            (job.finished_at - job.created_at).total_seconds(),
+        )
+    job.save(update_fields=['status', 'run_at', 'last_error', 'finished_at'])
+
+
+def requeue_stale_jobs():
+    return Job.objects.filter(
+        status=Job.RUNNING, started_at__lt=timezone.now() - STALE_AFTER
+    ).update(status=Job.QUEUED, run_at=timezone.now())
+
+
+def queue_stats(window=timedelta(hours=1)):
+    """Queue depth per status, age of the oldest due job and recent latencies."""
+    now = timezone.now()
+    depth = {code: 0 for code, label in Job.STATUS_CHOICES}
+    depth.update(Job.objects.values_list('status').annotate(count=Count('id')).order_by())
+
+    oldest_due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).aggregate(oldest=Min('run_at'))['oldest']
+    recent = Job.objects.filter(status=Job.DONE, finished_at__gte=now - window).aggregate(
+        wait=Avg(F('started_at') - F('created_at')),
+        run=Avg(F('finished_at') - F('started_at')),
+    )
+    return {
+        'depth': {dict(Job.STATUS_CHOICES)[code]: count for code, count in depth.items()},
+        'oldest_due_seconds': (now - oldest_due).total_seconds() if oldest_due else 0,
+        'avg_wait_seconds': recent['wait'].total_seconds() if recent['wait'] else 0,
+        'avg_run_seconds': recent['run'].total_seconds() if recent['run'] else 0,
+    }
@@ -0,0 +1,42 @@
+import csv
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.analytics import EXPORT_GROUPS, export_history
+
+
+class Command(BaseCommand):
+    help = "Aggregate raw order history for an ad-hoc report and write it as CSV (needs numpy)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day, YYYY-MM-DD (default: 90 days ago)")
+        parser.add_argument('--end', help="Last day, YYYY-MM-DD (default: today)")
+        parser.add_argument('--by', choices=EXPORT_GROUPS, default='day')
+        parser.add_argument('--output', help="CSV file to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        start = parse_date(options['start']) if options['start'] else today - timedelta(days=89)
+        end = parse_date(options['end']) if options['end'] else today
+        if start is None or end is None:
+            raise CommandError("Dates must be YYYY-MM-DD")
+
+        try:
+            rows = export_history(start, end, by=options['by'])
+        except ImportError:
+            raise CommandError("analytics_export needs numpy: pip install numpy")
+
+        fieldnames = [options['by'], 'lines', 'quantity', 'revenue']
+        if options['output']:
+            with open(options['output'], 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(rows)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(rows)} rows to {options['output']}"))
+        else:
+            writer = csv.DictWriter(self.stdout, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
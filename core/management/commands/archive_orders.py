@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.archive import BATCH_SIZE, archivable_orders, archive_batch, archive_cutoff
+
+
+class Command(BaseCommand):
+    help = "Move delivered and cancelled orders older than --days into the archive tables, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_ARCHIVE_AFTER_DAYS,
+                            help="Archive finished orders created more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int,
+                            help="Stop after this many batches; the next run carries on from there")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to go easy on a busy database")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the orders that would move")
+
+    def handle(self, *args, **options):
+        before = archive_cutoff(options['days'])
+        if options['dry_run']:
+            count = archivable_orders(before).count()
+            self.stdout.write(f"{count} orders created before {before:%Y-%m-%d %H:%M} would be archived")
+            return
+
+        total = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            moved = archive_batch(before, options['batch_size'])
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            self.stdout.write(f"Archived {total} orders")
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} orders created before {before:%Y-%m-%d %H:%M}"))
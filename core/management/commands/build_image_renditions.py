@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.images import build_pizza_renditions, build_static_renditions
+from core.models import Pizza
+
+CAROUSEL_DIR = Path(__file__).resolve().parents[2] / 'static' / 'core' / 'carousel'
+
+
+def _build(pizza_id):
+    # Runs in a worker process
+    pizza = Pizza.objects.get(pk=pizza_id)
+    fields = build_pizza_renditions(pizza)
+    Pizza.objects.filter(pk=pizza_id).update(**fields)
+
+
+class Command(BaseCommand):
+    help = "Backfill resized WebP/JPEG renditions for pizza images using a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Rebuild pizzas that already have renditions")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument('--static', action='store_true', help="Also rebuild the home page carousel renditions")
+
+    def handle(self, *args, **options):
+        pizzas = Pizza.objects.exclude(image='')
+        if not options['force']:
+            pizzas = pizzas.filter(image_renditions={})
+        pizza_ids = list(pizzas.values_list('id', flat=True))
+
+        # Don't hand an open database connection to the forked workers
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(_build, pizza_id): f"Pizza #{pizza_id}" for pizza_id in pizza_ids}
+            if options['static']:
+                for path in sorted(CAROUSEL_DIR.glob('*.jpg')):
+                    futures[pool.submit(build_static_renditions, str(path))] = path.name
+
+            failed = 0
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+                else:
+                    self.stdout.write(f"Built renditions for {futures[future]}")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {len(futures) - failed} images ({failed} failed)"))
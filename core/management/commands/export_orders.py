@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import CHUNK_SIZE, EXPORTERS, export_filters, export_orders
+
+
+class Command(BaseCommand):
+    help = "Stream orders to CSV or NDJSON for accounting, in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=EXPORTERS, default='csv')
+        parser.add_argument('--start', help="First day, YYYY-MM-DD")
+        parser.add_argument('--end', help="Last day, YYYY-MM-DD")
+        parser.add_argument('--status', help="Comma-separated status codes, e.g. DL,C")
+        parser.add_argument('--after', help="Resume after this order id")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--output', help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            filters = export_filters(
+                start=options['start'], end=options['end'], status=options['status'], after=options['after']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        stream, content_type = EXPORTERS[options['type']]
+        orders = export_orders(chunk_size=options['chunk_size'], **filters)
+        if options['output']:
+            with open(options['output'], 'w', newline='') as file:
+                file.writelines(stream(orders))
+        else:
+            sys.stdout.writelines(stream(orders))
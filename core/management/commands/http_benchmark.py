@@ -0,0 +1,117 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    body = b''
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            body += (await reader.readexactly(size + 2))[:-2]
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    return status, headers, body
+
+
+async def run_load(url, concurrency, duration, headers=None):
+    """Drive GET requests at ``url`` over keep-alive connections for ``duration`` seconds.
+
+    Returns the list of request latencies in seconds and the error count.
+    """
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else '')
+    request_headers = {'Host': parts.netloc, 'Connection': 'keep-alive', **(headers or {})}
+    request = f"GET {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+    request = request.encode()
+
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                started = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                status, response_headers, body = await read_response(reader)
+                latencies.append(time.perf_counter() - started)
+                if status >= 400:
+                    errors += 1
+                if response_headers.get('connection', '').lower() == 'close':
+                    writer.close()
+                    writer = None
+            except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+                errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests/sec and latency percentiles of running servers, e.g. the sync "
+        "WSGI path (gunicorn chakbites.wsgi) against the async ASGI path "
+        "(uvicorn chakbites.asgi) started with the same number of workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', metavar='URL', help="Endpoints to benchmark, one after another")
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--duration', type=float, default=10, help="Seconds per endpoint")
+        parser.add_argument('--username', help="Send an access token for this user")
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['username']!r} does not exist")
+            headers['Authorization'] = f"Bearer {RefreshToken.for_user(user).access_token}"
+
+        self.stdout.write(f"{'URL':<50} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for url in options['urls']:
+            latencies, errors = asyncio.run(
+                run_load(url, options['concurrency'], options['duration'], headers)
+            )
+            latencies.sort()
+            self.stdout.write(
+                f"{url:<50} {len(latencies) / options['duration']:>9.1f} "
+                f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} {errors:>7}"
+            )
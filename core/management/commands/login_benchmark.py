@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+from core.management.commands.http_benchmark import percentile, read_response, run_load
+from core.perf import PASSWORD, PREFIX
+
+
+async def run_logins(url, concurrency, duration, username, password):
+    """POST credentials to the login endpoint for ``duration`` seconds.
+
+    Returns latencies of successful logins, the number of 429s and the error count.
+    """
+    parts = urlsplit(url)
+    body = json.dumps({'username': username, 'password': password}).encode()
+    request = (
+        f"POST {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: keep-alive\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+
+    latencies = []
+    rejected = errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal rejected, errors
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+                started = time.perf_counter()
+                writer.write(request)
+                await writer.drain()
+                status, headers, _ = await read_response(reader)
+                if status == 429:
+                    rejected += 1
+                    # Back off as the server asks, as a real client would
+                    await asyncio.sleep(float(headers.get('retry-after', 1)))
+                elif status >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+                if headers.get('connection', '').lower() == 'close':
+                    writer.close()
+                    writer = None
+            except (OSError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+                errors += 1
+                if writer is not None:
+                    writer.close()
+                writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, rejected, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure menu read latency on a running server on its own, then while a burst of logins "
+        "runs alongside, and report login throughput and 429s. Run seed_perf_data first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help="Base URL of the server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--readers', type=int, default=10, help="Concurrent menu readers")
+        parser.add_argument('--logins', type=int, default=20, help="Concurrent login clients")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds per phase")
+        parser.add_argument('--username', default=f'{PREFIX}0')
+        parser.add_argument('--password', default=PASSWORD)
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        duration = options['duration']
+
+        async def mixed():
+            return await asyncio.gather(
+                run_load(f"{base}/api/pizzas/", options['readers'], duration),
+                run_logins(f"{base}/api/login/", options['logins'], duration,
+                           options['username'], options['password'])
+            )
+
+        menu_alone, menu_alone_errors = asyncio.run(run_load(f"{base}/api/pizzas/", options['readers'], duration))
+        (menu_mixed, menu_mixed_errors), (logins, rejected, errors) = asyncio.run(mixed())
+
+        self.stdout.write(f"{'phase':<24} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'429s':>6} {'errors':>7}")
+        for name, latencies, phase_rejected, phase_errors in [
+            ('menu alone', menu_alone, 0, menu_alone_errors),
+            ('menu during logins', menu_mixed, 0, menu_mixed_errors),
+            ('logins', logins, rejected, errors),
+        ]:
+            latencies.sort()
+            self.stdout.write(
+                f"{name:<24} {len(latencies) / duration:>9.1f} "
+                f"{percentile(latencies, 0.50) * 1000:>8.1f} {percentile(latencies, 0.95) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} {phase_rejected:>6} {phase_errors:>7}"
+            )
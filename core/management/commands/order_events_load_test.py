@@ -0,0 +1,83 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Open many idle connections to the order event stream of a running ASGI "
+        "server (e.g. uvicorn chakbites.asgi:application) and report how many it holds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api/orders/events/')
+        parser.add_argument('--username', required=True, help="User whose access token the clients use")
+        parser.add_argument('--connections', type=int, default=2000)
+        parser.add_argument('--hold', type=float, default=30, help="Seconds to keep the connections open")
+        parser.add_argument('--ramp', type=int, default=200, help="Connections opened concurrently")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']!r} does not exist")
+        token = str(RefreshToken.for_user(user).access_token)
+
+        url = urlsplit(options['url'])
+        path = f"{url.path}?token={token}"
+        results = asyncio.run(self.run(url.hostname, url.port or 80, path, options))
+
+        opened, failed, alive, connect_times = results
+        connect_times.sort()
+        self.stdout.write(f"Opened {opened}/{options['connections']} streams ({failed} failed)")
+        if connect_times:
+            p50 = connect_times[len(connect_times) // 2] * 1000
+            p99 = connect_times[int(len(connect_times) * 0.99)] * 1000
+            self.stdout.write(f"Time to first byte: p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"{alive} streams still open after {options['hold']}s"))
+
+    async def run(self, host, port, path, options):
+        semaphore = asyncio.Semaphore(options['ramp'])
+        streams = []
+        connect_times = []
+
+        async def connect():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    reader, writer = await asyncio.open_connection(host, port)
+                    writer.write(
+                        f"GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode()
+                    )
+                    await writer.drain()
+                    status_line = await reader.readline()
+                except OSError:
+                    return
+                if b' 200 ' not in status_line:
+                    writer.close()
+                    return
+                connect_times.append(time.perf_counter() - started)
+                streams.append((reader, writer))
+
+        await asyncio.gather(*(connect() for _ in range(options['connections'])))
+        opened = len(streams)
+
+        async def drain(reader):
+            # Read keepalives until the hold period ends; an EOF means the server dropped us
+            while True:
+                if not await reader.read(1024):
+                    return False
+
+        tasks = [asyncio.ensure_future(drain(reader)) for reader, writer in streams]
+        await asyncio.sleep(options['hold'])
+        alive = sum(1 for task in tasks if not task.done())
+        for task in tasks:
+            task.cancel()
+        for reader, writer in streams:
+            writer.close()
+
+        return opened, options['connections'] - opened, alive, connect_times
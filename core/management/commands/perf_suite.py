@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment
+
+from core.perf import FUNNEL, compare, load_fixtures, run_client, run_http
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / 'perf_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the ordering funnel (menu, add_item, cart, checkout, order list, update_status) "
+        "and compare latency and query counts with a stored baseline. Run seed_perf_data first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help="Funnel passes through the test client")
+        parser.add_argument('--url', help="Also load test a running server, e.g. http://127.0.0.1:8000")
+        parser.add_argument('--concurrency', type=int, default=20, help="Virtual users for --url")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds for --url")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help="Allowed p95 slowdown as a fraction of the baseline; query counts must not grow")
+
+    def handle(self, *args, **options):
+        fixtures = load_fixtures()
+        if fixtures is None:
+            raise CommandError("No perf data found; run `manage.py seed_perf_data` first")
+
+        setup_test_environment()  # Allows the test client's host and keeps email in memory
+        results = {'client': run_client(fixtures, options['iterations'])}
+        self.report('Test client', results['client'])
+
+        if options['url']:
+            parts = urlsplit(options['url'])
+            results['http'] = run_http(
+                fixtures, parts.hostname, parts.port or 80, options['concurrency'], options['duration']
+            )
+            self.report(f"HTTP {options['url']}", results['http'])
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(results, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Saved baseline to {baseline_path}"))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; use --save-baseline"))
+            return
+
+        baseline = json.loads(baseline_path.read_text())
+        regressions = []
+        for mode, steps in results.items():
+            regressions += [f"[{mode}] {regression}" for regression in
+                            compare(steps, baseline.get(mode, {}), options['tolerance'])]
+        if regressions:
+            raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def report(self, title, steps):
+        self.stdout.write(f"\n{title}")
+        self.stdout.write(
+            f"{'step':<14} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8} {'errors':>7}"
+        )
+        for step in FUNNEL:
+            if step not in steps:
+                continue
+            row = steps[step]
+            queries = '-' if row['queries'] is None else row['queries']
+            self.stdout.write(
+                f"{step:<14} {row['requests']:>9} {row['rps']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                f"{row['p99_ms']:>8} {queries:>8} {row['errors']:>7}"
+            )
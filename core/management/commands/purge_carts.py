@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.carts import PURGE_BATCH_SIZE, purge_batch, purge_cutoffs, purgeable_carts
+
+
+class Command(BaseCommand):
+    help = "Delete checked-out, empty and abandoned carts with their items, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empty-hours', type=int, default=settings.CART_EMPTY_EXPIRY_HOURS,
+                            help="Delete empty carts untouched for this many hours")
+        parser.add_argument('--idle-days', type=int, default=settings.CART_IDLE_EXPIRY_DAYS,
+                            help="Delete carts with items untouched for this many days")
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int,
+                            help="Stop after this many batches; the next run carries on from there")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Seconds to sleep between batches, to go easy on a busy database")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the carts that would go")
+
+    def handle(self, *args, **options):
+        empty_before, idle_before = purge_cutoffs(options['empty_hours'], options['idle_days'])
+        if options['dry_run']:
+            count = purgeable_carts(empty_before, idle_before).count()
+            self.stdout.write(f"{count} carts would be deleted")
+            return
+
+        carts = items = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            batch_carts, batch_items = purge_batch(empty_before, idle_before, options['batch_size'])
+            if not batch_carts:
+                break
+            carts += batch_carts
+            items += batch_items
+            batches += 1
+            self.stdout.write(f"Deleted {carts} carts")
+            if options['pause']:
+                time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {carts} carts and {items} cart items"))
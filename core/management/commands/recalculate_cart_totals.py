@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Cart, CartItem
+from core.pricing import recalculate_carts
+
+
+class Command(BaseCommand):
+    help = "Recompute stored cart item prices and cart subtotals and report any that have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recomputed values back")
+        parser.add_argument('--all', action='store_true', help="Include checked-out (inactive) carts")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.order_by('id')
+        if not options['all']:
+            carts = carts.filter(active=True)
+        batch_size = options['batch_size']
+
+        stale_items = stale_carts = 0
+        last_id = 0
+        while True:
+            batch = list(carts.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            items = (
+                CartItem.objects.filter(cart__in=batch)
+                .select_related('pizza')
+                .prefetch_related('toppings')
+            )
+            totals = {cart.id: [Decimal('0'), 0] for cart in batch}
+            changed_items = []
+            for item in items:
+                unit_price = item.compute_unit_price()
+                line_total = unit_price * item.quantity
+                if item.unit_price != unit_price or item.line_total != line_total:
+                    self.stdout.write(
+                        f"CartItem #{item.id}: stored {item.unit_price}/{item.line_total}, "
+                        f"expected {unit_price}/{line_total}"
+                    )
+                    item.unit_price = unit_price
+                    item.line_total = line_total
+                    changed_items.append(item)
+                totals[item.cart_id][0] += line_total
+                totals[item.cart_id][1] += 1
+
+            changed_carts = []
+            for cart in batch:
+                subtotal, item_count = totals[cart.id]
+                if cart.subtotal != subtotal or cart.item_count != item_count:
+                    self.stdout.write(
+                        f"Cart #{cart.id}: stored {cart.subtotal} ({cart.item_count} items), "
+                        f"expected {subtotal} ({item_count} items)"
+                    )
+                    changed_carts.append(cart.id)
+
+            stale_items += len(changed_items)
+            stale_carts += len(changed_carts)
+            if options['fix']:
+                CartItem.objects.bulk_update(changed_items, ['unit_price', 'line_total'])
+                recalculate_carts(changed_carts)
+
+        summary = f"{stale_items} cart items and {stale_carts} carts out of date"
+        if options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {summary}"))
+        elif stale_items or stale_carts:
+            raise CommandError(f"{summary}; rerun with --fix to repair")
+        else:
+            self.stdout.write(self.style.SUCCESS("All cart totals are up to date"))
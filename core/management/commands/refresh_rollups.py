@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.analytics import refresh_rollups
+from core.jobs import enqueue
+
+
+class Command(BaseCommand):
+    help = "Bring the sales rollups up to date with orders changed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schedule', action='store_true',
+                            help="Also queue the hourly refresh job, which then keeps rescheduling itself")
+
+    def handle(self, *args, **options):
+        hours = refresh_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {hours} hourly rollups"))
+        if options['schedule']:
+            enqueue('refresh_sales_rollups', idempotency_key='sales-rollups:bootstrap')
+            self.stdout.write("Queued the hourly refresh job; keep `manage.py run_jobs` running")
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import claim_next_job, queue_stats, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help="Exit once no jobs are due")
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--stats', action='store_true', help="Print queue depth and latency, then exit")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in queue_stats().items():
+                self.stdout.write(f"{name}: {value}")
+            return
+
+        processed = 0
+        while True:
+            requeue_stale_jobs()
+            job = claim_next_job()
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            run_job(job)
+            processed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs"))
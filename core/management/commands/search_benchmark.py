@@ -0,0 +1,88 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core.menu_cache import bump_catalog_version
+from core.models import Pizza
+from core.search import search_catalog
+
+from .http_benchmark import percentile
+
+ADJECTIVES = ['spicy', 'smoky', 'classic', 'cheesy', 'garlic', 'tandoori', 'creamy', 'crispy', 'fiery', 'supreme']
+BASES = ['pepperoni', 'margherita', 'chicken', 'veggie', 'mushroom', 'bbq', 'tikka', 'hawaiian', 'beef', 'paneer']
+WORDS = [
+    'mozzarella', 'tomato', 'basil', 'onion', 'olives', 'jalapeno', 'sauce', 'oregano', 'capsicum', 'pineapple',
+    'sausage', 'fajita', 'ranch', 'parmesan', 'cheddar', 'crust', 'thin', 'stuffed', 'wood', 'fired',
+]
+QUERIES = ['pepperoni', 'pep', 'bbq chicken', 'spicy veg', 'mushrom', 'cheddar crust', 'tandoori pan']
+
+
+def synthetic_pizzas(count, rng):
+    for number in range(count):
+        yield Pizza(
+            name=f"{rng.choice(ADJECTIVES).title()} {rng.choice(BASES).title()} {number}",
+            description=' '.join(rng.choice(WORDS) for _ in range(12)),
+            image='',
+            small_price=10,
+            medium_price=20,
+            large_price=30
+        )
+
+
+def icontains_search(query, limit):
+    return list(
+        Pizza.objects.filter(available=True)
+        .filter(Q(name__icontains=query) | Q(description__icontains=query))[:limit]
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the old icontains menu filter with core.search on synthetic catalogs. "
+        "Rows are inserted in a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=20, help="Runs of each query per backend")
+        parser.add_argument('--limit', type=int, default=20)
+
+    def handle(self, *args, **options):
+        backend = 'postgres' if connection.vendor == 'postgresql' else 'index'
+        self.stdout.write(
+            f"{'items':>8} {'backend':<10} {'build ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'hits/query':>11}"
+        )
+        for size in options['sizes']:
+            with transaction.atomic():
+                Pizza.objects.bulk_create(synthetic_pizzas(size, random.Random(size)), batch_size=2000)
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE core_pizza')
+                bump_catalog_version()
+
+                # The first search builds the in-process index; report that separately
+                started = time.perf_counter()
+                search_catalog(QUERIES[0], options['limit'])
+                build = time.perf_counter() - started
+
+                for name, search in [
+                    ('icontains', icontains_search),
+                    (backend, lambda query, limit: search_catalog(query, limit)[0]),
+                ]:
+                    latencies, hits = [], 0
+                    for _ in range(options['repeat']):
+                        for query in QUERIES:
+                            started = time.perf_counter()
+                            hits += len(search(query, options['limit']))
+                            latencies.append(time.perf_counter() - started)
+                    latencies.sort()
+                    self.stdout.write(
+                        f"{size:>8} {name:<10} {build * 1000 if name == backend else 0:>9.1f} "
+                        f"{percentile(latencies, 0.50) * 1000:>8.2f} {percentile(latencies, 0.95) * 1000:>8.2f} "
+                        f"{hits / len(latencies):>11.1f}"
+                    )
+                transaction.set_rollback(True)
+            bump_catalog_version()
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from core.perf import clear, seed
+
+
+class Command(BaseCommand):
+    help = "Create synthetic perf_* users, pizzas, toppings and order history for the perf suite"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--pizzas', type=int, default=30)
+        parser.add_argument('--toppings', type=int, default=15)
+        parser.add_argument('--orders', type=int, default=2000, help="Past orders to spread over --days")
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible data")
+        parser.add_argument('--reset', action='store_true', help="Delete existing perf data first")
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            clear()
+        counts = seed(
+            users=options['users'],
+            pizzas=options['pizzas'],
+            toppings=options['toppings'],
+            orders=options['orders'],
+            days=options['days'],
+            seed=options['seed']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded {users} users, {pizzas} pizzas, {orders} orders with {items} items".format(**counts)
+        ))
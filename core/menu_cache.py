@@ -0,0 +1,68 @@
+"""Versioned cache for the pizza/topping catalog.
+
+Every cached catalog entry is keyed under the current catalog version, and
+the version is replaced whenever a Pizza or Topping is saved or deleted, so
+stale entries are never read again and simply age out of the cache.
+
+The version lives in the default cache, so with several workers that cache
+must be shared (set REDIS_URL). With the local-memory default a version
+bump only reaches the worker that made it, and the others keep serving the
+old menu and ETag until they restart.
+"""
+import time
+
+from django.core.cache import cache
+
+from .metrics import record_cache
+
+VERSION_KEY = 'menu:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Lost or never set: start a fresh version so nothing stale is reused
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def acatalog_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, int(time.time() * 1000), None)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), (cache.get(VERSION_KEY) or 0) + 1), None)
+
+
+def get_or_build(name, builder):
+    key = f"menu:{catalog_version()}:{name}"
+    value = cache.get(key)
+    record_cache(value is not None)
+    if value is None:
+        value = builder()
+        cache.set(key, value, CACHE_TIMEOUT)
+    return value
+
+
+async def aget_or_build(name, builder):
+    """Async get_or_build; ``builder`` is a coroutine function."""
+    key = f"menu:{await acatalog_version()}:{name}"
+    value = await cache.aget(key)
+    record_cache(value is not None)
+    if value is None:
+        value = await builder()
+        await cache.aset(key, value, CACHE_TIMEOUT)
+    return value
+
+
+# Used with django.views.decorators.http.condition for conditional GETs. There
+# is no Last-Modified: at one-second precision two edits in the same second
+# would answer a 304 for the older menu.
+def catalog_etag(request, *args, **kwargs):
+    return f"catalog-{catalog_version()}"
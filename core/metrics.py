@@ -0,0 +1,161 @@
+"""Per-request timing, query and cache metrics.
+
+RequestMetricsMiddleware (core/middleware.py) starts a RequestMetrics for
+each request. Every database connection gets an execute wrapper that adds
+its queries to the current request, including ORM calls made from async
+views, since the request is held in a context variable. Finished requests
+are folded into per-route histograms kept in memory (one set per worker
+process) and rendered in the Prometheus text format by /api/_metrics.
+"""
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+N_PLUS_ONE_THRESHOLD = 5  # Same SQL this many times in one request looks like an N+1
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = Counter()  # SQL with placeholders -> times run
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count in self.queries.values() if count > 1)
+
+    def repeated_queries(self, threshold=N_PLUS_ONE_THRESHOLD):
+        return [(sql, count) for sql, count in self.queries.most_common() if count >= threshold]
+
+
+def start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries[sql] += 1
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Connected to connection_created in CoreConfig.ready
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache(hit):
+    metrics = _current.get()
+    if metrics is not None:
+        if hit:
+            metrics.cache_hits += 1
+        else:
+            metrics.cache_misses += 1
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Registry:
+    """Aggregated metrics per (route, method), safe to update from several threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+            self.db_durations = defaultdict(float)
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+            self.duplicate_queries = defaultdict(int)
+            self.n_plus_one = defaultdict(int)
+            self.cache = defaultdict(int)
+            self.responses = defaultdict(int)
+
+    def observe(self, route, method, status, metrics, seconds):
+        key = (route, method)
+        with self.lock:
+            self.durations[key].observe(seconds)
+            self.db_durations[key] += metrics.db_time
+            self.queries[key].observe(metrics.query_count)
+            self.duplicate_queries[key] += metrics.duplicate_queries
+            if metrics.repeated_queries():
+                self.n_plus_one[key] += 1
+            self.cache[key + ('hit',)] += metrics.cache_hits
+            self.cache[key + ('miss',)] += metrics.cache_misses
+            self.responses[key + (status,)] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            def histogram(name, help_text, histograms):
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+                for (route, method), values in sorted(histograms.items()):
+                    for bound, count in zip(values.buckets, values.counts):
+                        lines.append(f"{name}_bucket{_labels(route=route, method=method, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{_labels(route=route, method=method, le='+Inf')} {values.count}")
+                    lines.append(f"{name}_sum{_labels(route=route, method=method)} {values.sum}")
+                    lines.append(f"{name}_count{_labels(route=route, method=method)} {values.count}")
+
+            def counter(name, help_text, values, *extra):
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter"])
+                for key, value in sorted(values.items()):
+                    labels = dict(zip(('route', 'method') + extra, key))
+                    lines.append(f"{name}{_labels(**labels)} {value}")
+
+            histogram('chakbites_request_duration_seconds', 'Wall time per request.', self.durations)
+            histogram('chakbites_request_queries', 'Database queries per request.', self.queries)
+            counter('chakbites_db_duration_seconds_total', 'Time spent in database queries.', self.db_durations)
+            counter('chakbites_duplicate_queries_total', 'Queries that repeated an earlier query in the same request.',
+                    self.duplicate_queries)
+            counter('chakbites_n_plus_one_requests_total',
+                    f'Requests that ran the same query at least {N_PLUS_ONE_THRESHOLD} times.', self.n_plus_one)
+            counter('chakbites_cache_requests_total', 'Application cache lookups.', self.cache, 'result')
+            counter('chakbites_responses_total', 'Responses by status code.', self.responses, 'status')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
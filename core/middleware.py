@@ -0,0 +1,72 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import end_request, registry, start_request
+
+logger = logging.getLogger('core.metrics')
+
+
+class RequestMetricsMiddleware:
+    """Time each request, count its queries and cache lookups, and report them.
+
+    Adds a Server-Timing header, logs one line per request at DEBUG (and a
+    warning for likely N+1 queries) and feeds the per-route histograms
+    served by /api/_metrics. Works for both sync and async views.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        seconds = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        route = (match.view_name or match.route) if match else 'unmatched'
+
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={seconds * 1000:.1f}',
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+            f'cache;desc="{metrics.cache_hits} hits, {metrics.cache_misses} misses"',
+        ])
+        registry.observe(route, request.method, response.status_code, metrics, seconds)
+
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': response.status_code,
+            'total_ms': round(seconds * 1000, 1),
+            'db_ms': round(metrics.db_time * 1000, 1),
+            'queries': metrics.query_count,
+            'duplicate_queries': metrics.duplicate_queries,
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+        }
+        logger.debug(' '.join(f'{name}={value}' for name, value in fields.items()), extra={'metrics': fields})
+        for sql, count in metrics.repeated_queries():
+            logger.warning('Possible N+1 on %s: %d x %s', route, count, sql[:300])
+        return response
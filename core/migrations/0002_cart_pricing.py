@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:00
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+SIZE_PRICE_FIELDS = {'S': 'small_price', 'M': 'medium_price', 'L': 'large_price'}
+
+
+def backfill_cart_prices(apps, schema_editor):
+    Cart = apps.get_model('core', 'Cart')
+    CartItem = apps.get_model('core', 'CartItem')
+
+    items = CartItem.objects.select_related('pizza').prefetch_related('toppings')
+    for item in items.iterator(chunk_size=500):
+        base_price = getattr(item.pizza, SIZE_PRICE_FIELDS[item.size])
+        item.unit_price = base_price + sum((t.price for t in item.toppings.all()), Decimal('0'))
+        item.line_total = item.unit_price * item.quantity
+        item.save(update_fields=['unit_price', 'line_total'])
+
+    for cart in Cart.objects.iterator(chunk_size=500):
+        line_totals = list(CartItem.objects.filter(cart=cart).values_list('line_total', flat=True))
+        cart.subtotal = sum(line_totals, Decimal('0'))
+        cart.item_count = len(line_totals)
+        cart.save(update_fields=['subtotal', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=7),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='line_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=7),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(backfill_cart_prices, migrations.RunPython.noop),
+    ]
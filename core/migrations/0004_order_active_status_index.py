@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_order_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status__in', ['P', 'PR', 'OD'])), fields=['status', 'created_at'], name='order_active_status_idx'),
+        ),
+    ]
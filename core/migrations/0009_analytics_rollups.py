@@ -0,0 +1,87 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_pizza_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PizzaSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('period_start', models.DateTimeField()),
+                ('size', models.CharField(choices=[('S', 'Small'), ('M', 'Medium'), ('L', 'Large')], max_length=1)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('period_start', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('cancelled_orders', models.PositiveIntegerField(default=0)),
+                ('pizzas_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('delivery_fees', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ToppingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('period_start', models.DateTimeField()),
+                ('pizzas', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='pizzasalesrollup',
+            name='pizza',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.pizza'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'period_start'), name='sales_rollup_period_unique'),
+        ),
+        migrations.AddField(
+            model_name='toppingrollup',
+            name='topping',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.topping'),
+        ),
+        migrations.AddConstraint(
+            model_name='pizzasalesrollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'period_start', 'pizza', 'size'), name='pizza_rollup_period_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='toppingrollup',
+            constraint=models.UniqueConstraint(fields=('granularity', 'period_start', 'topping'), name='topping_rollup_period_unique'),
+        ),
+    ]
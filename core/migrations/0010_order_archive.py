@@ -0,0 +1,54 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_analytics_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_type', models.CharField(choices=[('D', 'Delivery'), ('O', 'On-Spot')], max_length=1)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('PR', 'Preparing'), ('OD', 'Out for Delivery'), ('DL', 'Delivered'), ('C', 'Cancelled')], max_length=2)),
+                ('delivery_address', models.TextField(blank=True, null=True)),
+                ('delivery_fee', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('estimated_delivery_time', models.CharField(blank=True, max_length=50)),
+                ('payment_method', models.CharField(default='Cash on Delivery', max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=7)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('notes', models.TextField(blank=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('size', models.CharField(choices=[('S', 'Small'), ('M', 'Medium'), ('L', 'Large')], max_length=1)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.archivedorder')),
+                ('pizza', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.pizza')),
+                ('toppings', models.ManyToManyField(blank=True, to='core.topping')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', 'created_at'], name='archived_order_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at'], name='archived_order_created_idx'),
+        ),
+    ]
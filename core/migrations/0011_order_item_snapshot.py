@@ -0,0 +1,74 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:36
+
+from decimal import Decimal
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_snapshots(apps, schema_editor):
+    # The catalog as it is now is the best record left of older orders; the
+    # unit price comes from the stored line price, which is exact
+    for model_name in ('OrderItem', 'ArchivedOrderItem'):
+        model = apps.get_model('core', model_name)
+        last_id = 0
+        while True:
+            items = list(
+                model.objects.filter(id__gt=last_id, pizza_name='')
+                .select_related('pizza').prefetch_related('toppings')
+                .order_by('id')[:BATCH_SIZE]
+            )
+            if not items:
+                break
+            for item in items:
+                item.pizza_name = item.pizza.name
+                item.unit_price = (item.price / (item.quantity or 1)).quantize(Decimal('0.01'))
+                item.topping_snapshot = [
+                    {'id': topping.id, 'name': topping.name, 'price': topping.price}
+                    for topping in item.toppings.all()
+                ]
+            model.objects.bulk_update(items, ['pizza_name', 'unit_price', 'topping_snapshot'])
+            last_id = items[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='pizza_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='topping_snapshot',
+            field=models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='pizza_name',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='topping_snapshot',
+            field=models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=6),
+        ),
+        migrations.RunPython(backfill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def deactivate_duplicate_carts(apps, schema_editor):
+    # Keep each user's most recently touched active cart; the others become
+    # inactive, like a checked-out cart, and purge_carts removes them
+    Cart = apps.get_model('core', 'Cart')
+    users = (
+        Cart.objects.filter(active=True).values('user_id')
+        .annotate(carts=models.Count('id')).filter(carts__gt=1).values_list('user_id', flat=True)
+    )
+    for user_id in list(users):
+        carts = Cart.objects.filter(user_id=user_id, active=True).order_by('-updated_at', '-id')
+        Cart.objects.filter(id__in=list(carts.values_list('id', flat=True)[1:])).update(active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_claims_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('active', True)), fields=('user',), name='cart_one_active_per_user'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:53
+
+import re
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def convert_estimates(apps, schema_editor):
+    # Old orders carry text like "30-45 minutes", counted from when they were placed
+    for model_name in ('Order', 'ArchivedOrder'):
+        model = apps.get_model('core', model_name)
+        estimates = model.objects.exclude(estimated_delivery_time='').values_list('estimated_delivery_time', flat=True)
+        for text in set(estimates):
+            match = re.match(r'\s*(\d+)\s*-\s*(\d+)\s*min', text)
+            if match:
+                model.objects.filter(estimated_delivery_time=text).update(
+                    eta_earliest=models.F('created_at') + timedelta(minutes=int(match[1])),
+                    eta_latest=models.F('created_at') + timedelta(minutes=int(match[2]))
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_cart_one_active_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='eta_earliest',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='eta_latest',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='eta_earliest',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='eta_latest',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pizza',
+            name='prep_minutes',
+            field=models.PositiveSmallIntegerField(default=12),
+        ),
+        migrations.RunPython(convert_estimates, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='archivedorder',
+            name='estimated_delivery_time',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='estimated_delivery_time',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:58
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_delivery_eta'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(blank=True, choices=[('P', 'Pending'), ('PR', 'Preparing'), ('OD', 'Out for Delivery'), ('DL', 'Delivered'), ('C', 'Cancelled')], max_length=2)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('PR', 'Preparing'), ('OD', 'Out for Delivery'), ('DL', 'Delivered'), ('C', 'Cancelled')], max_length=2)),
+                ('stage_seconds', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='status_events', to='core.order')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['order', 'created_at'], name='status_event_order_idx'), models.Index(fields=['from_status', 'created_at'], include=('stage_seconds',), name='status_event_stage_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_order_status_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='pizza',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.pizza'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='pizza',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.pizza'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_order_item_pizza_set_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenRevocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField()),
+                ('jti', models.CharField(blank=True, max_length=255)),
+                ('revoked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['revoked_at'], name='token_revocation_revoked_idx'), models.Index(fields=['expires_at'], name='token_revocation_expires_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,10 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import F, Q
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
 from django.utils import timezone
 
@@ -19,6 +24,44 @@ class UserProfile(models.Model):
     def __str__(self):
         return self.user.username
 
+class ClaimsUser(User):
+    """A User built from access-token claims by core.auth, without a query.
+    
+    Only id, username, is_staff and is_active are loaded. Touching any other
+    field fills in the whole row from core.auth's short-lived row cache, so
+    treat it as read-only: fetch a fresh User before changing the row.
+    """
+    
+    class Meta:
+        proxy = True
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if from_queryset is not None or not fields or not set(fields) <= deferred:
+            return super().refresh_from_db(using, fields, from_queryset)
+        from .auth import load_user_row
+        row = load_user_row(self.pk)
+        for name in deferred:
+            setattr(self, name, row[name])
+
+class TokenRevocation(models.Model):
+    """Access tokens refused before they expire: one token, or every token a user had so far.
+    
+    Kept in the database, where nothing evicts it, and read by each process
+    every few seconds (see core.auth.RevocationList).
+    """
+    
+    user_id = models.BigIntegerField()  # Not a foreign key, so a deleted user's tokens stay revoked
+    jti = models.CharField(max_length=255, blank=True)  # Blank for every token issued up to revoked_at
+    revoked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['revoked_at'], name='token_revocation_revoked_idx'),
+            models.Index(fields=['expires_at'], name='token_revocation_expires_idx'),
+        ]
+
 class Pizza(models.Model):
     SIZE_CHOICES = [
         ('S', 'Small'),
@@ -34,6 +77,40 @@ class Pizza(models.Model):
     large_price = models.DecimalField(max_digits=5, decimal_places=2)
     available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Filled in from the uploaded image by core.images on save
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_placeholder = models.TextField(blank=True, editable=False)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Minutes one of these takes to prepare; the baseline for delivery ETAs (see core/delivery.py)
+    prep_minutes = models.PositiveSmallIntegerField(default=12)
+    
+    def image_rendition_urls(self, fmt):
+        renditions = self.image_renditions.get(fmt, {})
+        return [
+            (int(width), default_storage.url(name))
+            for width, name in sorted(renditions.items(), key=lambda rendition: int(rendition[0]))
+        ]
+    
+    def image_srcset(self, fmt):
+        return ', '.join(f"{url} {width}w" for width, url in self.image_rendition_urls(fmt))
+    
+    @property
+    def image_fallback_url(self):
+        # Largest JPEG rendition for browsers without srcset, not the raw upload
+        urls = self.image_rendition_urls('jpeg')
+        return urls[-1][1] if urls else self.image.url
+    
+    @property
+    def webp_srcset(self):
+        return self.image_srcset('webp')
+    
+    @property
+    def jpeg_srcset(self):
+        return self.image_srcset('jpeg')
+    
+    def get_size_price(self, size):
+        return getattr(self, f"{dict(self.SIZE_CHOICES)[size].lower()}_price")
     
     def __str__(self):
         return self.name
@@ -51,6 +128,23 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     active = models.BooleanField(default=True)
+    subtotal = models.DecimalField(max_digits=7, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # One active cart per user; checked-out carts stay inactive until purged
+            models.UniqueConstraint(fields=['user'], condition=Q(active=True), name='cart_one_active_per_user'),
+        ]
+    
+    def apply_delta(self, subtotal_delta, count_delta=0):
+        # Atomic in-place update so concurrent cart edits don't lose increments
+        Cart.objects.filter(pk=self.pk).update(
+            subtotal=F('subtotal') + subtotal_delta,
+            item_count=F('item_count') + count_delta,
+            updated_at=timezone.now()
+        )
+        self.refresh_from_db(fields=['subtotal', 'item_count', 'updated_at'])
     
     def __str__(self):
         return f"Cart for {self.user.username}"
@@ -62,11 +156,21 @@ class CartItem(models.Model):
     toppings = models.ManyToManyField(Topping, blank=True)
     quantity = models.PositiveIntegerField(default=1)
     notes = models.TextField(blank=True)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    line_total = models.DecimalField(max_digits=7, decimal_places=2, default=0)
+    
+    def compute_unit_price(self, toppings=None):
+        if toppings is None:
+            toppings = self.toppings.all()
+        base_price = self.pizza.get_size_price(self.size)
+        return base_price + sum((topping.price for topping in toppings), Decimal('0'))
+    
+    def set_price(self, unit_price):
+        self.unit_price = unit_price
+        self.line_total = unit_price * int(self.quantity)
     
     def get_price(self):
-        base_price = getattr(self.pizza, f"{self.size.lower()}_price")
-        toppings_price = sum(topping.price for topping in self.toppings.all())
-        return (base_price + toppings_price) * self.quantity
+        return self.line_total
     
     def __str__(self):
         return f"{self.quantity}x {self.pizza.name} ({self.size})"
@@ -85,28 +189,266 @@ class Order(models.Model):
         ('C', 'Cancelled'),
     ]
     
+    # Statuses the kitchen still has to act on
+    ACTIVE_STATUSES = ['P', 'PR', 'OD']
+    
+    # Where each status may go next (see core/order_status.py); Delivered and Cancelled are final
+    TRANSITIONS = {
+        'P': ['PR', 'C'],
+        'PR': ['OD', 'DL', 'C'],
+        'OD': ['DL', 'C'],
+        'DL': [],
+        'C': [],
+    }
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     order_type = models.CharField(max_length=1, choices=ORDER_TYPE_CHOICES)
     status = models.CharField(max_length=2, choices=STATUS_CHOICES, default='P')
     delivery_address = models.TextField(blank=True, null=True)
     delivery_fee = models.DecimalField(max_digits=5, decimal_places=2, default=0)
-    estimated_delivery_time = models.CharField(max_length=50, blank=True)
+    # Window the order should arrive in, or be ready in for on-spot orders (see core/delivery.py)
+    eta_earliest = models.DateTimeField(null=True, blank=True)
+    eta_latest = models.DateTimeField(null=True, blank=True)
     payment_method = models.CharField(max_length=20, default='Cash on Delivery')
     total_amount = models.DecimalField(max_digits=7, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+            # Small index over just the live orders, so the kitchen board stays
+            # fast however many delivered/cancelled orders pile up
+            models.Index(
+                fields=['status', 'created_at'],
+                condition=models.Q(status__in=['P', 'PR', 'OD']),
+                name='order_active_status_idx'
+            ),
+            # Used by the analytics rollups: changed orders since the watermark,
+            # then every order in the affected hours
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
+    
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
-class OrderItem(models.Model):
+class OrderStatusEvent(models.Model):
+    """One status change of an order, written in the same transaction (see core/order_status.py).
+    
+    Append-only. The order link has no database constraint, so the log
+    outlives archival; archived orders keep their ids.
+    """
+    
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                              related_name='status_events')
+    from_status = models.CharField(max_length=2, choices=Order.STATUS_CHOICES, blank=True)  # Blank when placed
+    status = models.CharField(max_length=2, choices=Order.STATUS_CHOICES)
+    stage_seconds = models.PositiveIntegerField(null=True, blank=True)  # Time spent in from_status
+    actor = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, db_index=False, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['order', 'created_at'], name='status_event_order_idx'),
+            # Stage latency reports scan only this index on PostgreSQL
+            models.Index(fields=['from_status', 'created_at'], include=['stage_seconds'], name='status_event_stage_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order status events are append-only")
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status or '-'} -> {self.status}"
+
+class OrderItemSnapshot(models.Model):
+    """What was ordered, copied from the catalog once at checkout.
+    
+    Order history renders from these columns alone, so it needs no joins
+    into Pizza/Topping and still shows what the customer paid after the
+    menu changes. The pizza and toppings relations stay for reordering
+    and the analytics rollups; deleting a pizza or topping only unlinks it.
+    """
+    
+    pizza_name = models.CharField(max_length=100, blank=True)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2, default=0)
+    # [{"id": 3, "name": "Olives", "price": "40.00"}, ...]
+    topping_snapshot = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    
+    class Meta:
+        abstract = True
+    
+    @property
+    def topping_names(self):
+        return [topping['name'] for topping in self.topping_snapshot]
+    
+    def __str__(self):
+        return f"{self.quantity}x {self.pizza_name} ({self.size})"
+
+class OrderItem(OrderItemSnapshot):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE)
+    pizza = models.ForeignKey(Pizza, null=True, blank=True, on_delete=models.SET_NULL)
     size = models.CharField(max_length=1, choices=Pizza.SIZE_CHOICES)
     toppings = models.ManyToManyField(Topping, blank=True)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=6, decimal_places=2)
+
+class IdempotencyKey(models.Model):
+    """Checkout response stored under the client's Idempotency-Key, replayed on retries."""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_unique'),
+        ]
     
     def __str__(self):
-        return f"{self.quantity}x {self.pizza.name} ({self.size})"
\ No newline at end of file
+        return f"{self.key} ({self.user.username})"
+
+class Job(models.Model):
+    """Deferred work run by the ``run_jobs`` worker (see core/jobs.py)."""
+    
+    QUEUED = 'Q'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=QUEUED)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+class SalesRollup(models.Model):
+    """Order totals per hour or day, kept current by core.analytics.refresh_rollups."""
+    
+    HOUR = 'H'
+    DAY = 'D'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+    
+    granularity = models.CharField(max_length=1, choices=GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    orders = models.PositiveIntegerField(default=0)
+    cancelled_orders = models.PositiveIntegerField(default=0)
+    pizzas_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    delivery_fees = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['granularity', 'period_start'], name='sales_rollup_period_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_granularity_display()} {self.period_start:%Y-%m-%d %H:%M}"
+
+class PizzaSalesRollup(models.Model):
+    granularity = models.CharField(max_length=1, choices=SalesRollup.GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE)
+    size = models.CharField(max_length=1, choices=Pizza.SIZE_CHOICES)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'period_start', 'pizza', 'size'], name='pizza_rollup_period_unique'
+            ),
+        ]
+
+class ToppingRollup(models.Model):
+    granularity = models.CharField(max_length=1, choices=SalesRollup.GRANULARITY_CHOICES)
+    period_start = models.DateTimeField()
+    topping = models.ForeignKey(Topping, on_delete=models.CASCADE)
+    pizzas = models.PositiveIntegerField(default=0)  # Pizzas sold with this topping
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'period_start', 'topping'], name='topping_rollup_period_unique'
+            ),
+        ]
+
+class AnalyticsWatermark(models.Model):
+    """How far the rollups have been brought up to date."""
+    
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+class ArchivedOrder(models.Model):
+    """A finished order moved out of Order by ``manage.py archive_orders`` (see core/archive.py).
+    
+    Same columns and the same id as the original, so serializers and
+    templates render either kind of order alike.
+    """
+    
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders')
+    order_type = models.CharField(max_length=1, choices=Order.ORDER_TYPE_CHOICES)
+    status = models.CharField(max_length=2, choices=Order.STATUS_CHOICES)
+    delivery_address = models.TextField(blank=True, null=True)
+    delivery_fee = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+    eta_earliest = models.DateTimeField(null=True, blank=True)
+    eta_latest = models.DateTimeField(null=True, blank=True)
+    payment_method = models.CharField(max_length=20, default='Cash on Delivery')
+    total_amount = models.DecimalField(max_digits=7, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    notes = models.TextField(blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_order_user_idx'),
+            models.Index(fields=['created_at'], name='archived_order_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Order #{self.id} by {self.user.username} (archived)"
+
+class ArchivedOrderItem(OrderItemSnapshot):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    pizza = models.ForeignKey(Pizza, null=True, blank=True, on_delete=models.SET_NULL)
+    size = models.CharField(max_length=1, choices=Pizza.SIZE_CHOICES)
+    toppings = models.ManyToManyField(Topping, blank=True)
+    quantity = models.PositiveIntegerField(default=1)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
\ No newline at end of file
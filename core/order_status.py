@@ -0,0 +1,181 @@
+"""Order status changes, checked against a state machine and logged.
+
+``change_status``, or ``change_statuses`` for a batch from the kitchen
+board, is the one way an order's status moves on. It locks the order,
+rejects moves Order.TRANSITIONS doesn't allow, such as Delivered back to
+Pending, and appends an OrderStatusEvent in the same transaction: the new
+status, who made the change and how long the order sat in the status it
+left. ``stage_latencies`` reads those durations back through the
+(from_status, created_at) index, which on PostgreSQL also carries
+stage_seconds, so a report never touches the table itself.
+"""
+from django.db import connection, transaction
+from django.db.models import Aggregate, Count, FloatField, Max
+from django.utils import timezone
+
+from .models import Order, OrderStatusEvent
+
+# Statuses an order waits in, i.e. the stages worth timing
+STAGES = Order.ACTIVE_STATUSES
+PERCENTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+class PercentileCont(Aggregate):
+    # PostgreSQL's ordered-set aggregate; ``fraction`` is one of our own constants, never user input
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def allowed_statuses(order):
+    """Statuses ``order`` may move to next."""
+    allowed = Order.TRANSITIONS[order.status]
+    if order.status == 'PR':
+        # Deliveries go out for delivery before they are delivered; on-spot orders never do
+        skipped = 'DL' if order.order_type == 'D' else 'OD'
+        allowed = [status for status in allowed if status != skipped]
+    return allowed
+
+
+def record_placed(order, actor):
+    """Log a new order's first status. Call in the transaction that created it."""
+    return OrderStatusEvent.objects.create(order=order, status=order.status, actor=actor, created_at=order.created_at)
+
+
+def _invalid_transition(order, new_status):
+    status_labels = dict(Order.STATUS_CHOICES)
+    return f"Can't move an order from {status_labels[order.status]} to {status_labels.get(new_status, new_status)}"
+
+
+def _stage_seconds(order, stage_started, now):
+    if stage_started is None:
+        # Placed before the log existed: updated_at is the last status change
+        stage_started = order.created_at if order.status == 'P' else order.updated_at
+    return max(int((now - stage_started).total_seconds()), 0)
+
+
+def change_status(order, new_status, actor=None):
+    """Move ``order`` to ``new_status`` and log the change; returns the OrderStatusEvent.
+
+    Raises InvalidTransition if the order can't go there from its current status.
+    """
+    with transaction.atomic():
+        # Re-read under the lock, so two staff members can't both move the same order on
+        current = Order.objects.select_for_update().filter(pk=order.pk).values('status', 'updated_at').get()
+        order.status, order.updated_at = current['status'], current['updated_at']
+        if new_status not in allowed_statuses(order):
+            raise InvalidTransition(_invalid_transition(order, new_status))
+
+        now = timezone.now()
+        stage_started = (
+            OrderStatusEvent.objects.filter(order=order).order_by('-created_at')
+            .values_list('created_at', flat=True).first()
+        )
+        event = OrderStatusEvent.objects.create(
+            order=order,
+            from_status=order.status,
+            status=new_status,
+            stage_seconds=_stage_seconds(order, stage_started, now),
+            actor=actor,
+            created_at=now
+        )
+        order.status = new_status
+        order.save(update_fields=['status', 'updated_at'])
+    return event
+
+
+def change_statuses(order_ids, new_status, actor=None):
+    """Move each of ``order_ids`` that may go to ``new_status`` there, logging every change.
+
+    Each order is checked on its own, as by ``change_status``, and the moves
+    are written with one UPDATE and one bulk insert of events. Returns the
+    moved orders, each with the OrderStatusEvent it logged as
+    ``status_event``, and a dict of order id -> reason for the orders left
+    as they were.
+    """
+    with transaction.atomic():
+        # Locked in id order, so overlapping batches queue rather than deadlock
+        orders = list(Order.objects.select_for_update().filter(id__in=order_ids).order_by('id'))
+        found = {order.pk for order in orders}
+        rejected = {order_id: 'Order not found' for order_id in order_ids if order_id not in found}
+        moving = []
+        for order in orders:
+            if new_status in allowed_statuses(order):
+                moving.append(order)
+            else:
+                rejected[order.pk] = _invalid_transition(order, new_status)
+        if not moving:
+            return [], rejected
+
+        now = timezone.now()
+        stage_started = dict(
+            OrderStatusEvent.objects.filter(order__in=moving).values('order')
+            .annotate(latest=Max('created_at')).values_list('order', 'latest').order_by()
+        )
+        events = OrderStatusEvent.objects.bulk_create([
+            OrderStatusEvent(
+                order=order,
+                from_status=order.status,
+                status=new_status,
+                stage_seconds=_stage_seconds(order, stage_started.get(order.pk), now),
+                actor=actor,
+                created_at=now
+            )
+            for order in moving
+        ])
+        Order.objects.filter(id__in=[order.pk for order in moving]).update(status=new_status, updated_at=now)
+        for order, event in zip(moving, events):
+            order.status, order.updated_at, order.status_event = new_status, now, event
+    return moving, rejected
+
+
+def _percentile_cont(ordered, fraction):
+    # Interpolated like PERCENTILE_CONT, so both backends report the same figures
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def stage_latencies(period_from, period_to):
+    """Seconds spent in each stage by orders that left it between ``period_from`` and ``period_to``."""
+    events = OrderStatusEvent.objects.filter(
+        from_status__in=STAGES, created_at__gte=period_from, created_at__lt=period_to
+    )
+    if connection.vendor == 'postgresql':
+        rows = {
+            row['from_status']: row
+            for row in events.values('from_status').annotate(
+                count=Count('*'),
+                **{name: PercentileCont('stage_seconds', fraction) for name, fraction in PERCENTILES.items()}
+            ).order_by()
+        }
+    else:
+        durations = {stage: [] for stage in STAGES}
+        for stage, seconds in events.values_list('from_status', 'stage_seconds'):
+            durations[stage].append(seconds)
+        rows = {}
+        for stage, values in durations.items():
+            if values:
+                values.sort()
+                rows[stage] = {'count': len(values), **{
+                    name: _percentile_cont(values, fraction) for name, fraction in PERCENTILES.items()
+                }}
+
+    status_labels = dict(Order.STATUS_CHOICES)
+    return [
+        {
+            'stage': stage,
+            'label': status_labels[stage],
+            'count': rows[stage]['count'] if stage in rows else 0,
+            **{name: rows[stage][name] if stage in rows else None for name in PERCENTILES},
+        }
+        for stage in STAGES
+    ]
@@ -0,0 +1,10 @@
+from rest_framework.pagination import CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    # Keyset pagination over (created_at, id), newest first; served by the
+    # (user, created_at) and (status, created_at) indexes on Order
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
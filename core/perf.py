@@ -0,0 +1,290 @@
+"""Synthetic data and the ordering funnel used by the performance suite.
+
+``manage.py seed_perf_data`` fills the database, ``manage.py perf_suite``
+drives the funnel through the Django test client (latency and query
+counts) or over HTTP against a running server (throughput and latency),
+and compares the result with a stored baseline.
+"""
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .auth import issue_tokens
+from .management.commands.http_benchmark import percentile, read_response
+from .models import Order, OrderItem, Pizza, Topping, UserProfile
+
+PREFIX = 'perf_'
+PASSWORD = 'perf-password'
+STAFF_USERNAME = f'{PREFIX}staff'
+
+FUNNEL = ['menu', 'add_item', 'cart', 'checkout', 'order_list', 'update_status']
+
+
+def seed(users=50, pizzas=30, toppings=15, orders=2000, days=90, seed=0):
+    """Create perf_* users, pizzas, toppings and order history. Returns the counts."""
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)  # Hash once; hashing per user would dominate seeding
+    now = timezone.now()
+
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'{PREFIX}{number}', email=f'{PREFIX}{number}@example.com', password=password)
+             for number in range(users)]
+            + [User(username=STAFF_USERNAME, password=password, is_staff=True)],
+            ignore_conflicts=True
+        )
+        customers = list(User.objects.filter(username__startswith=PREFIX, is_staff=False))
+        UserProfile.objects.bulk_create(
+            [UserProfile(user=user, phone='+923001234567', address=f'{user.pk} Perf Street') for user in customers],
+            ignore_conflicts=True
+        )
+
+        Topping.objects.bulk_create([
+            Topping(name=f'Perf Topping {number}', price=Decimal(rng.randint(30, 99)))
+            for number in range(toppings)
+        ])
+        Pizza.objects.bulk_create([
+            Pizza(
+                name=f'Perf Pizza {number}',
+                description='Synthetic pizza for load testing',
+                image='pizzas/perf.jpg',
+                small_price=Decimal(rng.randint(300, 500)),
+                medium_price=Decimal(rng.randint(550, 750)),
+                large_price=Decimal(rng.randint(800, 990))
+            )
+            for number in range(pizzas)
+        ])
+        menu = list(Pizza.objects.filter(name__startswith='Perf Pizza'))
+
+        # Order history, spread over the last ``days`` days
+        history = Order.objects.bulk_create([
+            Order(
+                user=rng.choice(customers),
+                order_type='D',
+                status=rng.choice(['DL'] * 8 + ['C', 'P']),
+                delivery_address='Perf Street',
+                delivery_fee=50,
+                total_amount=0
+            )
+            for _ in range(orders)
+        ], batch_size=1000)
+        items = []
+        for order in history:
+            order.created_at = now - timedelta(days=rng.random() * days)
+            for _ in range(rng.randint(1, 3)):
+                pizza = rng.choice(menu)
+                quantity = rng.randint(1, 3)
+                items.append(OrderItem(order=order, pizza=pizza, pizza_name=pizza.name, size='M',
+                                       quantity=quantity, unit_price=pizza.medium_price,
+                                       price=pizza.medium_price * quantity))
+                order.total_amount += pizza.medium_price * quantity
+            order.total_amount += order.delivery_fee
+        OrderItem.objects.bulk_create(items, batch_size=1000)
+        # created_at is auto_now_add, so the backdated values need their own update
+        Order.objects.bulk_update(history, ['created_at', 'total_amount'], batch_size=1000)
+
+    return {'users': len(customers), 'pizzas': len(menu), 'orders': len(history), 'items': len(items)}
+
+
+def clear():
+    """Delete everything created by ``seed``."""
+    with transaction.atomic():
+        User.objects.filter(username__startswith=PREFIX).delete()
+        Pizza.objects.filter(name__startswith='Perf Pizza').delete()
+        Topping.objects.filter(name__startswith='Perf Topping').delete()
+
+
+def load_fixtures():
+    """Access tokens and menu ids for the seeded users and catalog."""
+    customers = list(User.objects.filter(username__startswith=PREFIX, is_staff=False).order_by('pk'))
+    try:
+        staff = User.objects.get(username=STAFF_USERNAME)
+    except User.DoesNotExist:
+        staff = None
+    if not customers or staff is None:
+        return None
+    return {
+        'tokens': [issue_tokens(user)['access'] for user in customers],
+        'staff_token': issue_tokens(staff)['access'],
+        'pizza_ids': list(Pizza.objects.filter(available=True).values_list('id', flat=True)),
+        'topping_ids': list(Topping.objects.filter(available=True).values_list('id', flat=True)),
+    }
+
+
+def funnel_requests(fixtures, rng, token):
+    """Yield (step, method, path, body, token) for one pass through the funnel.
+
+    The order id for update_status is only known after checkout, so callers
+    send the checkout response back into the generator.
+    """
+    yield 'menu', 'GET', '/api/pizzas/', None, token
+    yield 'add_item', 'POST', '/api/cart/add_item/', {
+        'pizza_id': rng.choice(fixtures['pizza_ids']),
+        'size': rng.choice('SML'),
+        'quantity': rng.randint(1, 3),
+        'topping_ids': rng.sample(fixtures['topping_ids'], min(2, len(fixtures['topping_ids']))),
+    }, token
+    yield 'cart', 'GET', '/api/cart/', None, token
+    order = yield 'checkout', 'POST', '/api/orders/checkout/', {
+        'order_type': 'D',
+        'delivery_address': 'Perf Street',
+    }, token
+    yield 'order_list', 'GET', '/api/orders/', None, token
+    if order and 'id' in order:
+        yield 'update_status', 'POST', f"/api/orders/{order['id']}/update_status/", {
+            'status': 'PR'
+        }, fixtures['staff_token']
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, step, seconds, status, queries=None):
+        self.latencies[step].append(seconds)
+        if queries is not None:
+            self.queries[step].append(queries)
+        if status >= 400:
+            self.errors[step] += 1
+
+    def summary(self, elapsed):
+        results = {}
+        for step in FUNNEL:
+            latencies = sorted(self.latencies[step])
+            if not latencies:
+                continue
+            queries = self.queries[step]
+            results[step] = {
+                'requests': len(latencies),
+                'rps': round(len(latencies) / elapsed, 1),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'queries': round(sum(queries) / len(queries), 1) if queries else None,
+                'errors': self.errors[step],
+            }
+        return results
+
+
+def run_client(fixtures, iterations, seed=0):
+    """Drive the funnel in-process with the test client, counting queries per request."""
+    from rest_framework.test import APIClient
+
+    rng = random.Random(seed)
+    client = APIClient()
+    recorder = Recorder()
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        token = fixtures['tokens'][iteration % len(fixtures['tokens'])]
+        requests = funnel_requests(fixtures, rng, token)
+        response_data = None
+        while True:
+            try:
+                step, method, path, body, token = requests.send(response_data)
+            except StopIteration:
+                break
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+            if step == 'checkout':
+                headers['HTTP_IDEMPOTENCY_KEY'] = uuid.uuid4().hex
+            reset_queries()  # The query log is capped, so long runs would otherwise miscount
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                if method == 'GET':
+                    response = client.get(path, **headers)
+                else:
+                    response = client.post(path, body, format='json', **headers)
+                seconds = time.perf_counter() - request_started
+            recorder.record(step, seconds, response.status_code, len(context))
+            response_data = response.json() if step == 'checkout' else None
+    return recorder.summary(time.perf_counter() - started)
+
+
+async def _http_request(reader, writer, host, method, path, body, token):
+    payload = json.dumps(body).encode() if body is not None else b''
+    headers = {
+        'Host': host,
+        'Connection': 'keep-alive',
+        'Authorization': f'Bearer {token}',
+        'Content-Length': str(len(payload)),
+    }
+    if body is not None:
+        headers['Content-Type'] = 'application/json'
+    if method == 'POST' and path.endswith('/checkout/'):
+        headers['Idempotency-Key'] = uuid.uuid4().hex
+    request = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+    writer.write(request.encode() + payload)
+    await writer.drain()
+    return await read_response(reader)
+
+
+async def _run_http(fixtures, host, port, concurrency, duration, seed):
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(number):
+        rng = random.Random(seed + number)
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                token = fixtures['tokens'][rng.randrange(len(fixtures['tokens']))]
+                requests = funnel_requests(fixtures, rng, token)
+                response_data = None
+                while True:
+                    try:
+                        step, method, path, body, token = requests.send(response_data)
+                    except StopIteration:
+                        break
+                    started = time.perf_counter()
+                    status, headers, content = await _http_request(
+                        reader, writer, f"{host}:{port}", method, path, body, token
+                    )
+                    recorder.record(step, time.perf_counter() - started, status)
+                    response_data = json.loads(content) if step == 'checkout' and status < 400 else None
+                    if headers.get('connection', '').lower() == 'close':
+                        writer.close()
+                        reader, writer = await asyncio.open_connection(host, port)
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(number) for number in range(concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+def run_http(fixtures, host, port, concurrency, duration, seed=0):
+    """Drive the funnel against a running server from ``concurrency`` virtual users."""
+    return asyncio.run(_run_http(fixtures, host, port, concurrency, duration, seed))
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against ``baseline`` as readable strings; empty means the run passed.
+
+    Query counts must not grow at all. Latency may be up to ``tolerance``
+    (a fraction) slower than the baseline p95.
+    """
+    regressions = []
+    for step, expected in baseline.items():
+        actual = results.get(step)
+        if actual is None:
+            continue
+        if expected.get('queries') is not None and actual['queries'] is not None \
+                and actual['queries'] > expected['queries']:
+            regressions.append(f"{step}: {actual['queries']} queries per request, baseline {expected['queries']}")
+        if actual['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{step}: p95 {actual['p95_ms']} ms, baseline {expected['p95_ms']} ms")
+        if actual['errors']:
+            regressions.append(f"{step}: {actual['errors']} errors")
+    return regressions
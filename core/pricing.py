@@ -0,0 +1,45 @@
+from django.db.models import Count, DecimalField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .carts import forget_cart_counts
+from .models import Cart, CartItem
+
+
+def reprice_items(items):
+    """Recompute stored unit prices and line totals for the given cart items.
+
+    Returns the ids of the carts whose items were touched.
+    """
+    items = list(items.select_related('pizza').prefetch_related('toppings'))
+    for item in items:
+        item.set_price(item.compute_unit_price())
+    CartItem.objects.bulk_update(items, ['unit_price', 'line_total'], batch_size=500)
+    return {item.cart_id for item in items}
+
+
+def recalculate_carts(cart_ids):
+    """Rebuild the subtotal and item count of the given carts from their items."""
+    if not cart_ids:
+        return
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.filter(id__in=cart_ids).update(
+        subtotal=Coalesce(
+            Subquery(items.annotate(total=Sum('line_total')).values('total')),
+            Value(0),
+            output_field=DecimalField(max_digits=7, decimal_places=2)
+        ),
+        item_count=Coalesce(
+            Subquery(items.annotate(count=Count('id')).values('count')),
+            Value(0),
+            output_field=IntegerField()
+        ),
+        updated_at=timezone.now()
+    )
+    forget_cart_counts(Cart.objects.filter(id__in=cart_ids).values_list('user_id', flat=True))
+
+
+def reprice_active_items(**filters):
+    # Catalog price changes only matter for carts that haven't been checked out
+    cart_ids = reprice_items(CartItem.objects.filter(cart__active=True, **filters))
+    recalculate_carts(cart_ids)
@@ -0,0 +1,175 @@
+"""Ranked, prefix-as-you-type search over the pizza and topping catalog.
+
+On PostgreSQL pizzas are matched against a weighted ``search_vector``
+column (name A, description B) kept up to date by the database and backed
+by a GIN index (see migration 0008). Words that match nothing fall back to
+trigram similarity, which tolerates typos. Other databases, e.g. SQLite in
+tests, use an in-process inverted index that is rebuilt whenever the
+catalog version changes.
+"""
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from difflib import get_close_matches
+from heapq import nlargest
+
+from django.db import connection
+
+from .menu_cache import catalog_version
+from .models import Pizza, Topping
+
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+PREFIX_FACTOR = 0.5  # A prefix or typo match scores half an exact word
+TYPO_CUTOFF = 0.75
+TRIGRAM_THRESHOLD = 0.3
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+class InvertedIndex:
+    """Token -> {document key: weight}, with a sorted vocabulary for prefix lookups."""
+
+    def __init__(self, documents):
+        self.postings = defaultdict(dict)
+        for key, fields in documents:
+            for text, weight in fields:
+                for token in tokenize(text):
+                    postings = self.postings[token]
+                    postings[key] = max(postings.get(key, 0), weight)
+        self.vocabulary = sorted(self.postings)
+        # Typo candidates share the first letter, which keeps the fuzzy match cheap
+        self.words_by_initial = defaultdict(list)
+        for token in self.vocabulary:
+            if token.isalpha():
+                self.words_by_initial[token[0]].append(token)
+
+    def expand(self, term):
+        start = bisect_left(self.vocabulary, term)
+        for token in self.vocabulary[start:]:
+            if not token.startswith(term):
+                break
+            yield token, 1.0 if token == term else PREFIX_FACTOR
+
+    def close_matches(self, term):
+        candidates = [word for word in self.words_by_initial[term[0]] if abs(len(word) - len(term)) <= 2]
+        return get_close_matches(term, candidates, 3, TYPO_CUTOFF)
+
+    def matches(self, term):
+        """(postings, factor) pairs for the words ``term`` starts, or typo matches if none."""
+        expansions = list(self.expand(term)) or [(token, PREFIX_FACTOR) for token in self.close_matches(term)]
+        return [(self.postings[token], factor) for token, factor in expansions]
+
+    def search(self, query, limit=None):
+        """Keys matching every word of ``query``, best first."""
+        terms = [self.matches(term) for term in tokenize(query)]
+        if not terms:
+            return []
+        # Rarest word first, so the others only need to score its candidates
+        terms.sort(key=lambda matches: sum(len(postings) for postings, factor in matches))
+
+        scores = {}
+        for postings, factor in terms[0]:
+            for key, weight in postings.items():
+                scores[key] = max(scores.get(key, 0), weight * factor)
+        for matches in terms[1:]:
+            narrowed = {}
+            for postings, factor in matches:
+                for key in scores.keys() & postings.keys():
+                    narrowed[key] = max(narrowed.get(key, 0), postings[key] * factor)
+            scores = {key: scores[key] + score for key, score in narrowed.items()}
+            if not scores:
+                return []
+
+        if limit is None:
+            return sorted(scores, key=scores.get, reverse=True)
+        return nlargest(limit, scores, key=scores.get)
+
+
+_indexes = (None, None)
+
+
+def build_indexes():
+    pizzas = Pizza.objects.filter(available=True).values_list('id', 'name', 'description')
+    toppings = Topping.objects.filter(available=True).values_list('id', 'name')
+    return {
+        Pizza: InvertedIndex(
+            (pk, [(name, NAME_WEIGHT), (description, DESCRIPTION_WEIGHT)])
+            for pk, name, description in pizzas.iterator()
+        ),
+        Topping: InvertedIndex((pk, [(name, NAME_WEIGHT)]) for pk, name in toppings),
+    }
+
+
+def get_indexes():
+    # Built once per process and rebuilt when a Pizza or Topping change bumps the catalog version
+    global _indexes
+    version, indexes = _indexes
+    current = catalog_version()
+    if version != current or indexes is None:
+        indexes = build_indexes()
+        _indexes = (current, indexes)
+    return indexes
+
+
+def _index_search(query, limit):
+    results = []
+    for model, index in get_indexes().items():
+        ids = index.search(query, limit)
+        objects = model.objects.in_bulk(ids)
+        results.append([objects[pk] for pk in ids if pk in objects])
+    return tuple(results)
+
+
+def _postgres_search(query, limit):
+    # Imported here since django.contrib.postgres needs psycopg
+    from django.contrib.postgres.search import (
+        SearchQuery, SearchRank, SearchVector, SearchVectorField, TrigramWordSimilarity
+    )
+    from django.db.models import Count, Q
+    from django.db.models.expressions import RawSQL
+
+    terms = tokenize(query)
+    tsquery = SearchQuery(' & '.join(f"{term}:*" for term in terms), search_type='raw', config='english')
+    document = RawSQL(f'"{Pizza._meta.db_table}"."search_vector"', [], output_field=SearchVectorField())
+    available = Pizza.objects.filter(available=True).alias(document=document)
+
+    pizzas = list(
+        available.filter(document=tsquery)
+        .annotate(rank=SearchRank(document, tsquery))
+        .order_by('-rank', 'name')[:limit]
+    )
+    # Typos only: if every word matches some pizza, just not the same one, there is no match
+    if not pizzas and not all(available.aggregate(**{
+        f'term_{index}': Count('pk', filter=Q(document=SearchQuery(f"{term}:*", search_type='raw', config='english')))
+        for index, term in enumerate(terms)
+    }).values()):
+        pizzas = list(
+            Pizza.objects.filter(available=True)
+            .annotate(similarity=TrigramWordSimilarity(' '.join(terms), 'name'))
+            .filter(similarity__gt=TRIGRAM_THRESHOLD)
+            .order_by('-similarity', 'name')[:limit]
+        )
+
+    toppings = list(
+        Topping.objects.filter(available=True)
+        .alias(document=SearchVector('name', config='english'))
+        .filter(document=tsquery)
+        .order_by('name')[:limit]
+    )
+    return pizzas, toppings
+
+
+def search_catalog(query, limit=20):
+    """Return ``(pizzas, toppings)`` matching ``query``, best match first.
+
+    Every word must match, and each one may be the start of a word, so
+    results update as the user types. ``limit=None`` returns every match.
+    """
+    if not tokenize(query):
+        return [], []
+    if connection.vendor == 'postgresql':
+        return _postgres_search(query, limit)
+    return _index_search(query, limit)
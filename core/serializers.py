@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 from .models import UserProfile, Pizza, Topping, Cart, CartItem, Order, OrderItem
 
 class UserSerializer(serializers.ModelSerializer):
@@ -24,12 +26,22 @@ class ToppingSerializer(serializers.ModelSerializer):
 
 class PizzaSerializer(serializers.ModelSerializer):
     toppings = ToppingSerializer(many=True, read_only=True)
+    image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = Pizza
-        fields = ('id', 'name', 'description', 'image', 'small_price', 
-                 'medium_price', 'large_price', 'available', 'toppings')
-        read_only_fields = ('id',)
+        fields = ('id', 'name', 'description', 'image', 'image_width', 'image_height',
+                 'image_placeholder', 'image_srcset', 'small_price', 'medium_price',
+                 'large_price', 'available', 'toppings')
+        read_only_fields = ('id', 'image_width', 'image_height', 'image_placeholder')
+    
+    def get_image_srcset(self, obj):
+        request = self.context.get('request')
+        build_url = request.build_absolute_uri if request else str
+        return {
+            fmt: ', '.join(f"{build_url(url)} {width}w" for width, url in obj.image_rendition_urls(fmt))
+            for fmt in ('webp', 'jpeg')
+        }
 
 class CartItemSerializer(serializers.ModelSerializer):
     pizza = PizzaSerializer(read_only=True)
@@ -38,8 +50,8 @@ class CartItemSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CartItem
-        fields = ('id', 'pizza', 'size', 'toppings', 'quantity', 'notes', 'price')
-        read_only_fields = ('id',)
+        fields = ('id', 'pizza', 'size', 'toppings', 'quantity', 'notes', 'unit_price', 'price')
+        read_only_fields = ('id', 'unit_price')
     
     def get_price(self, obj):
         return obj.get_price()
@@ -50,20 +62,24 @@ class CartSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Cart
-        fields = ('id', 'user', 'created_at', 'updated_at', 'active', 'items', 'total_price')
-        read_only_fields = ('id', 'user', 'created_at', 'updated_at')
+        fields = ('id', 'user', 'created_at', 'updated_at', 'active', 'items', 'item_count', 'total_price')
+        read_only_fields = ('id', 'user', 'created_at', 'updated_at', 'item_count')
     
     def get_total_price(self, obj):
-        return sum(item.get_price() for item in obj.items.all())
+        return obj.subtotal
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    pizza = PizzaSerializer(read_only=True)
-    toppings = ToppingSerializer(many=True, read_only=True)
+    # From the checkout snapshot on the item itself, never the live catalog
+    pizza = serializers.SerializerMethodField()
+    toppings = serializers.JSONField(source='topping_snapshot', read_only=True)
     
     class Meta:
         model = OrderItem
-        fields = ('id', 'pizza', 'size', 'toppings', 'quantity', 'price')
-        read_only_fields = ('id',)
+        fields = ('id', 'pizza', 'size', 'toppings', 'quantity', 'unit_price', 'price')
+        read_only_fields = ('id', 'unit_price')
+    
+    def get_pizza(self, obj):
+        return {'id': obj.pizza_id, 'name': obj.pizza_name}
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
@@ -72,6 +88,67 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ('id', 'user', 'order_type', 'status', 'delivery_address', 
-                 'delivery_fee', 'estimated_delivery_time', 'payment_method', 
+                 'delivery_fee', 'eta_earliest', 'eta_latest', 'payment_method', 
                  'total_amount', 'created_at', 'updated_at', 'notes', 'items')
-        read_only_fields = ('id', 'user', 'created_at', 'updated_at')
\ No newline at end of file
+        read_only_fields = ('id', 'user', 'created_at', 'updated_at')
+
+class OrderListSerializer(serializers.ModelSerializer):
+    item_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = Order
+        fields = ('id', 'status', 'total_amount', 'created_at', 'item_count')
+        read_only_fields = fields
+
+class KitchenItemSerializer(serializers.ModelSerializer):
+    pizza = serializers.CharField(source='pizza_name', read_only=True)
+    toppings = serializers.ListField(source='topping_names', read_only=True)
+    
+    class Meta:
+        model = OrderItem
+        fields = ('pizza', 'size', 'quantity', 'toppings')
+
+class KitchenOrderSerializer(serializers.ModelSerializer):
+    customer = serializers.CharField(source='user.username', read_only=True)
+    items = KitchenItemSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = Order
+        fields = ('id', 'customer', 'order_type', 'status', 'created_at', 'updated_at', 'notes', 'items')
+        read_only_fields = fields
+
+def eager_load(queryset, serializer):
+    """Apply select_related/prefetch_related matching the nested serializers.
+
+    Forward relations rendered by a nested serializer are joined in with
+    select_related, to-many relations get a Prefetch whose queryset is eager
+    loaded the same way, so a whole page of objects serializes in a fixed
+    number of queries.
+    """
+    select, prefetch = _related_lookups(serializer, queryset.model)
+    return queryset.select_related(*select).prefetch_related(*prefetch)
+
+def _related_lookups(serializer, model, prefix=''):
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if not isinstance(nested, serializers.BaseSerializer):
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+        
+        lookup = prefix + field.source
+        related_model = model_field.related_model
+        if model_field.many_to_many or model_field.one_to_many:
+            queryset = eager_load(related_model._default_manager.all(), nested)
+            prefetch.append(Prefetch(lookup, queryset=queryset))
+        else:
+            select.append(lookup)
+            nested_select, nested_prefetch = _related_lookups(nested, related_model, lookup + '__')
+            select += nested_select
+            prefetch += nested_prefetch
+    return select, prefetch
@@ -0,0 +1,96 @@
+import logging
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .auth import forget_user_row, revoke_user_tokens
+from .images import build_pizza_renditions
+from .menu_cache import bump_catalog_version
+from .models import CartItem, Pizza, Topping
+from .pricing import reprice_active_items, recalculate_carts
+
+logger = logging.getLogger(__name__)
+
+# User fields copied into access tokens by core.auth
+TOKEN_CLAIM_FIELDS = ('username', 'is_staff', 'is_active')
+
+
+@receiver(post_save, sender=Pizza)
+def reprice_carts_for_pizza(sender, instance, created, **kwargs):
+    if not created:
+        reprice_active_items(pizza=instance)
+
+
+@receiver(post_save, sender=Topping)
+def reprice_carts_for_topping(sender, instance, created, **kwargs):
+    if not created:
+        reprice_active_items(toppings=instance)
+
+
+@receiver(pre_delete, sender=Pizza)
+@receiver(pre_delete, sender=Topping)
+def remember_affected_cart_items(sender, instance, **kwargs):
+    # The cart items (or their topping links) are gone by post_delete
+    lookup = 'pizza' if sender is Pizza else 'toppings'
+    instance._affected_cart_items = list(
+        CartItem.objects.filter(cart__active=True, **{lookup: instance}).values_list('id', 'cart_id')
+    )
+
+
+@receiver(post_delete, sender=Pizza)
+def recalculate_carts_for_pizza(sender, instance, **kwargs):
+    recalculate_carts({cart_id for item_id, cart_id in getattr(instance, '_affected_cart_items', [])})
+
+
+@receiver(post_delete, sender=Topping)
+def reprice_carts_for_topping_delete(sender, instance, **kwargs):
+    item_ids = [item_id for item_id, cart_id in getattr(instance, '_affected_cart_items', [])]
+    if item_ids:
+        reprice_active_items(id__in=item_ids)
+
+
+@receiver(post_save, sender=Pizza)
+@receiver(post_save, sender=Topping)
+@receiver(post_delete, sender=Pizza)
+@receiver(post_delete, sender=Topping)
+def invalidate_menu_cache(sender, **kwargs):
+    # Wait for the commit so a concurrent reader can't re-cache the old rows
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Pizza)
+def build_image_renditions(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or instance.image_renditions.get('source') == instance.image.name:
+        return
+    try:
+        fields = build_pizza_renditions(instance)
+    except OSError:
+        logger.warning("Could not build renditions for %s", instance.image.name, exc_info=True)
+        return
+    # update() rather than save() so this doesn't re-trigger the save signals
+    Pizza.objects.filter(pk=instance.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(instance, name, value)
+
+
+@receiver(pre_save, sender=User)
+def remember_token_claims(sender, instance, update_fields=None, **kwargs):
+    # Access tokens carry these, so changing one must invalidate the old tokens
+    if instance.pk and (update_fields is None or set(TOKEN_CLAIM_FIELDS) & set(update_fields)):
+        instance._previous_claims = User.objects.filter(pk=instance.pk).values_list(*TOKEN_CLAIM_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def revoke_stale_tokens(sender, instance, **kwargs):
+    forget_user_row(instance.pk)
+    previous = getattr(instance, '_previous_claims', None)
+    if previous and previous != tuple(getattr(instance, name) for name in TOKEN_CLAIM_FIELDS):
+        revoke_user_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    forget_user_row(instance.pk)
+    revoke_user_tokens(instance.pk)
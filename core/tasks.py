@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+from django.utils import timezone
+
+from .analytics import refresh_rollups
+from .jobs import enqueue, job
+from .models import Order
+
+
+@job
+def send_order_receipt(order_id):
+    order = Order.objects.select_related('user').prefetch_related('items').get(pk=order_id)
+    if not order.user.email:
+        return
+    lines = [f"{item.quantity}x {item.pizza_name} ({item.get_size_display()}) - Rs. {item.price}"
+             for item in order.items.all()]
+    if order.delivery_fee:
+        lines.append(f"Delivery fee - Rs. {order.delivery_fee}")
+    send_mail(
+        f"ChakBites order #{order.id} received",
+        "Thanks for your order!\n\n" + "\n".join(lines) + f"\n\nTotal: Rs. {order.total_amount}\n",
+        settings.DEFAULT_FROM_EMAIL,
+        [order.user.email],
+    )
+
+
+@job
+def send_welcome_email(user_id):
+    user = User.objects.get(pk=user_id)
+    if not user.email:
+        return
+    send_mail(
+        "Welcome to ChakBites",
+        f"Hi {user.first_name or user.username}, your account is ready. Happy ordering!",
+        settings.DEFAULT_FROM_EMAIL,
+        [user.email],
+    )
+
+
+@job
+def refresh_sales_rollups():
+    refresh_rollups()
+    # Hourly: each run queues the next, and the key keeps it to one run per hour
+    next_hour = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    enqueue(
+        'refresh_sales_rollups',
+        idempotency_key=f"sales-rollups:{next_hour:%Y%m%d%H}",
+        delay=(next_hour - timezone.now()).total_seconds() + 60
+    )
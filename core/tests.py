@@ -1,3 +1,1341 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import analytics, auth, delivery, events, hashing, jobs, perf
+from .analytics import refresh_rollups
+from .archive import archive_batch
+from .auth import issue_tokens, revoke_token
+from .carts import get_or_create_active_cart, purge_batch, purge_cutoffs
+from .order_status import stage_latencies
+from .models import (
+    ArchivedOrderItem, Cart, IdempotencyKey, Job, Order, OrderItem, OrderStatusEvent, Pizza, SalesRollup, Topping,
+    UserProfile
+)
+from .search import search_catalog
+
+# Keep the kitchen queue snapshot from reloading partway through a test and
+# adding a query to whichever request happens to trigger it
+pin_kitchen_queue = override_settings(DELIVERY={**settings.DELIVERY, 'QUEUE_REFRESH_SECONDS': 3600})
+
+
+class ShopFixtures:
+    """A signed-in customer, a pizza and two toppings."""
+
+    def setUp(self):
+        # Per-process state outlives the rolled-back rows it was built from
+        cache.clear()
+        delivery.get_model.cache_clear()
+        delivery.get_model().queued_orders()
+        revocations = mock.patch.object(auth, 'revocations', auth.RevocationList())
+        revocations.start()
+        self.addCleanup(revocations.stop)
+
+        self.user = User.objects.create_user('customer', password='crust-and-cheese')
+        UserProfile.objects.create(user=self.user, phone='+923001234567', address='12 Mall Road')
+        self.client = self.customer_client()
+
+        self.pizza = Pizza.objects.create(
+            name='Margherita', description='Tomato and mozzarella',
+            small_price=10, medium_price=20, large_price=30
+        )
+        self.toppings = [
+            Topping.objects.create(name='Olives', price=2), Topping.objects.create(name='Jalapenos', price=3)
+        ]
+
+    def customer_client(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def add_to_cart(self, lines):
+        for _ in range(lines):
+            response = self.client.post('/api/cart/add_item/', {
+                'pizza_id': self.pizza.id,
+                'size': 'M',
+                'quantity': 2,
+                'topping_ids': [topping.id for topping in self.toppings]
+            }, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+
+    def assertQueryBudget(self, budget, path, method='get', data=None):
+        """Request ``path`` and fail if it succeeds with more than ``budget`` queries."""
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{method.upper()} {path} ran {len(queries)} queries:\n" + '\n'.join(query['sql'] for query in queries)
+        )
+        return response
+
+    def checkout(self, client=None, idempotency_key=None):
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else {}
+        return (client or self.client).post('/api/orders/checkout/', {
+            'order_type': 'D',
+            'delivery_address': '12 Mall Road'
+        }, format='json', headers=headers)
+
+
+@pin_kitchen_queue
+
+
+class ShopTestCase(ShopFixtures, TestCase):
+    pass
+
+
+class CheckoutQueryTests(ShopTestCase):
+
+    def checkout_queries(self, lines):
+        self.add_to_cart(lines)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.data['items']), lines)
+        return len(queries)
+
+    def test_queries_do_not_grow_with_cart_size(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(8))
+
+    def test_order_is_priced_from_the_cart(self):
+        self.add_to_cart(3)
+        response = self.checkout()
+
+        order = Order.objects.get(pk=response.data['id'])
+        # 3 lines of 2 medium pizzas at 20 with 2 + 3 in toppings, plus delivery
+        self.assertEqual(order.total_amount, 3 * 2 * 25 + order.delivery_fee)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.items.first().toppings.count(), 2)
+
+
+class CartValidationTests(ShopTestCase):
+
+    def test_add_item_rejects_bad_size_and_quantity(self):
+        for data in ({'size': 'X'}, {}, {'size': 'M', 'quantity': 0}, {'size': 'M', 'quantity': 'two'}):
+            response = self.client.post('/api/cart/add_item/', {'pizza_id': self.pizza.id, **data}, format='json')
+            self.assertEqual(response.status_code, 400, data)
+        self.assertEqual(self.client.get('/api/cart/count/').data['count'], 0)
+
+    def test_update_quantity_rejects_bad_quantity(self):
+        self.add_to_cart(1)
+        item = self.user.cart_set.get(active=True).items.get()
+        for quantity in (None, -1, 'lots'):
+            response = self.client.post('/api/cart/update_item_quantity/',
+                                        {'item_id': item.id, 'quantity': quantity}, format='json')
+            self.assertEqual(response.status_code, 400, quantity)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 2)
+
+
+class CartCountTests(ShopTestCase):
+
+    def test_count_follows_committed_writes(self):
+        self.assertEqual(self.client.get('/api/cart/count/').data['count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_to_cart(2)
+        self.assertEqual(self.client.get('/api/cart/count/').data['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.checkout()
+        self.assertEqual(self.client.get('/api/cart/count/').data['count'], 0)
+
+
+class MenuCacheTests(ShopTestCase):
+
+    def test_conditional_get_follows_every_edit(self):
+        response = self.client.get('/api/pizzas/')
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/pizzas/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Two edits in the same second each get a new ETag
+        for price in (11, 12):
+            self.pizza.small_price = price
+            with self.captureOnCommitCallbacks(execute=True):
+                self.pizza.save()
+            response = self.client.get('/api/pizzas/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+
+class CartPurgeTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.carts = {}
+        for name, active, items, idle in (
+            ('checked_out', False, 1, timedelta()),
+            ('empty_stale', True, 0, timedelta(hours=25)),
+            ('empty_fresh', True, 0, timedelta(hours=1)),
+            ('abandoned', True, 2, timedelta(days=31)),
+            ('in_use', True, 2, timedelta(days=2)),
+        ):
+            user = User.objects.create_user(name)
+            cart = Cart.objects.create(user=user, active=active)
+            for _ in range(items):
+                cart.items.create(pizza=self.pizza, size='S', unit_price=10, line_total=10)
+            Cart.objects.filter(pk=cart.pk).update(item_count=items, updated_at=now - idle)
+            self.carts[name] = cart.pk
+
+    def remaining(self):
+        return {name for name, pk in self.carts.items() if Cart.objects.filter(pk=pk).exists()}
+
+    def test_only_expired_carts_go(self):
+        self.assertEqual(purge_batch(*purge_cutoffs()), (3, 3))
+        self.assertEqual(self.remaining(), {'empty_fresh', 'in_use'})
+        self.assertEqual(purge_batch(*purge_cutoffs()), (0, 0))
+
+    def test_batches(self):
+        self.assertEqual(purge_batch(*purge_cutoffs(), batch_size=2), (2, 1))
+        self.assertEqual(self.remaining(), {'empty_fresh', 'abandoned', 'in_use'})
+
+        output = StringIO()
+        call_command('purge_carts', batch_size=1, stdout=output)
+        self.assertIn('Deleted 1 carts and 2 cart items', output.getvalue())
+        self.assertEqual(self.remaining(), {'empty_fresh', 'in_use'})
+
+    def test_one_active_cart_per_user(self):
+        Cart.objects.create(user=self.user, active=False)
+        Cart.objects.create(user=self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(user=self.user)
+
+
+class QueryBudgetTests(ShopTestCase):
+    """Reads whose query count must not grow with the number of orders, lines or toppings."""
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(4):
+            self.add_to_cart(3)
+            self.checkout()
+        self.add_to_cart(3)
+        self.order = Order.objects.filter(user=self.user).last()
+
+    def test_order_list(self):
+        response = self.assertQueryBudget(2, '/api/orders/')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_order_detail(self):
+        response = self.assertQueryBudget(2, f'/api/orders/{self.order.id}/')
+        self.assertEqual(len(response.data['items']), 3)
+
+    def test_cart(self):
+        response = self.assertQueryBudget(3, '/api/cart/')
+        self.assertEqual(len(response.data[0]['items']), 3)
+
+    def test_staff_order_list_and_kitchen_board(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+        self.assertQueryBudget(2, '/api/orders/')
+        response = self.assertQueryBudget(2, '/api/kitchen/')
+        self.assertEqual(len(response.data[0]['orders']), 4)
+
+
+class RequestMetricsTests(ShopTestCase):
+
+    def test_request_line_is_logged_at_debug(self):
+        with self.assertLogs('core.metrics', 'DEBUG') as logs:
+            self.client.get('/api/cart/count/')
+        self.assertEqual([record.levelname for record in logs.records], ['DEBUG'])
+        self.assertIn('route=', logs.records[0].getMessage())
+
+
+class AsyncViewTests(ShopTestCase):
+    """The async read endpoints answer exactly as their DRF counterparts do."""
+
+    def setUp(self):
+        super().setUp()
+        self.add_to_cart(1)
+        self.order_id = self.checkout().data['id']
+        self.add_to_cart(2)
+        self.headers = {'Authorization': f"Bearer {issue_tokens(self.user)['access']}"}
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.headers['Authorization'])
+
+    def assertSameResponse(self, sync_path, async_path, shape=lambda data: data):
+        sync_response = self.client.get(sync_path)
+        async_response = async_to_sync(self.async_client.get)(async_path, headers=self.headers)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), shape(sync_response.json()))
+        return async_response
+
+    def test_menu(self):
+        response = self.assertSameResponse('/api/pizzas/', '/api/async/menu/')
+        self.assertEqual(response['ETag'], self.client.get('/api/pizzas/')['ETag'])
+        not_modified = async_to_sync(self.async_client.get)('/api/async/menu/', headers={
+            'If-None-Match': response['ETag']
+        })
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_cart(self):
+        # The DRF endpoint lists the active cart; the async one returns it
+        self.assertSameResponse('/api/cart/', '/api/async/cart/', shape=lambda data: data[0])
+        self.assertSameResponse('/api/cart/count/', '/api/async/cart/count/')
+
+    def test_order_detail(self):
+        self.assertSameResponse(f'/api/orders/{self.order_id}/', f'/api/async/orders/{self.order_id}/')
+        response = async_to_sync(self.async_client.get)('/api/async/orders/0/', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_customers_orders_are_not_found(self):
+        neighbour = User.objects.create_user('neighbour')
+        headers = {'Authorization': f"Bearer {issue_tokens(neighbour)['access']}"}
+        response = async_to_sync(self.async_client.get)(f'/api/async/orders/{self.order_id}/', headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_authentication_is_required(self):
+        for path in ('/api/async/cart/', '/api/async/cart/count/', f'/api/async/orders/{self.order_id}/'):
+            self.assertEqual(async_to_sync(self.async_client.get)(path).status_code, 401, path)
+
+
+class CartBatchTests(ShopTestCase):
+
+    def test_duplicate_toppings_are_added_once(self):
+        olives = self.toppings[0]
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'pizza_id': self.pizza.id, 'size': 'S', 'topping_ids': [olives.id, olives.id, str(olives.id)]}
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        item = self.user.cart_set.get(active=True).items.get()
+        self.assertEqual(list(item.toppings.all()), [olives])
+        self.assertEqual(item.line_total, 10 + 2)
+
+
+@override_settings(DELIVERY={
+    **settings.DELIVERY,
+    'ZONES': [
+        {'name': 'Gulberg', 'keywords': ['gulberg'], 'fee': 50, 'travel_minutes': 15},
+        {'name': 'DHA', 'keywords': ['dha', 'defence'], 'fee': 120, 'travel_minutes': 30},
+    ],
+    'DEFAULT_ZONE': {'name': 'Standard', 'fee': 80, 'travel_minutes': 20},
+    'KITCHEN_STATIONS': 2,
+    'QUEUE_REFRESH_SECONDS': 3600,
+})
+
+
+class DeliveryEstimateTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        clock = mock.patch.object(delivery.timezone, 'now', return_value=self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.model = delivery.DeliveryModel()
+
+    def minutes(self, moment):
+        return (moment - self.now).total_seconds() / 60
+
+    def test_zone_lookup(self):
+        for address, zone in (
+            ('House 4, Gulberg III', 'Gulberg'),
+            ('12 DEFENCE road', 'DHA'),
+            ('Gulberg side of DHA', 'Gulberg'),  # The first zone listed wins
+            ('Gulbergabad', 'Standard'),  # Whole words only
+            (None, 'Standard'),
+        ):
+            self.assertEqual(delivery.get_zone(address)['name'], zone, address)
+
+    def test_fee_follows_the_zone(self):
+        for order_type, address, zone, fee in (
+            ('D', 'Gulberg', 'Gulberg', 50),
+            ('D', 'DHA phase 5', 'DHA', 120),
+            ('D', 'Model Town', 'Standard', 80),  # Out of every zone: the default one
+            ('O', 'DHA phase 5', None, 0),  # On the spot: no delivery
+        ):
+            quote = self.model.estimate(order_type, address, 10)
+            self.assertEqual((quote['zone'], quote['fee']), (zone, Decimal(fee)), address)
+
+    def test_eta_window_adds_prep_and_travel(self):
+        quote = self.model.estimate('D', 'DHA', 10)
+        self.assertEqual(self.minutes(quote['eta_earliest']), 10 + 30)
+        self.assertEqual(self.minutes(quote['eta_latest']), (10 + 30) * delivery.SLOW_FACTOR)
+        on_spot = self.model.estimate('O', '', 10)
+        self.assertEqual(self.minutes(on_spot['eta_earliest']), 10)
+        self.assertEqual(self.minutes(on_spot['eta_latest']), 10 + delivery.MIN_WINDOW_MINUTES)
+
+    def test_queue_depth_delays_the_eta(self):
+        def earliest():
+            return self.minutes(self.model.estimate('O', '', 10)['eta_earliest'])
+
+        self.assertEqual(earliest(), 10)
+        # Two stations: the first queued order takes one, the other is still free
+        self.model.add_order(1, 30, self.now)
+        self.assertEqual(earliest(), 10)
+        self.model.add_order(2, 20, self.now)
+        self.assertEqual(earliest(), 20 + 10)
+        # An order already being prepared only holds its station for the time it has left
+        self.model.record(Order(pk=2, status='PR'), OrderStatusEvent(
+            from_status='P', stage_seconds=0, created_at=self.now - timedelta(minutes=15)
+        ))
+        self.assertEqual(earliest(), 5 + 10)
+
+    def test_learns_from_recorded_deliveries(self):
+        order = Order(pk=1, status='DL', delivery_address='Gulberg')
+        for minutes in (40, 40, 40):
+            event = OrderStatusEvent(from_status='OD', stage_seconds=minutes * 60, created_at=self.now)
+            self.model.record(order, event)
+        self.assertEqual(self.minutes(self.model.estimate('D', 'Gulberg', 0)['eta_earliest']), 40)
+
+    def test_checkout_charges_the_zone_fee(self):
+        self.add_to_cart(1)
+        response = self.client.post('/api/orders/checkout/', {
+            'order_type': 'D', 'delivery_address': 'Defence phase 2'
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.delivery_fee, 120)
+        self.assertEqual(order.total_amount, 2 * 25 + 120)
+
+
+class KitchenBoardTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.add_to_cart(1)
+            self.checkout()
+        self.orders = list(Order.objects.order_by('id'))
+        Order.objects.filter(pk=self.orders[0].pk).update(status='PR')
+        Order.objects.filter(pk=self.orders[2].pk).update(status='DL')
+        self.customer_token = issue_tokens(self.user)['access']
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+        self.staff_token = issue_tokens(self.user)['access']
+
+    def test_board_groups_live_orders_by_status(self):
+        response = self.client.get('/api/kitchen/')
+        self.assertEqual(response.status_code, 200)
+        board = {group['status']: [order['id'] for order in group['orders']] for group in response.data}
+        self.assertEqual(board, {'P': [self.orders[1].id], 'PR': [self.orders[0].id], 'OD': []})
+        self.assertEqual(response.data[1]['orders'][0]['items'][0]['pizza'], 'Margherita')
+
+    def test_customers_cannot_see_the_board(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.customer_token}')
+        self.assertEqual(client.get('/api/kitchen/').status_code, 403)
+
+    def move(self, order, new_status):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/kitchen/transition/', {
+                'order_ids': [order.id], 'status': new_status
+            }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    async def next_event(self, stream):
+        return (await asyncio.wait_for(anext(stream), timeout=5)).decode()
+
+    async def test_stream_pushes_status_changes(self):
+        kitchen = await self.async_client.get('/api/orders/events/', {'kitchen': 1, 'token': self.staff_token})
+        self.assertEqual(kitchen['Content-Type'], 'text/event-stream')
+        kitchen = aiter(kitchen.streaming_content)
+        self.assertEqual(await self.next_event(kitchen), 'retry: 5000\n\n')  # Subscribed from here on
+
+        await sync_to_async(self.move)(self.orders[1], 'PR')
+        event = await self.next_event(kitchen)
+        self.assertTrue(event.startswith('event: order_status\ndata: '), event)
+        message = json.loads(event.split('data: ', 1)[1])
+        self.assertEqual((message['order_id'], message['status']), (self.orders[1].id, 'PR'))
+
+    async def test_customers_only_hear_about_their_own_orders(self):
+        neighbour = await sync_to_async(User.objects.create_user)('neighbour')
+        token = (await sync_to_async(issue_tokens)(neighbour))['access']
+        # ?kitchen=1 is ignored for customers
+        response = await self.async_client.get('/api/orders/events/', {'kitchen': 1, 'token': token})
+        stream = aiter(response.streaming_content)
+        await self.next_event(stream)
+
+        await sync_to_async(self.move)(self.orders[1], 'PR')
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(anext(stream), timeout=0.5)
+
+    async def test_stream_requires_a_token(self):
+        response = await self.async_client.get('/api/orders/events/')
+        self.assertEqual(response.status_code, 401)
+
+
+class KitchenTransitionTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.add_to_cart(1)
+            self.checkout()
+        self.orders = list(Order.objects.filter(user=self.user).order_by('id'))
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+
+    def transition(self, orders, new_status):
+        return self.client.post('/api/kitchen/transition/', {
+            'order_ids': [order.id for order in orders],
+            'status': new_status
+        }, format='json')
+
+    def test_moves_are_logged(self):
+        response = self.transition(self.orders, 'PR')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data, {'updated': 3, 'rejected': []})
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'PR'})
+        events = OrderStatusEvent.objects.filter(from_status='P')
+        self.assertEqual(sorted(events.values_list('order', flat=True)), [order.id for order in self.orders])
+        self.assertEqual({event.actor_id for event in events}, {self.user.pk})
+
+        # A delivery order goes out for delivery before it can be delivered
+        response = self.transition(self.orders[:1], 'DL')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.data['rejected'][0]['id'], self.orders[0].id)
+        self.assertEqual(self.transition(self.orders[:1], 'OD').status_code, 200)
+        self.assertEqual(self.transition(self.orders[:1], 'DL').status_code, 200)
+        now = timezone.now()
+        latencies = stage_latencies(now - timedelta(hours=1), now + timedelta(hours=1))
+        self.assertEqual({row['stage']: row['count'] for row in latencies}, {'P': 3, 'PR': 1, 'OD': 1})
+        # The delivery model saw each move: two orders still preparing, one delivered
+        self.assertEqual([entry[0] for entry in delivery.get_model().queued_orders()], ['PR', 'PR'])
+
+    def test_illegal_moves_are_rejected_per_order(self):
+        for new_status in ('PR', 'OD', 'DL'):
+            self.assertEqual(self.transition(self.orders[:1], new_status).status_code, 200)
+        event_count = OrderStatusEvent.objects.count()
+
+        response = self.transition(self.orders + [Order(id=0)], 'PR')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(
+            {row['id'] for row in response.data['rejected']}, {self.orders[0].id, 0}
+        )
+        self.assertEqual(Order.objects.get(pk=self.orders[0].id).status, 'DL')
+        self.assertEqual(OrderStatusEvent.objects.count(), event_count + 2)
+
+        response = self.transition(self.orders, 'P')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(OrderStatusEvent.objects.count(), event_count + 2)
+
+    def test_order_ids_must_be_ids(self):
+        response = self.client.post('/api/kitchen/transition/', {'order_ids': ['first'], 'status': 'PR'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.add_to_cart(2)
+            self.checkout()
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+
+    def test_csv_has_a_row_per_item(self):
+        response = self.client.get('/api/orders/export/')
+        self.assertEqual(response.status_code, 200)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 1 + 3 * 2)
+
+    async def test_streams_under_asgi(self):
+        token = (await sync_to_async(issue_tokens)(self.user))['access']
+        response = await AsyncClient().get(
+            '/api/orders/export/', {'type': 'ndjson'}, headers={'Authorization': f'Bearer {token}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        # An async iterator is sent chunk by chunk; a sync one would be read whole first
+        self.assertTrue(response.is_async)
+        lines = [json.loads(chunk) async for chunk in response.streaming_content]
+        self.assertEqual([len(line['items']) for line in lines], [2, 2, 2])
+
+
+class StopListening(BaseException):
+    pass
+
+
+@skipUnless(importlib.util.find_spec('redis'), "needs the redis package")
+
+
+class RedisBrokerTests(TestCase):
+
+    def test_listener_resubscribes_after_a_disconnect(self):
+        import redis
+
+        def pubsub_listening(*items):
+            pubsub = mock.Mock()
+            pubsub.listen.return_value = iter(items)
+            return pubsub
+
+        def dropped():
+            yield {'channel': b'order-events:kitchen', 'data': b'{"order_id": 1}'}
+            raise redis.ConnectionError('Connection closed by server')
+
+        down = mock.Mock()
+        down.psubscribe.side_effect = redis.ConnectionError('Connection refused')
+        stop = mock.Mock()
+        stop.psubscribe.side_effect = StopListening
+
+        broker = events.RedisBroker(url='redis://localhost:6379/0')
+        first = pubsub_listening()
+        first.listen.return_value = dropped()
+        broker._redis = mock.Mock()
+        broker._redis.pubsub.side_effect = [first, down, down, pubsub_listening(), stop]
+        with mock.patch.object(broker, '_fan_out') as fan_out, \
+                mock.patch.object(events.time, 'sleep') as sleep, \
+                self.assertLogs('core.events', 'WARNING') as logs, \
+                self.assertRaises(StopListening):
+            broker._listen()
+
+        fan_out.assert_called_once_with('kitchen', {'order_id': 1})
+        # Backs off while Redis is down, and starts over once it's back
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 4, 1])
+        self.assertEqual(len(logs.records), 3)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+
+
+@pin_kitchen_queue
+
+
+class CheckoutConcurrencyTests(ShopFixtures, TransactionTestCase):
+    """Checkouts of one cart racing each other from several threads, each on its own connection."""
+
+    threads = 8
+
+    def race_checkouts(self, idempotency_keys):
+        self.add_to_cart(3)
+        start = threading.Barrier(len(idempotency_keys))
+        responses = []
+
+        def checkout(key):
+            client = self.customer_client()
+            try:
+                start.wait()
+                responses.append(self.checkout(client, key))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(key,)) for key in idempotency_keys]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(responses), len(idempotency_keys))
+        return responses
+
+    def test_shared_idempotency_key_places_one_order(self):
+        responses = self.race_checkouts(['double-tap'] * self.threads)
+
+        self.assertEqual(Order.objects.count(), 1)
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(IdempotencyKey.objects.get(key='double-tap').order, order)
+        # Every retry is answered with the first response, marked as a replay
+        self.assertEqual([response.status_code for response in responses], [201] * self.threads)
+        original = [response for response in responses if 'Idempotent-Replayed' not in response.headers]
+        self.assertEqual(len(original), 1)
+        for response in responses:
+            self.assertEqual(response.json(), original[0].json())
+
+    def test_cart_lock_stops_a_second_order(self):
+        responses = self.race_checkouts([f'device-{number}' for number in range(self.threads)])
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Order.objects.get().items.count(), 3)
+        self.assertFalse(Cart.objects.filter(user=self.user, active=True).exists())
+        self.assertEqual(sorted(response.status_code for response in responses), [201] + [400] * (self.threads - 1))
+        # Failed checkouts don't keep their keys, so they can be retried
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+
+
+@pin_kitchen_queue
+
+
+class CartConcurrencyTests(ShopFixtures, TransactionTestCase):
+    """First cart writes racing each other from several threads, each on its own connection."""
+
+    threads = 8
+
+    def race(self, work):
+        start = threading.Barrier(self.threads)
+        results = []
+
+        def run():
+            try:
+                start.wait()
+                results.append(work())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), self.threads)
+        return results
+
+    def test_get_or_create_returns_one_cart(self):
+        carts = self.race(lambda: get_or_create_active_cart(self.user))
+        self.assertEqual({cart.id for cart in carts}, {Cart.objects.get(user=self.user, active=True).id})
+
+    def test_first_adds_share_one_cart(self):
+        responses = self.race(lambda: self.customer_client().post('/api/cart/add_item/', {
+            'pizza_id': self.pizza.id, 'size': 'S', 'quantity': 1
+        }, format='json'))
+        self.assertEqual([response.status_code for response in responses], [201] * self.threads)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(
+            (cart.items.count(), cart.item_count, cart.subtotal), (self.threads, self.threads, 10 * self.threads)
+        )
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        registry = mock.patch.dict(jobs.registry, {'flaky': self.flaky})
+        registry.start()
+        self.addCleanup(registry.stop)
+        self.now = timezone.now()
+        clock = mock.patch.object(jobs.timezone, 'now', return_value=self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def flaky(self, fail=True):
+        self.calls.append(fail)
+        if fail:
+            raise ValueError('Upstream unavailable')
+
+    def test_claims_due_jobs_oldest_first(self):
+        later = jobs.enqueue('flaky', delay=60)
+        newer = jobs.enqueue('flaky', fail=False)
+        older = jobs.enqueue('flaky', fail=False)
+        Job.objects.filter(pk=older.pk).update(run_at=self.now - timedelta(minutes=1))
+
+        self.assertEqual([jobs.claim_next_job().pk, jobs.claim_next_job().pk], [older.pk, newer.pk])
+        self.assertIsNone(jobs.claim_next_job())
+        newer.refresh_from_db()
+        self.assertEqual((newer.status, newer.attempts), (Job.RUNNING, 1))
+        later.refresh_from_db()
+        self.assertEqual(later.status, Job.QUEUED)
+
+    def test_retries_with_backoff_then_fails(self):
+        queued = jobs.enqueue('flaky', max_attempts=3)
+        delays = []
+        for _ in range(3):
+            Job.objects.filter(pk=queued.pk).update(run_at=self.now)
+            claimed = jobs.claim_next_job()
+            self.assertEqual(claimed.pk, queued.pk)
+            with self.assertLogs('core.jobs', 'WARNING'):
+                jobs.run_job(claimed)
+            claimed.refresh_from_db()
+            if claimed.status == Job.QUEUED:
+                delays.append((claimed.run_at - self.now).total_seconds())
+
+        self.assertEqual(delays, [jobs.RETRY_BASE_DELAY, jobs.RETRY_BASE_DELAY * 2])
+        self.assertEqual((claimed.status, claimed.attempts, claimed.finished_at), (Job.FAILED, 3, self.now))
+        self.assertIn('Upstream unavailable', claimed.last_error)
+        self.assertEqual(len(self.calls), 3)
+        self.assertIsNone(jobs.claim_next_job())
+
+    def test_idempotency_key_queues_once(self):
+        first = jobs.enqueue('flaky', idempotency_key='once', fail=False)
+        self.assertEqual(jobs.enqueue('flaky', idempotency_key='once', fail=False), first)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_stale_running_jobs_are_requeued(self):
+        stale = jobs.enqueue('flaky')
+        jobs.claim_next_job()
+        Job.objects.filter(pk=stale.pk).update(started_at=self.now - jobs.STALE_AFTER - timedelta(seconds=1))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(jobs.claim_next_job().attempts, 2)
+
+
+class ReceiptJobTests(ShopTestCase):
+
+    def test_checkout_receipt_is_sent_by_the_worker(self):
+        User.objects.filter(pk=self.user.pk).update(email='customer@example.com')
+        self.add_to_cart(1)
+        order_id = self.checkout().data['id']
+        self.assertEqual(mail.outbox, [])
+
+        with self.assertLogs('core.jobs', 'INFO'):
+            call_command('run_jobs', burst=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, f"ChakBites order #{order_id} received")
+        self.assertEqual(Job.objects.get(name='send_order_receipt').status, Job.DONE)
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+
+
+class JobClaimConcurrencyTests(TransactionTestCase):
+
+    def test_locked_job_is_skipped_not_waited_for(self):
+        with mock.patch.dict(jobs.registry, {'noop': lambda: None}):
+            first, second = jobs.enqueue('noop'), jobs.enqueue('noop')
+        Job.objects.filter(pk=first.pk).update(run_at=timezone.now() - timedelta(minutes=1))
+        claimed = []
+
+        def claim():
+            try:
+                claimed.append(jobs.claim_next_job())
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Another worker is in the middle of claiming the first job
+            Job.objects.select_for_update().get(pk=first.pk)
+            worker = threading.Thread(target=claim)
+            worker.start()
+            worker.join(timeout=10)
+        self.assertEqual([job.pk for job in claimed], [second.pk])
+
+
+class PerfSuiteTests(ShopTestCase):
+
+    def test_funnel_runs_cleanly_on_seeded_data(self):
+        counts = perf.seed(users=3, pizzas=4, toppings=3, orders=20, days=7)
+        self.assertEqual((counts['users'], counts['pizzas'], counts['orders']), (3, 4, 20))
+        fixtures = perf.load_fixtures()
+
+        results = perf.run_client(fixtures, iterations=3)
+        self.assertEqual(list(results), perf.FUNNEL)
+        for step, row in results.items():
+            self.assertEqual((row['requests'], row['errors']), (3, 0), step)
+            self.assertGreater(row['p95_ms'], 0)
+        self.assertEqual(perf.compare(results, results, tolerance=0), [])
+
+        perf.clear()
+        self.assertIsNone(perf.load_fixtures())
+        self.assertFalse(Pizza.objects.filter(name__startswith='Perf Pizza').exists())
+
+    def test_compare_flags_regressions(self):
+        baseline = {'cart': {'p95_ms': 10.0, 'queries': 3.0, 'errors': 0}}
+
+        def regressions(**row):
+            return perf.compare({'cart': {'p95_ms': 10.0, 'queries': 3.0, 'errors': 0, **row}}, baseline, 0.5)
+
+        self.assertEqual(regressions(p95_ms=15.0, queries=2.0), [])
+        self.assertEqual(regressions(queries=3.5), ['cart: 3.5 queries per request, baseline 3.0'])
+        self.assertEqual(regressions(p95_ms=15.1), ['cart: p95 15.1 ms, baseline 10.0 ms'])
+        self.assertEqual(regressions(errors=2), ['cart: 2 errors'])
+        # HTTP runs count no queries, and steps missing from either side are skipped
+        self.assertEqual(regressions(queries=None), [])
+        self.assertEqual(perf.compare({}, baseline, 0.5), [])
+
+
+class SearchTests(ShopTestCase):
+    """Ranked search; on PostgreSQL this runs the full-text and trigram queries, elsewhere the in-process index."""
+
+    def setUp(self):
+        super().setUp()
+        self.pepperoni = Pizza.objects.create(
+            name='Pepperoni Feast', description='Spicy pepperoni and mozzarella',
+            small_price=12, medium_price=22, large_price=32
+        )
+        self.veggie = Pizza.objects.create(
+            name='Garden Veggie', description='Peppers, onions and olives on a margherita base',
+            small_price=11, medium_price=21, large_price=31
+        )
+        Pizza.objects.create(name='Pepper Steak', description='Beef strips', small_price=13, medium_price=23,
+                             large_price=33, available=False)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/pizzas/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return (
+            [pizza['name'] for pizza in response.data['pizzas']],
+            [topping['name'] for topping in response.data['toppings']]
+        )
+
+    def test_name_match_outranks_description_match(self):
+        self.assertEqual(self.search('marg')[0], ['Margherita', 'Garden Veggie'])
+
+    def test_every_word_must_match_as_a_prefix(self):
+        self.assertEqual(self.search('pep mozz')[0], ['Pepperoni Feast'])
+        self.assertEqual(self.search('pepperoni olives')[0], [])
+
+    def test_toppings_match_by_prefix(self):
+        self.assertEqual(self.search('oli'), (['Garden Veggie'], ['Olives']))
+
+    def test_typo_falls_back_to_similar_names(self):
+        self.assertEqual(self.search('peperoni')[0], ['Pepperoni Feast'])
+
+    def test_query_syntax_is_not_passed_through(self):
+        for query in ("pep & !mozz", "pep:* | (veg", "o'reilly\\\\", "<->"):
+            self.search(query)
+        self.assertEqual(self.search('')[0], [])
+
+    def test_limit(self):
+        self.assertEqual(len(self.search('pep', limit=1)[0]), 1)
+
+    def test_unlimited_search_for_the_menu_page(self):
+        pizzas, toppings = search_catalog('pep', limit=None)
+        self.assertEqual({pizza.name for pizza in pizzas}, {'Pepperoni Feast', 'Garden Veggie'})
+
+    @skipUnless(connection.vendor == 'postgresql', "search_vector is a PostgreSQL generated column")
+    def test_search_vector_follows_edits(self):
+        self.pepperoni.name = 'Diavola'
+        self.pepperoni.save()
+        self.assertEqual(self.search('diav')[0], ['Diavola'])
+        self.assertEqual(self.search('pepperoni')[0], ['Diavola'])  # Still in the description
+
+
+class ImageRenditionTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def photo(self, width, height, orientation=None):
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Phone camera'  # Make
+        if orientation:
+            exif[0x0112] = orientation
+        Image.new('RGB', (width, height), 'orange').save(buffer, format='JPEG', exif=exif)
+        return SimpleUploadedFile('crust.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def rendition(self, pizza, fmt, width):
+        with default_storage.open(pizza.image_renditions[fmt][str(width)]) as file:
+            image = Image.open(file)
+            image.load()
+        return image
+
+    def test_upload_is_resized_to_each_width_in_both_formats(self):
+        pizza = Pizza.objects.create(name='Pepperoni', small_price=10, medium_price=20, large_price=30,
+                                     image=self.photo(1200, 900))
+        pizza.refresh_from_db()
+        self.assertEqual((pizza.image_width, pizza.image_height), (1200, 900))
+        self.assertEqual(pizza.image_renditions['source'], pizza.image.name)
+        self.assertTrue(pizza.image_placeholder.startswith('data:image/jpeg;base64,'))
+        for fmt, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            self.assertEqual([width for width, url in pizza.image_rendition_urls(fmt)], [320, 640, 960])
+            image = self.rendition(pizza, fmt, 640)
+            self.assertEqual((image.format, image.size), (image_format, (640, 480)))
+            # Camera metadata is dropped
+            self.assertFalse(image.getexif())
+        self.assertTrue(pizza.image_fallback_url.endswith('-960.jpeg'))
+        self.assertEqual(pizza.webp_srcset.count(' 320w, '), 1)
+
+    def test_small_photos_are_not_upscaled(self):
+        pizza = Pizza.objects.create(name='Mini', small_price=10, medium_price=20, large_price=30,
+                                     image=self.photo(200, 100))
+        pizza.refresh_from_db()
+        self.assertEqual(list(pizza.image_renditions['jpeg']), ['200'])
+
+    def test_camera_rotation_is_applied(self):
+        # Orientation 6: the camera was turned, so the picture displays rotated a quarter turn
+        pizza = Pizza.objects.create(name='Tilted', small_price=10, medium_price=20, large_price=30,
+                                     image=self.photo(800, 400, orientation=6))
+        pizza.refresh_from_db()
+        self.assertEqual((pizza.image_width, pizza.image_height), (400, 800))
+        self.assertEqual(self.rendition(pizza, 'jpeg', 320).size, (320, 640))
+
+    def test_unchanged_image_is_not_rebuilt(self):
+        pizza = Pizza.objects.create(name='Pepperoni', small_price=10, medium_price=20, large_price=30,
+                                     image=self.photo(400, 400))
+        with mock.patch('core.signals.build_pizza_renditions') as build:
+            pizza.small_price = 12
+            pizza.save()
+        build.assert_not_called()
+
+
+class OrderPaginationTests(ShopTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for _ in range(3):
+            self.add_to_cart(2)
+            self.checkout()
+
+    def order_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [order['id'] for order in response.data['results']], response.data['next']
+
+    def test_list_is_slim(self):
+        order = self.client.get('/api/orders/').data['results'][0]
+        self.assertEqual(set(order), {'id', 'status', 'total_amount', 'created_at', 'item_count'})
+        self.assertEqual(order['item_count'], 2)
+
+    def test_new_orders_do_not_shift_the_next_page(self):
+        first_page, next_page = self.order_ids('/api/orders/?page_size=2')
+        self.add_to_cart(1)
+        self.checkout()
+        second_page, last = self.order_ids(next_page)
+        self.assertEqual(first_page + second_page, sorted(first_page + second_page, reverse=True))
+        self.assertEqual(len(set(first_page + second_page)), 3)
+        self.assertIsNone(last)
+
+    def test_page_size_is_capped(self):
+        Order.objects.bulk_create([Order(user=self.user, order_type='O', total_amount=10) for _ in range(120)])
+        self.assertEqual(len(self.order_ids('/api/orders/')[0]), 20)
+        self.assertEqual(len(self.order_ids('/api/orders/?page_size=500')[0]), 100)
+
+    def test_customers_only_see_their_own_orders(self):
+        other = User.objects.create_user('neighbour')
+        Order.objects.create(user=other, order_type='O', total_amount=10)
+        self.assertEqual(len(self.order_ids('/api/orders/')[0]), 3)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+        self.assertEqual(len(self.order_ids('/api/orders/')[0]), 4)
+
+
+class OrderArchiveTests(ShopTestCase):
+    """Archived orders read back together with the live ones."""
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for days_ago in (1, 2, 3, 3, 4, 5):
+            self.add_to_cart(1)
+            order_id = self.checkout().data['id']
+            Order.objects.filter(pk=order_id).update(created_at=now - timedelta(days=days_ago))
+        self.orders = list(Order.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        # Every other order is delivered and archived, including one of the two placed at the same moment
+        Order.objects.filter(pk__in=self.orders[1::2]).update(status='DL')
+        self.assertEqual(archive_batch(now), 3)
+        self.assertEqual(Order.objects.count(), 3)
+
+    def test_cursor_pages_merge_live_and_archived(self):
+        seen, pages = [], 0
+        url = '/api/orders/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            seen += [order['id'] for order in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+        self.assertEqual(seen, self.orders)
+        self.assertEqual(pages, 3)
+
+        previous = self.client.get(self.client.get('/api/orders/?page_size=2').data['next']).data['previous']
+        self.assertEqual([order['id'] for order in self.client.get(previous).data['results']], self.orders[:2])
+
+    def test_export_includes_archived_orders(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+
+        def exported(**params):
+            response = self.client.get('/api/orders/export/', {'type': 'ndjson', **params})
+            self.assertEqual(response.status_code, 200)
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        lines = exported()
+        self.assertEqual([line['id'] for line in lines], sorted(self.orders))
+        self.assertEqual({line['status'] for line in lines}, {'P', 'DL'})
+        self.assertTrue(all(len(line['items']) == 1 for line in lines))
+        # Resuming after an archived order carries on through both tables
+        archived = sorted(self.orders[1::2])[0]
+        self.assertEqual(
+            [line['id'] for line in exported(after=archived)],
+            [order_id for order_id in sorted(self.orders) if order_id > archived]
+        )
+
+
+class SalesRollupTests(ShopTestCase):
+    """Hourly and daily rollups add up to the orders they were built from."""
+
+    def setUp(self):
+        super().setUp()
+        self.day = timezone.localdate() - timedelta(days=3)
+        self.morning = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=3)
+
+    def place(self, lines, minutes, status='P'):
+        self.add_to_cart(lines)
+        order_id = self.checkout().data['id']
+        Order.objects.filter(pk=order_id).update(created_at=self.morning + timedelta(minutes=minutes), status=status)
+        return Order.objects.get(pk=order_id)
+
+    def test_hourly_and_daily_totals(self):
+        first, second = self.place(1, 15), self.place(2, 40)
+        cancelled = self.place(1, 4 * 60 + 5, status='C')
+        self.assertEqual(refresh_rollups(), 2)
+
+        revenue = first.total_amount + second.total_amount
+        hours = analytics.revenue_series(self.day, self.day, SalesRollup.HOUR)
+        self.assertEqual(
+            [(row['period_start'].hour, row['orders'], row['cancelled_orders'], row['pizzas_sold'], row['revenue'])
+             for row in hours],
+            [(10, 2, 0, 6, revenue), (14, 0, 1, 0, 0)]
+        )
+        self.assertEqual(hours[0]['average_order_value'], (revenue / 2).quantize(Decimal('0.01')))
+        self.assertIsNone(hours[1]['average_order_value'])
+
+        # The cancelled order still has a total of its own; it just isn't revenue
+        self.assertGreater(cancelled.total_amount, 0)
+        totals = analytics.summary(self.day, self.day)
+        self.assertEqual(totals, {
+            'orders': 2,
+            'cancelled_orders': 1,
+            'pizzas_sold': 6,
+            'revenue': revenue,
+            'delivery_fees': first.delivery_fee + second.delivery_fee,
+            'average_order_value': (revenue / 2).quantize(Decimal('0.01')),
+        })
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+        response = self.client.get('/api/analytics/summary/', {'start': self.day, 'end': self.day})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['results'], totals)
+
+    def test_best_sellers_and_topping_attach_rates(self):
+        self.place(1, 15)
+        response = self.client.post('/api/cart/add_item/', {'pizza_id': self.pizza.id, 'size': 'L'}, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.place(0, 20)
+        self.place(1, 30, status='C')
+        refresh_rollups()
+
+        self.assertEqual(
+            [(row['name'], row['size'], row['quantity'], row['revenue'])
+             for row in analytics.best_sellers(self.day, self.day)],
+            [('Margherita', 'M', 2, 50), ('Margherita', 'L', 1, 30)]
+        )
+        # Both toppings went on the two medium pizzas out of three sold
+        rates = analytics.topping_attach_rates(self.day, self.day)
+        self.assertEqual(
+            {row['name']: (row['pizzas'], row['attach_rate']) for row in rates},
+            {'Olives': (2, 0.6667), 'Jalapenos': (2, 0.6667)}
+        )
+
+    def test_reruns_rebuild_only_what_changed(self):
+        order = self.place(1, 15)
+        self.place(1, 45)
+        refresh_rollups()
+        before = analytics.summary(self.day, self.day)
+        refresh_rollups()
+        self.assertEqual(analytics.summary(self.day, self.day), before)
+
+        # A cancellation after the watermark moves the order out of revenue on the next run
+        Order.objects.filter(pk=order.pk).update(status='C', updated_at=timezone.now() + timedelta(minutes=10))
+        self.assertEqual(refresh_rollups(timezone.now() + timedelta(minutes=15)), 1)
+        after = analytics.summary(self.day, self.day)
+        self.assertEqual((after['orders'], after['cancelled_orders'], after['pizzas_sold']), (1, 1, 2))
+        self.assertEqual(after['revenue'], before['revenue'] - order.total_amount)
+
+    def test_archived_orders_still_count(self):
+        archived = self.place(1, 15, status='DL')
+        live = self.place(2, 45)
+        self.assertEqual(archive_batch(self.morning + timedelta(minutes=30)), 1)
+        # Touching the live order rebuilds the shared hour from both tables
+        Order.objects.filter(pk=live.pk).update(updated_at=timezone.now())
+        refresh_rollups()
+
+        totals = analytics.summary(self.day, self.day)
+        self.assertEqual((totals['orders'], totals['pizzas_sold']), (2, 6))
+        self.assertEqual(totals['revenue'], archived.total_amount + live.total_amount)
+
+
+class DeletedPizzaTests(ShopTestCase):
+    """Deleting a pizza from the menu leaves order history, live and archived, intact."""
+
+    def setUp(self):
+        super().setUp()
+        self.retired = Pizza.objects.create(name='Seasonal Special', description='Gone next month',
+                                            small_price=15, medium_price=25, large_price=35)
+        for pizza in (self.pizza, self.retired):
+            response = self.client.post('/api/cart/add_item/', {'pizza_id': pizza.id, 'size': 'L'}, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+        self.order = Order.objects.get(pk=self.checkout().data['id'])
+
+    def test_order_items_keep_their_snapshot(self):
+        Order.objects.filter(pk=self.order.pk).update(status='DL', created_at=timezone.now() - timedelta(days=365))
+        archive_batch(timezone.now())
+        self.add_to_cart(1)
+        live_order = self.checkout().data['id']
+        self.retired.delete()
+
+        for order_id in (self.order.id, live_order):
+            response = self.client.get(f'/api/orders/{order_id}/')
+            self.assertEqual(response.status_code, 200, response.content)
+        archived = self.client.get(f'/api/orders/{self.order.id}/').data
+        self.assertEqual(
+            {item['pizza']['name']: item['pizza']['id'] for item in archived['items']},
+            {'Margherita': self.pizza.id, 'Seasonal Special': None}
+        )
+        self.assertEqual(ArchivedOrderItem.objects.filter(pizza=None).count(), 1)
+
+    def test_rollups_still_count_the_deleted_pizza(self):
+        self.retired.delete()
+        self.assertEqual(OrderItem.objects.filter(order=self.order, pizza=None).count(), 1)
+
+        refresh_rollups()
+        today = timezone.localdate()
+        self.assertEqual(analytics.summary(today, today)['pizzas_sold'], 2)
+        self.assertEqual([row['name'] for row in analytics.best_sellers(today, today)], ['Margherita'])
+        self.assertEqual(
+            {row['pizza']: row['quantity'] for row in analytics.export_history(today, today, by='pizza')},
+            {self.pizza.id: 1, None: 1}
+        )
+
+
+class TokenRevocationTests(ShopTestCase):
+    """Logouts, deactivations and demotions refuse old tokens in every worker, not just the one that saw them."""
+
+    def setUp(self):
+        super().setUp()
+        self.tokens = issue_tokens(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def cart_count_status(self):
+        return self.client.get('/api/cart/count/').status_code
+
+    def in_another_worker(self):
+        # A process that has never seen the revocation, with nothing in its cache
+        cache.clear()
+        return mock.patch.object(auth, 'revocations', auth.RevocationList())
+
+    def test_no_user_query_per_request(self):
+        self.assertEqual(self.cart_count_status(), 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.cart_count_status(), 200)
+        self.assertFalse([query['sql'] for query in queries if 'auth_user' in query['sql']])
+
+    def test_logout(self):
+        response = self.client.post('/api/logout/', {'refresh_token': self.tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.cart_count_status(), 401)
+        with self.in_another_worker():
+            self.assertEqual(self.cart_count_status(), 401)
+
+    def assertChangeRevokes(self, **changes):
+        for name, value in changes.items():
+            setattr(self.user, name, value)
+        self.user.save()
+        self.assertEqual(self.cart_count_status(), 401)
+        with self.in_another_worker():
+            self.assertEqual(self.cart_count_status(), 401)
+
+    def test_deactivation(self):
+        self.assertChangeRevokes(is_active=False)
+
+    def test_staff_change(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_tokens(self.user)['access']}")
+        self.assertChangeRevokes(is_staff=False)
+
+    def test_demoted_user_cannot_refresh(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.user.is_staff = True
+        refresh = issue_tokens(self.user)['refresh']
+        self.user.is_staff = False
+        self.user.save()
+
+        response = APIClient().post('/api/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, 401, response.content)
+
+    def test_login_right_after_revocation_works(self):
+        auth.revoke_user_tokens(self.user.pk)
+        self.assertEqual(self.cart_count_status(), 401)
+        # Most likely within the same whole second as the revocation
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_tokens(self.user)['access']}")
+        self.assertEqual(self.cart_count_status(), 200)
+
+    def test_other_workers_catch_up_within_the_poll_interval(self):
+        self.assertEqual(self.cart_count_status(), 200)
+        with self.in_another_worker():
+            self.assertEqual(self.cart_count_status(), 200)
+            auth.TokenRevocation.objects.create(
+                user_id=self.user.pk, jti='', expires_at=timezone.now() + timedelta(hours=1)
+            )
+            self.assertEqual(self.cart_count_status(), 200)  # Not polled yet
+            auth.revocations.polled_at -= settings.JWT_REVOCATION_POLL_SECONDS + 1
+            self.assertEqual(self.cart_count_status(), 401)
+
+    def test_expired_revocations_are_dropped(self):
+        auth.TokenRevocation.objects.create(user_id=self.user.pk, jti='gone', expires_at=timezone.now())
+        revoke_token(AccessToken(self.tokens['access']))
+        self.assertEqual(list(auth.TokenRevocation.objects.values_list('user_id', flat=True)), [self.user.pk])
+
+
+@override_settings(PASSWORD_HASHING_POOL={'WORKERS': 1, 'BACKLOG': 0}, PASSWORD_PBKDF2_ITERATIONS=1000)
+
+
+class PasswordHashingTests(ShopTestCase):
+    """Sign-ins beyond the hashing pool's slots are shed with a 429 rather than queued."""
+
+    def setUp(self):
+        super().setUp()
+        hashing.get_pool.cache_clear()
+        self.addCleanup(hashing.get_pool.cache_clear)
+
+    def login(self, password='crust-and-cheese'):
+        return APIClient().post('/api/login/', {'username': 'customer', 'password': password}, format='json')
+
+    def hold_the_only_slot(self):
+        busy, release = threading.Event(), threading.Event()
+
+        def hash_slowly():
+            busy.set()
+            release.wait(5)
+
+        def free_the_slot():
+            release.set()
+            thread.join()
+
+        thread = threading.Thread(target=hashing.get_pool().run, args=(hash_slowly,))
+        thread.start()
+        self.addCleanup(free_the_slot)
+        self.assertTrue(busy.wait(5))
+        return free_the_slot
+
+    def test_full_pool_sheds_with_429(self):
+        free_the_slot = self.hold_the_only_slot()
+
+        response = self.login()
+        self.assertEqual(response.status_code, 429, response.content)
+        self.assertEqual(response['Retry-After'], '1')
+        response = APIClient().post('/api/register/', {
+            'username': 'newcomer', 'password': 'thin-crust', 'email': 'new@example.com',
+            'phone': '+923001112233', 'address': '1 Canal Road'
+        }, format='json')
+        self.assertEqual(response.status_code, 429, response.content)
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+        response = self.client.post('/api/change_password/', {
+            'current_password': 'crust-and-cheese', 'new_password': 'deep-dish'
+        }, format='json')
+        self.assertEqual(response.status_code, 429, response.content)
+
+        free_the_slot()
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_login_upgrades_an_outdated_hash(self):
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.user.set_password('crust-and-cheese')
+            self.user.save()
+        self.assertEqual(self.login('wrong').status_code, 401)
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
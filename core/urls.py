@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'pizzas', views.PizzaViewSet)
 router.register(r'toppings', views.ToppingViewSet)
 router.register(r'cart', views.CartViewSet, basename='cart')
 router.register(r'orders', views.OrderViewSet, basename='order')
+router.register(r'kitchen', views.KitchenBoardViewSet, basename='kitchen')
+router.register(r'analytics', views.AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     # Web URLs
@@ -22,11 +24,20 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     
     # API URLs
+    # Must come before the router, whose <pk> detail routes would swallow them
+    path('api/cart/count/', views.get_cart_count, name='get_cart_count'),
+    path('api/orders/events/', async_views.order_events, name='order_events'),
+    path('api/_metrics', views.metrics, name='metrics'),
     path('api/', include(router.urls)),
     path('api/register/', views.UserRegistrationView.as_view(), name='api_register'),
     path('api/login/', views.UserLoginView.as_view(), name='api_login'),
     path('api/logout/', views.UserLogoutView.as_view(), name='api_logout'),
-    path('api/cart/count/', views.get_cart_count, name='get_cart_count'),
     path('api/update_profile/', views.update_profile, name='api_update_profile'),
     path('api/change_password/', views.change_password, name='api_change_password'),
+    
+    # Async read paths, for serving under ASGI
+    path('api/async/menu/', async_views.menu, name='async_menu'),
+    path('api/async/cart/', async_views.cart, name='async_cart'),
+    path('api/async/cart/count/', async_views.cart_count, name='async_cart_count'),
+    path('api/async/orders/<int:order_id>/', async_views.order_detail, name='async_order_detail'),
 ]
\ No newline at end of file
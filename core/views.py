@@ -1,73 +1,136 @@
+import hashlib
+import json
+from datetime import timedelta
+
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth import login, logout, authenticate
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.hashers import check_password
 from django.contrib import messages
-from rest_framework import viewsets, status, permissions
+from rest_framework import generics, viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.http import JsonResponse
-from .models import UserProfile, Pizza, Topping, Cart, CartItem, Order, OrderItem
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from .models import (
+    UserProfile, Pizza, Topping, Cart, CartItem, Order, OrderItem, ArchivedOrder, IdempotencyKey, SalesRollup
+)
+from . import analytics, delivery
+from .archive import OrderHistory, find_order
+from .auth import StatelessJWTAuthentication, forget_user_row, issue_tokens, revoke_token
+from .hashing import HashingBusy, check_credentials, get_pool as get_hashing_pool, hash_password
+from .checkout import place_order
+from .jobs import enqueue
+from .order_status import InvalidTransition, change_status, change_statuses, stage_latencies
+from .cart_batch import CartOperationError, apply_cart_operations
+from .carts import (
+    forget_cart_counts, get_active_cart, get_cart_count as get_cached_cart_count, get_or_create_active_cart, lock_active_cart
+)
 from .serializers import (
     UserSerializer, UserProfileSerializer, PizzaSerializer, ToppingSerializer,
-    CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer
+    CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, OrderListSerializer,
+    KitchenOrderSerializer, eager_load
 )
-from django.db import models
-from django.db.models import Q
+from .pagination import OrderCursorPagination
+from .events import publish_order_event
+from .exports import EXPORTERS, aiter_chunks, export_filters, export_orders
+from .metrics import registry as metrics_registry
+from rest_framework.request import Request
+from django.db import models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views.decorators.csrf import csrf_exempt
-
-# Context processor for cart count
-def cart_count(request):
-    count = 0
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user, active=True)
-        count = cart.items.count()
-    return {'cart_count': count}
+from django.views.decorators.http import condition
+from .menu_cache import catalog_version, get_or_build, catalog_etag
+from .search import search_catalog, tokenize
 
 # Web Views
 def home(request):
+    # Querysets are lazy, so they only run when the cached fragments are cold
     featured_pizzas = Pizza.objects.filter(available=True)[:3]
-    return render(request, 'core/home.html', {'featured_pizzas': featured_pizzas})
+    return render(request, 'core/home.html', {
+        'featured_pizzas': featured_pizzas,
+        'catalog_version': catalog_version()
+    })
 
 def menu(request):
     search_query = request.GET.get('search', '')
     pizzas = Pizza.objects.filter(available=True)
     toppings = Topping.objects.filter(available=True)
     
-    # Filter pizzas based on search query
+    # Ranked search, lazy so it only runs when the cached fragment is cold
     if search_query:
-        pizzas = pizzas.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+        pizzas = SimpleLazyObject(lambda: search_catalog(search_query, limit=None)[0])
     
-    return render(request, 'core/menu.html', {'pizzas': pizzas, 'toppings': toppings, 'search_query': search_query})
+    return render(request, 'core/menu.html', {
+        'pizzas': pizzas,
+        'toppings': toppings,
+        'search_query': search_query,
+        'catalog_version': catalog_version()
+    })
 
 @login_required
 def cart(request):
-    cart, created = Cart.objects.get_or_create(user=request.user, active=True)
-    return render(request, 'core/cart.html', {'cart': cart})
+    cart = get_active_cart(request.user)
+    items = cart.items.select_related('pizza').prefetch_related('toppings') if cart else []
+    # Delivery to the saved address; checkout quotes the address actually given
+    address = UserProfile.objects.filter(user=request.user).values_list('address', flat=True).first()
+    return render(request, 'core/cart.html', {
+        'cart': cart,
+        'items': items,
+        'delivery_fee': delivery.get_zone(address)['fee']
+    })
 
 @login_required
 def checkout(request):
-    cart, created = Cart.objects.get_or_create(user=request.user, active=True)
-    if not cart.items.exists():
+    cart = get_active_cart(request.user)
+    if not cart or not cart.item_count:
         messages.error(request, 'Your cart is empty')
         return redirect('cart')
-    return render(request, 'core/checkout.html', {'cart': cart})
+    address = UserProfile.objects.filter(user=request.user).values_list('address', flat=True).first()
+    quote = delivery.estimate('D', address, delivery.prep_minutes(cart.items.select_related('pizza')))
+    return render(request, 'core/checkout.html', {'cart': cart, 'quote': quote})
 
 @login_required
 def orders(request):
-    user_orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'core/orders.html', {'orders': user_orders})
+    # Recent orders first, running on into the archived history
+    user_orders = OrderHistory(Order.objects.filter(user=request.user),
+                               ArchivedOrder.objects.filter(user=request.user))
+    paginator = OrderCursorPagination()
+    page = paginator.paginate_queryset(user_orders, Request(request))
+    return render(request, 'core/orders.html', {
+        'orders': page,
+        'next_page': paginator.get_next_link(),
+        'previous_page': paginator.get_previous_link()
+    })
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    return render(request, 'core/order_detail.html', {'order': order})
+    order = find_order(
+        eager_load(Order.objects.all(), OrderSerializer()),
+        eager_load(ArchivedOrder.objects.all(), OrderSerializer()),
+        id=order_id, user=request.user
+    )
+    if order is None:
+        raise Http404("No Order matches the given query.")
+    # Cart batch operations that put the same pizzas back in the cart, less any since deleted
+    reorder_operations = [
+        {
+            'op': 'add',
+            'pizza_id': item.pizza_id,
+            'size': item.size,
+            'quantity': item.quantity,
+            'topping_ids': [topping['id'] for topping in item.topping_snapshot]
+        }
+        for item in order.items.all()
+        if item.pizza_id is not None
+    ]
+    return render(request, 'core/order_detail.html', {'order': order, 'reorder_operations': reorder_operations})
 
 @login_required
 def profile(request):
@@ -86,6 +149,18 @@ def logout_view(request):
     return render(request, "core/logout.html")
 
 # API Views
+def positive_int(value):
+    # Quantities as posted, e.g. 2 or "2"; None for anything that isn't a positive whole number
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+def hashing_busy():
+    return Response({'error': 'Too many sign-ins at the moment, please try again shortly'},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': '1'})
+
 @method_decorator(csrf_exempt, name='dispatch')
 class UserRegistrationView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -106,25 +181,32 @@ class UserRegistrationView(APIView):
         if User.objects.filter(username=username).exists():
             return Response({'error': 'Username already exists'}, status=status.HTTP_400_BAD_REQUEST)
         
-        user = User.objects.create_user(
-            username=username,
-            password=password,
-            email=email,
-            first_name=first_name,
-            last_name=last_name
-        )
+        # Hash before the transaction, so no locks are held while it runs
+        try:
+            password_hash = hash_password(password)
+        except HashingBusy:
+            return hashing_busy()
         
-        UserProfile.objects.create(
-            user=user,
-            phone=phone,
-            address=address
-        )
+        with transaction.atomic():
+            user = User.objects.create(
+                username=User.normalize_username(username),
+                password=password_hash,
+                email=User.objects.normalize_email(email),
+                first_name=first_name,
+                last_name=last_name
+            )
+            
+            profile = UserProfile.objects.create(
+                user=user,
+                phone=phone,
+                address=address
+            )
+            
+            enqueue('send_welcome_email', user_id=user.id, idempotency_key=f"welcome-email:{user.id}")
         
-        refresh = RefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
+            **issue_tokens(user, profile_id=profile.id),
         }, status=status.HTTP_201_CREATED)
         
         
@@ -134,7 +216,6 @@ from rest_framework import status, permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.contrib.auth.models import User
-from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import UserSerializer
 
@@ -147,15 +228,16 @@ class UserLoginView(APIView):
         username = request.data.get('username')
         password = request.data.get('password')
         
-        user = authenticate(username=username, password=password)
+        try:
+            user = check_credentials(username, password)
+        except HashingBusy:
+            return hashing_busy()
         
         if user:
-            refresh = RefreshToken.for_user(user)
             return Response({
                 'success': True,
                 'user': UserSerializer(user).data,
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
+                **issue_tokens(user),
             }, status=status.HTTP_200_OK)
         
         return Response({
@@ -163,11 +245,10 @@ class UserLoginView(APIView):
             'error': 'Invalid credentials'
         }, status=status.HTTP_401_UNAUTHORIZED)
         
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class UserLogoutView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [StatelessJWTAuthentication]
     permission_classes = [permissions.IsAuthenticated]
     
     def post(self, request):
@@ -177,6 +258,8 @@ class UserLogoutView(APIView):
             if refresh_token:
                 token = RefreshToken(refresh_token)
                 token.blacklist()
+            # and refuse the access token from now on, without waiting for it to expire
+            revoke_token(request.auth)
             
             return Response({'success': True}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -192,6 +275,35 @@ class PizzaViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return super().get_permissions()
+    
+    @method_decorator(condition(etag_func=catalog_etag))
+    def list(self, request, *args, **kwargs):
+        # Image URLs are absolute, so the cached payload is per host
+        data = get_or_build(
+            f"api:pizzas:{request.build_absolute_uri('/')}",
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        )
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked pizzas and toppings for ?q=, matching word prefixes as the user types."""
+        query = ' '.join(tokenize(request.query_params.get('q', '')))
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 50))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        def build():
+            pizzas, toppings = search_catalog(query, limit)
+            return {
+                'query': query,
+                'pizzas': self.get_serializer(pizzas, many=True).data,
+                'toppings': ToppingSerializer(toppings, many=True).data
+            }
+        
+        query_hash = hashlib.md5(query.encode()).hexdigest()
+        return Response(get_or_build(f"api:search:{request.build_absolute_uri('/')}:{limit}:{query_hash}", build))
 
 class ToppingViewSet(viewsets.ModelViewSet):
     queryset = Topping.objects.all()
@@ -202,46 +314,75 @@ class ToppingViewSet(viewsets.ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [permissions.IsAdminUser()]
         return super().get_permissions()
+    
+    @method_decorator(condition(etag_func=catalog_etag))
+    def list(self, request, *args, **kwargs):
+        # Image URLs are absolute, so the cached payload is per host
+        data = get_or_build(
+            f"api:toppings:{request.build_absolute_uri('/')}",
+            lambda: self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data
+        )
+        return Response(data)
+
+class EagerLoadingMixin:
+    """Eager load the queryset to match the shape of the viewset's serializer."""
+    
+    def get_queryset(self):
+        return eager_load(super().get_queryset(), self.get_serializer_class()())
 
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
+    queryset = Cart.objects.all()
     
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user, active=True)
+        return super().get_queryset().filter(user=self.request.user, active=True)
     
     def get_object(self):
-        cart, created = Cart.objects.get_or_create(
-            user=self.request.user,
-            active=True
-        )
-        return cart
+        if self.action == 'retrieve':
+            cart = self.get_queryset().first()
+            if cart is not None:
+                return cart
+        return get_or_create_active_cart(self.request.user)
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
-        cart = self.get_object()
         pizza_id = request.data.get('pizza_id')
         size = request.data.get('size')
         quantity = request.data.get('quantity', 1)
         topping_ids = request.data.get('topping_ids', [])
         notes = request.data.get('notes', '')
         
+        if size not in dict(Pizza.SIZE_CHOICES):
+            return Response({'error': 'Invalid size'}, status=status.HTTP_400_BAD_REQUEST)
+        quantity = positive_int(quantity)
+        if quantity is None:
+            return Response({'error': 'Quantity must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
         try:
             pizza = Pizza.objects.get(id=pizza_id)
         except Pizza.DoesNotExist:
             return Response({'error': 'Pizza not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        cart_item = CartItem.objects.create(
-            cart=cart,
-            pizza=pizza,
-            size=size,
-            quantity=quantity,
-            notes=notes
-        )
+        toppings = list(Topping.objects.filter(id__in=topping_ids)) if topping_ids else []
         
-        if topping_ids:
-            toppings = Topping.objects.filter(id__in=topping_ids)
-            cart_item.toppings.set(toppings)
+        with transaction.atomic():
+            cart = lock_active_cart(request.user)
+            cart_item = CartItem(
+                cart=cart,
+                pizza=pizza,
+                size=size,
+                quantity=quantity,
+                notes=notes
+            )
+            cart_item.set_price(cart_item.compute_unit_price(toppings))
+            cart_item.save()
+            
+            if toppings:
+                cart_item.toppings.set(toppings)
+            
+            cart.apply_delta(cart_item.line_total, 1)
+        forget_cart_counts([request.user.pk])
         
         serializer = CartItemSerializer(cart_item)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -251,8 +392,14 @@ class CartViewSet(viewsets.ModelViewSet):
         item_id = request.data.get('item_id')
         
         try:
-            item = CartItem.objects.get(id=item_id, cart__user=request.user)
-            item.delete()
+            with transaction.atomic():
+                # Locks the item and its cart, so this waits for a checkout in progress
+                item = CartItem.objects.select_related('cart').select_for_update().get(
+                    id=item_id, cart__user=request.user, cart__active=True
+                )
+                item.delete()
+                item.cart.apply_delta(-item.line_total, -1)
+            forget_cart_counts([request.user.pk])
             return Response({'message': 'Item removed from cart'}, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
             return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
@@ -260,32 +407,124 @@ class CartViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'])
     def update_item_quantity(self, request):
         item_id = request.data.get('item_id')
-        quantity = request.data.get('quantity')
+        quantity = positive_int(request.data.get('quantity'))
+        if quantity is None:
+            return Response({'error': 'Quantity must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            item = CartItem.objects.get(id=item_id, cart__user=request.user)
-            item.quantity = quantity
-            item.save()
+            with transaction.atomic():
+                item = CartItem.objects.select_related('cart').select_for_update().get(
+                    id=item_id, cart__user=request.user, cart__active=True
+                )
+                old_total = item.line_total
+                item.quantity = quantity
+                item.set_price(item.unit_price)
+                item.save(update_fields=['quantity', 'line_total'])
+                item.cart.apply_delta(item.line_total - old_total)
             return Response({
-                'price': item.get_price()
+                'price': item.get_price(),
+                'subtotal': item.cart.subtotal
             }, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
             return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
 
-class OrderViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        try:
+            with transaction.atomic():
+                cart = apply_cart_operations(lock_active_cart(request.user), request.data.get('operations'))
+        except CartOperationError as e:
+            return Response({'error': e.message, 'operation': e.index}, status=status.HTTP_400_BAD_REQUEST)
+        
+        forget_cart_counts([request.user.pk])
+        cart = eager_load(Cart.objects.all(), CartSerializer()).get(pk=cart.pk)
+        return Response(CartSerializer(cart, context={'request': request}).data, status=status.HTTP_200_OK)
+
+class OrderViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
+    queryset = Order.objects.all()
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return super().get_serializer_class()
     
     def get_queryset(self):
+        return self.scope(super().get_queryset())
+    
+    def get_archived_queryset(self):
+        return self.scope(eager_load(ArchivedOrder.objects.all(), self.get_serializer_class()()))
+    
+    def scope(self, queryset):
         user = self.request.user
+        if self.action == 'list':
+            queryset = queryset.annotate(item_count=models.Count('items'))
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
+    
+    def list(self, request, *args, **kwargs):
+        # Recent orders first, running on into the archived history
+        page = self.paginate_queryset(OrderHistory(self.get_queryset(), self.get_archived_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Archived orders can be read but not changed
+            if self.action != 'retrieve':
+                raise
+        order = generics.get_object_or_404(self.filter_queryset(self.get_archived_queryset()), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, order)
+        return order
     
     @action(detail=False, methods=['post'])
     def checkout(self, request):
+        """Place an order from the active cart.
+        
+        Clients may send an Idempotency-Key header; a retry with the same key
+        gets the original response back instead of a second order.
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return self._place_order(request)
+        if len(key) > 255:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        request_hash = hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+        with transaction.atomic():
+            # A concurrent request with the same key blocks on this insert until the first one commits
+            record, created = IdempotencyKey.objects.get_or_create(
+                user=request.user,
+                key=key,
+                defaults={'request_hash': request_hash}
+            )
+            if not created:
+                if record.request_hash != request_hash:
+                    return Response({'error': 'Idempotency-Key was already used for a different request'},
+                                   status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(record.response_body, status=record.response_status,
+                                headers={'Idempotent-Replayed': 'true'})
+            
+            response = self._place_order(request)
+            if response.status_code != status.HTTP_201_CREATED:
+                # Don't keep failures, so the key can be retried once the cart is fixed
+                transaction.set_rollback(True)
+                return response
+            
+            record.order_id = response.data['id']
+            record.response_status = response.status_code
+            record.response_body = response.data
+            record.save(update_fields=['order', 'response_status', 'response_body'])
+        return response
+    
+    def _place_order(self, request):
         cart = Cart.objects.filter(user=request.user, active=True).first()
-        if not cart or not cart.items.exists():
+        if not cart:
             return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
         
         order_type = request.data.get('order_type', 'D')
@@ -296,45 +535,64 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Delivery address is required for delivery orders'}, 
                            status=status.HTTP_400_BAD_REQUEST)
         
-        # Calculate total amount
-        total_amount = sum(item.get_price() for item in cart.items.all())
-        
-        # Add delivery fee if applicable
-        delivery_fee = 0
-        if order_type == 'D':
-            delivery_fee = 50  # Flat delivery fee
-            total_amount += delivery_fee
-        
-        order = Order.objects.create(
-            user=request.user,
-            order_type=order_type,
-            delivery_address=delivery_address,
-            delivery_fee=delivery_fee,
-            estimated_delivery_time='30-45 minutes',
-            payment_method='Cash on Delivery',
-            total_amount=total_amount,
-            notes=notes
-        )
-        
-        # Create order items from cart items
-        for item in cart.items.all():
-            order_item = OrderItem.objects.create(
-                order=order,
-                pizza=item.pizza,
-                size=item.size,
-                quantity=item.quantity,
-                price=item.get_price()
-            )
-            order_item.toppings.set(item.toppings.all())
-        
-        # Clear the cart
-        cart.items.all().delete()
-        cart.active = False
-        cart.save()
+        order = place_order(request.user, cart, order_type, delivery_address, notes)
+        if order is None:
+            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+        forget_cart_counts([request.user.pk])
+        publish_order_event(order)
         
+        order = self.get_queryset().get(pk=order.pk)
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['get'])
+    def quote(self, request):
+        """Delivery fee and ETA window for checking out the active cart now.
+        
+        Takes ?order_type=D|O and ?delivery_address=.
+        """
+        order_type = request.query_params.get('order_type', 'D')
+        if order_type not in dict(Order.ORDER_TYPE_CHOICES):
+            return Response({'error': 'Invalid order type'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        cart = get_active_cart(request.user)
+        items = CartItem.objects.filter(cart=cart).select_related('pizza') if cart else []
+        quote = delivery.estimate(order_type, request.query_params.get('delivery_address'), delivery.prep_minutes(items))
+        return Response({
+            'zone': quote['zone'],
+            'delivery_fee': quote['fee'],
+            'eta_earliest': quote['eta_earliest'],
+            'eta_latest': quote['eta_latest'],
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream matching orders as ?type=csv (default) or ndjson.
+        
+        Filters: ?start= and ?end= dates, ?status=P,DL and ?after=<order id>
+        to resume an interrupted download.
+        """
+        if not request.user.is_staff:
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        
+        export_type = request.query_params.get('type', 'csv')
+        if export_type not in EXPORTERS:
+            return Response({'error': 'type must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            filters = export_filters(**{
+                name: request.query_params.get(name) for name in ('start', 'end', 'status', 'after')
+            })
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        stream, content_type = EXPORTERS[export_type]
+        chunks = stream(export_orders(**filters))
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiter_chunks(chunks)
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_type}"'
+        return response
+    
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
         if not request.user.is_staff:
@@ -346,47 +604,176 @@ class OrderViewSet(viewsets.ModelViewSet):
         if new_status not in dict(Order.STATUS_CHOICES):
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
         
-        order.status = new_status
-        order.save()
+        try:
+            event = change_status(order, new_status, request.user)
+        except InvalidTransition as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        publish_order_event(order)
+        delivery.record_transition(order, event)
         
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+class KitchenBoardViewSet(viewsets.ViewSet):
+    """Live orders for the kitchen screen, oldest first within each status.
+
+    Changes are pushed on the order event stream (/api/orders/events/?kitchen=1).
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get_queryset(self):
+        # Served by the partial index on active statuses
+        return Order.objects.filter(status__in=Order.ACTIVE_STATUSES).order_by(
+            'created_at', 'id'
+        ).select_related('user').prefetch_related('items')
+    
+    def list(self, request):
+        groups = {code: [] for code in Order.ACTIVE_STATUSES}
+        for order in KitchenOrderSerializer(self.get_queryset(), many=True).data:
+            groups[order['status']].append(order)
+        
+        status_labels = dict(Order.STATUS_CHOICES)
+        return Response([
+            {'status': code, 'label': status_labels[code], 'orders': groups[code]}
+            for code in Order.ACTIVE_STATUSES
+        ])
+    
+    @action(detail=False, methods=['post'])
+    def transition(self, request):
+        order_ids = request.data.get('order_ids', [])
+        new_status = request.data.get('status')
+        
+        if new_status not in dict(Order.STATUS_CHOICES):
+            return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(order_ids, list) or not order_ids:
+            return Response({'error': 'order_ids must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order_ids = [int(order_id) for order_id in order_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'order_ids must be order ids'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Orders that can't make the move, e.g. already delivered, stay put and are reported back
+        moved, rejected = change_statuses(order_ids, new_status, request.user)
+        for order in moved:
+            publish_order_event(order)
+            delivery.record_transition(order, order.status_event)
+        
+        return Response({
+            'updated': len(moved),
+            'rejected': [{'id': order_id, 'error': error} for order_id, error in rejected.items()]
+        }, status=status.HTTP_200_OK if moved else status.HTTP_400_BAD_REQUEST)
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def get_cart_count(request):
-    cart, created = Cart.objects.get_or_create(user=request.user, active=True)
-    count = cart.items.count()
-    return Response({'count': count})
+    return Response({'count': get_cached_cart_count(request.user)})
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    """Sales reports for staff, answered from the rollup tables in core.analytics.
+    
+    Every endpoint takes ?start= and ?end= dates (inclusive, default the last
+    30 days), and those read from rollups report how current they are in ``as_of``.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def date_param(self, request, name, default):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        parsed = parse_date(value)  # Raises ValueError for impossible dates like 2024-02-30
+        if parsed is None:
+            raise ValueError(value)
+        return parsed
+    
+    def date_range(self, request):
+        today = timezone.localdate()
+        return (
+            self.date_param(request, 'start', today - timedelta(days=29)),
+            self.date_param(request, 'end', today)
+        )
+    
+    def report(self, request, build, from_rollups=True):
+        try:
+            start, end = self.date_range(request)
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({'error': 'start must not be after end'}, status=status.HTTP_400_BAD_REQUEST)
+        report = {'start': start, 'end': end}
+        if from_rollups:
+            report['as_of'] = analytics.rollup_watermark()
+        report['results'] = build(start, end)
+        return Response(report)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        return self.report(request, analytics.summary)
+    
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        granularity = SalesRollup.HOUR if request.query_params.get('granularity') == 'hour' else SalesRollup.DAY
+        return self.report(request, lambda start, end: analytics.revenue_series(start, end, granularity))
+    
+    @action(detail=False, methods=['get'])
+    def pizzas(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 100))
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.report(request, lambda start, end: analytics.best_sellers(start, end, limit))
+    
+    @action(detail=False, methods=['get'])
+    def toppings(self, request):
+        return self.report(request, analytics.topping_attach_rates)
+    
+    @action(detail=False, methods=['get'])
+    def stages(self, request):
+        """Seconds orders spent Pending, Preparing and Out for Delivery: count, p50, p90 and p99.
+        
+        Read from the order status log rather than the rollups, so always current.
+        """
+        return self.report(request, lambda start, end: stage_latencies(*analytics.period_range(start, end)),
+                           from_rollups=False)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def metrics(request):
+    # Prometheus text format; counters are per worker process
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def update_profile(request):
-    user = request.user
-    profile = user.userprofile
+    # Update just the submitted columns; request.user is built from the token and never saved
+    user_fields = {name: request.data[name] for name in ('first_name', 'last_name', 'email') if name in request.data}
+    profile_fields = {name: request.data[name] for name in ('phone', 'address') if name in request.data}
     
-    user.first_name = request.data.get('first_name', user.first_name)
-    user.last_name = request.data.get('last_name', user.last_name)
-    user.email = request.data.get('email', user.email)
-    user.save()
+    if user_fields:
+        User.objects.filter(pk=request.user.pk).update(**user_fields)
+        forget_user_row(request.user.pk)
     
-    profile.phone = request.data.get('phone', profile.phone)
-    profile.address = request.data.get('address', profile.address)
-    profile.save()
+    if profile_fields:
+        # The profile id comes from the token; older tokens don't carry it
+        profile_id = getattr(request.user, 'profile_id', None)
+        lookup = {'pk': profile_id} if profile_id else {'user_id': request.user.pk}
+        UserProfile.objects.filter(**lookup).update(**profile_fields)
     
     return Response({'success': True})
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def change_password(request):
-    user = request.user
+    # Always the current row; the token's user may hold a cached password hash
+    user = User.objects.get(pk=request.user.pk)
     current_password = request.data.get('current_password')
     new_password = request.data.get('new_password')
     
-    if not user.check_password(current_password):
-        return Response({'error': 'Current password is incorrect'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    user.set_password(new_password)
-    user.save()
+    try:
+        if not get_hashing_pool().run(check_password, current_password, user.password):
+            return Response({'error': 'Current password is incorrect'}, status=status.HTTP_400_BAD_REQUEST)
+        user.password = hash_password(new_password)
+    except HashingBusy:
+        return hashing_busy()
+    user.save(update_fields=['password'])
     
     return Response({'success': True})
\ No newline at end of file